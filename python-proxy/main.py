@@ -1,6 +1,7 @@
 import os
 import uvicorn
 from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
@@ -9,15 +10,49 @@ from pydantic import BaseModel
 from typing import Optional, Dict, List, Any
 import time
 import asyncio
+from contextlib import asynccontextmanager
 
 # Load environment variables
 load_dotenv()
 
+from utils import http_pool, metrics, shared_state
+from utils.auth import validate_service_token
+
+METRICS_PUBLISH_INTERVAL = float(os.getenv("METRICS_PUBLISH_INTERVAL", "5"))  # seconds between worker metric snapshots
+
+# Application lifespan: shared resources are opened before serving and closed on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the shared upstream connection pool
+    await http_pool.start_pool()
+    
+    # Run router startup handlers (a custom lifespan replaces the default event runner)
+    await app.router.startup()
+    
+    # With several workers, each publishes its metrics to the shared store
+    publisher = None
+    if shared_state.store is not None:
+        publisher = asyncio.ensure_future(
+            shared_state.publish_metrics_periodically(metrics.registry.snapshot, METRICS_PUBLISH_INTERVAL)
+        )
+    
+    yield
+    
+    if publisher is not None:
+        publisher.cancel()
+    
+    # Run router shutdown handlers first so streams are closed before the pool
+    await app.router.shutdown()
+    await http_pool.close_pool()
+    if shared_state.store is not None:
+        shared_state.store.close()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Educational Platform API",
     description="Python implementation of AI and proxy functionality",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware configuration
@@ -27,8 +62,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Bare v2 responses carry the upstream status and headers in these
+    expose_headers=["x-bare-status", "x-bare-status-text", "x-bare-headers"],
 )
 
+# Request latency, byte and in-flight metrics for every HTTP request
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -50,6 +90,19 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": time.time()}
 
+# Prometheus scrape endpoint; labels include upstream hosts, so it needs the service token
+@app.get("/metrics")
+async def prometheus_metrics(is_valid_service: bool = Depends(validate_service_token)):
+    if not is_valid_service:
+        raise HTTPException(status_code=403, detail="Invalid service token")
+    snapshot = metrics.registry.snapshot()
+    if shared_state.store is not None:
+        # Report every live worker, not just the one that took the scrape
+        await asyncio.to_thread(shared_state.store.publish_metrics, snapshot)
+        snapshots = await asyncio.to_thread(shared_state.store.worker_metrics, METRICS_PUBLISH_INTERVAL * 3)
+        snapshot = metrics.merge_snapshots(snapshots)
+    return PlainTextResponse(metrics.render_snapshot(snapshot), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
     port = 6078
     
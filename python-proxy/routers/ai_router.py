@@ -12,6 +12,8 @@ from datetime import datetime, timedelta
 import asyncio
 import hashlib
 from utils.auth import verify_token, get_user_id, get_optional_user_id, validate_service_token
+from utils import metrics, shared_state
+from utils.json_codec import FastJSONResponse
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -76,11 +78,11 @@ ERROR_TYPES = {
     "UNKNOWN": "UNKNOWN"
 }
 
-# Session and rate limiting in-memory stores
-# In production, use a proper database
+# Session and rate limiting stores
+# Rate limits and conversations are shared across workers when SHARED_STATE_PATH is set
 chat_sessions = {}
-rate_limits = {}
-conversation_history = {}
+rate_limits = shared_state.namespace("rate_limits")
+conversation_history = shared_state.namespace("conversations")
 
 # Performance metrics
 ai_metrics = {
@@ -89,10 +91,32 @@ ai_metrics = {
     "failed_requests": 0,
     "rate_limited_requests": 0,
     "tokens_processed": 0,
-    "response_times": [],
     "start_time": time.time()
 }
 
+# Estimated tokens per model; response times live in the shared request histogram
+AI_TOKENS = metrics.registry.register(metrics.Counter(
+    "ai_tokens_total",
+    "Estimated tokens processed by the AI chat endpoint",
+    ("model", "direction")
+))
+
+# Helper function to report AI counters to the Prometheus endpoint at scrape time
+def collect_ai_metrics():
+    yield ("ai_requests_total", "counter", "AI chat requests by outcome", {"outcome": "success"}, ai_metrics["successful_requests"])
+    yield ("ai_requests_total", "counter", "AI chat requests by outcome", {"outcome": "failure"}, ai_metrics["failed_requests"])
+    yield ("ai_rate_limited_total", "counter", "AI requests refused by the rate limiter", {}, ai_metrics["rate_limited_requests"])
+
+# Conversation store size, refreshed by the periodic cleanup and the metrics endpoint rather than counted per scrape
+conversation_stats = {"count": 0}
+
+# Helper function to report the conversation store size, the same in every worker when shared
+def collect_conversation_metrics():
+    yield ("ai_conversations", "gauge", "Stored AI conversations", {}, conversation_stats["count"])
+
+metrics.registry.add_collector(collect_ai_metrics)
+metrics.registry.add_collector(collect_conversation_metrics, aggregate="max")
+
 # Configure constants from environment variables with defaults
 SESSION_TIMEOUT = int(os.getenv("SESSION_TIMEOUT", "3600"))  # 1 hour in seconds
 RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "60"))  # 1 minute window
@@ -126,74 +150,76 @@ def initialize_gemini():
         raise HTTPException(status_code=500, detail=f"Failed to initialize Gemini API: {str(e)}")
 
 # Helper: Check rate limiting
-def is_rate_limited(user_id: str) -> Dict[str, Any]:
+async def is_rate_limited(user_id: str) -> Dict[str, Any]:
     now = time.time()
     
-    # Initialize rate limiting for new users
-    if user_id not in rate_limits:
-        rate_limits[user_id] = {
-            "count": 1,
-            "window_start": now,
-            "limited": False,
-            "remaining_requests": MAX_REQUESTS_PER_WINDOW - 1,
-            "reset_time": now + RATE_LIMIT_WINDOW,
-            "consecutive_windows": 0,
-            "last_request": now
-        }
-        logger.info(f"New user {user_id} added to rate limiting")
-        return rate_limits[user_id]
-    
-    user_limit = rate_limits[user_id]
-    
-    # Reset window if it's expired
-    if now - user_limit["window_start"] > RATE_LIMIT_WINDOW:
-        # Check if this is consecutive rate limiting
-        if user_limit["count"] >= MAX_REQUESTS_PER_WINDOW:
-            user_limit["consecutive_windows"] += 1
-            logger.warning(f"User {user_id} hit rate limit for {user_limit['consecutive_windows']} consecutive windows")
-        else:
-            user_limit["consecutive_windows"] = 0
-        
-        user_limit["count"] = 1
-        user_limit["window_start"] = now
-        user_limit["limited"] = False
-        user_limit["remaining_requests"] = MAX_REQUESTS_PER_WINDOW - 1
-        user_limit["reset_time"] = now + RATE_LIMIT_WINDOW
-        user_limit["last_request"] = now
-        return user_limit
-    
-    # Check if user has exceeded limit
-    if user_limit["count"] >= MAX_REQUESTS_PER_WINDOW:
-        user_limit["limited"] = True
-        user_limit["remaining_requests"] = 0
+    def advance(user_limit: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        # Initialize rate limiting for new users
+        if user_limit is None:
+            user_limit = {
+                "count": 1,
+                "window_start": now,
+                "limited": False,
+                "remaining_requests": MAX_REQUESTS_PER_WINDOW - 1,
+                "reset_time": now + RATE_LIMIT_WINDOW,
+                "consecutive_windows": 0,
+                "last_request": now
+            }
+            logger.info(f"New user {user_id} added to rate limiting")
+            return user_limit
         
-        # Update metrics
-        ai_metrics["rate_limited_requests"] += 1
+        # Reset window if it's expired
+        if now - user_limit["window_start"] > RATE_LIMIT_WINDOW:
+            # Check if this is consecutive rate limiting
+            if user_limit["count"] >= MAX_REQUESTS_PER_WINDOW:
+                user_limit["consecutive_windows"] += 1
+                logger.warning(f"User {user_id} hit rate limit for {user_limit['consecutive_windows']} consecutive windows")
+            else:
+                user_limit["consecutive_windows"] = 0
+        
+            user_limit["count"] = 1
+            user_limit["window_start"] = now
+            user_limit["limited"] = False
+            user_limit["remaining_requests"] = MAX_REQUESTS_PER_WINDOW - 1
+            user_limit["reset_time"] = now + RATE_LIMIT_WINDOW
+            user_limit["last_request"] = now
+            return user_limit
         
-        logger.warning(f"User {user_id} rate limited: {user_limit['count']} requests in {now - user_limit['window_start']:.2f} seconds")
-        return user_limit
-    
-    # Check for burst protection (optional, can be disabled)
-    min_request_interval = 1.0  # 1 second between requests
-    if now - user_limit.get("last_request", 0) < min_request_interval:
-        # Too many requests in a very short time
-        if user_limit.get("burst_count", 0) > 5:
+        # Check if user has exceeded limit
+        if user_limit["count"] >= MAX_REQUESTS_PER_WINDOW:
             user_limit["limited"] = True
             user_limit["remaining_requests"] = 0
-            user_limit["burst_limited"] = True
-            logger.warning(f"User {user_id} burst rate limited: too many requests in rapid succession")
+        
+            # Update metrics
+            ai_metrics["rate_limited_requests"] += 1
+        
+            logger.warning(f"User {user_id} rate limited: {user_limit['count']} requests in {now - user_limit['window_start']:.2f} seconds")
             return user_limit
+        
+        # Check for burst protection (optional, can be disabled)
+        min_request_interval = 1.0  # 1 second between requests
+        if now - user_limit.get("last_request", 0) < min_request_interval:
+            # Too many requests in a very short time
+            if user_limit.get("burst_count", 0) > 5:
+                user_limit["limited"] = True
+                user_limit["remaining_requests"] = 0
+                user_limit["burst_limited"] = True
+                logger.warning(f"User {user_id} burst rate limited: too many requests in rapid succession")
+                return user_limit
+            else:
+                user_limit["burst_count"] = user_limit.get("burst_count", 0) + 1
         else:
-            user_limit["burst_count"] = user_limit.get("burst_count", 0) + 1
-    else:
-        user_limit["burst_count"] = 0
+            user_limit["burst_count"] = 0
+        
+        # Increment counter and update remaining
+        user_limit["count"] += 1
+        user_limit["remaining_requests"] = MAX_REQUESTS_PER_WINDOW - user_limit["count"]
+        user_limit["limited"] = False
+        user_limit["last_request"] = now
+        return user_limit
     
-    # Increment counter and update remaining
-    user_limit["count"] += 1
-    user_limit["remaining_requests"] = MAX_REQUESTS_PER_WINDOW - user_limit["count"]
-    user_limit["limited"] = False
-    user_limit["last_request"] = now
-    return user_limit
+    # Read-modify-write in one step so workers sharing the counters cannot interleave
+    return await rate_limits.update(user_id, advance)
 
 # Helper: Generate a unique conversation ID
 def generate_conversation_id(user_id: str) -> str:
@@ -270,44 +296,54 @@ def determine_error_type(error) -> str:
     return ERROR_TYPES["UNKNOWN"]
 
 # Helper: Store conversation history
-def store_conversation(user_id: str, conversation_id: str, message: str, response: str, model: str, system_prompt: Optional[str] = None) -> None:
-    if conversation_id not in conversation_history:
-        # Create new conversation
-        conversation_history[conversation_id] = {
-            "conversation_id": conversation_id,
-            "user_id": user_id,
-            "messages": [],
-            "model": model,
-            "system_prompt": system_prompt,
-            "created_at": time.time(),
-            "updated_at": time.time()
-        }
-    
-    # Add message and response to history
-    conversation_history[conversation_id]["messages"].append({
-        "role": "user",
-        "content": message,
-        "timestamp": time.time()
-    })
-    
-    conversation_history[conversation_id]["messages"].append({
-        "role": "assistant",
-        "content": response,
-        "timestamp": time.time()
-    })
-    
-    # Update timestamp
-    conversation_history[conversation_id]["updated_at"] = time.time()
-    
-    # Limit conversation history size
-    if len(conversation_history[conversation_id]["messages"]) > MAX_CONVERSATION_HISTORY * 2:
-        # Remove oldest messages but keep system prompt if present
-        conversation_history[conversation_id]["messages"] = \
-            conversation_history[conversation_id]["messages"][-MAX_CONVERSATION_HISTORY * 2:]
+async def store_conversation(user_id: str, conversation_id: str, message: str, response: str, model: str, system_prompt: Optional[str] = None) -> None:
+    def append_exchange(conversation: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        if conversation is None:
+            # Create new conversation; the stored count catches up at the next refresh
+            conversation_stats["count"] += 1
+            conversation = {
+                "conversation_id": conversation_id,
+                "user_id": user_id,
+                "messages": [],
+                "model": model,
+                "system_prompt": system_prompt,
+                "created_at": time.time(),
+                "updated_at": time.time()
+            }
+        
+        # Add message and response to history
+        conversation["messages"].append({
+            "role": "user",
+            "content": message,
+            "timestamp": time.time()
+        })
+        
+        conversation["messages"].append({
+            "role": "assistant",
+            "content": response,
+            "timestamp": time.time()
+        })
+        
+        # Update timestamp
+        conversation["updated_at"] = time.time()
+        
+        # Limit conversation history size
+        if len(conversation["messages"]) > MAX_CONVERSATION_HISTORY * 2:
+            # Remove oldest messages but keep system prompt if present
+            conversation["messages"] = conversation["messages"][-MAX_CONVERSATION_HISTORY * 2:]
+        return conversation
+    
+    # Appended in one step so concurrent replies from different workers are both kept
+    await conversation_history.update(conversation_id, append_exchange)
 
 # Helper: Get conversation history
-def get_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
-    return conversation_history.get(conversation_id)
+async def get_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
+    return await conversation_history.get(conversation_id)
+
+# Helper: Recount stored conversations for the metrics gauge
+async def refresh_conversation_count() -> int:
+    conversation_stats["count"] = await conversation_history.count()
+    return conversation_stats["count"]
 
 # Helper: Clean up old sessions
 async def cleanup_old_sessions():
@@ -325,47 +361,30 @@ async def cleanup_old_sessions():
 
 # Helper: Clean up old rate limits
 async def cleanup_rate_limits():
-    now = time.time()
-    expired_keys = []
-    
-    for user_id, rate_data in rate_limits.items():
-        if now - rate_data["window_start"] > RATE_LIMIT_WINDOW * 10:
-            expired_keys.append(user_id)
-    
-    for key in expired_keys:
-        del rate_limits[key]
+    # One delete in the store rather than reading every counter back
+    expired = await rate_limits.expire("window_start", time.time() - RATE_LIMIT_WINDOW * 10)
     
-    logger.info(f"Cleaned up {len(expired_keys)} expired rate limits")
+    logger.info(f"Cleaned up {expired} expired rate limits")
 
 # Helper: Clean up old conversations
 async def cleanup_old_conversations():
-    now = time.time()
-    expired_keys = []
-    
     # Keep conversations for 7 days
     conversation_timeout = 7 * 24 * 60 * 60  # 7 days in seconds
     
-    for conversation_id, conversation in conversation_history.items():
-        if now - conversation["updated_at"] > conversation_timeout:
-            expired_keys.append(conversation_id)
+    expired = await conversation_history.expire("updated_at", time.time() - conversation_timeout)
+    await refresh_conversation_count()
     
-    for key in expired_keys:
-        del conversation_history[key]
-    
-    logger.info(f"Cleaned up {len(expired_keys)} expired conversations")
+    logger.info(f"Cleaned up {expired} expired conversations")
 
-# Helper: Calculate average response time
-def calculate_average_response_time() -> float:
-    if not ai_metrics["response_times"]:
-        return 0.0
-    
-    # Only consider the last 100 response times to avoid skew from old data
-    recent_times = ai_metrics["response_times"][-100:]
-    return sum(recent_times) / len(recent_times)
+# Helper: Summarize successful chat response times from the shared request histogram
+def response_time_summary(request: Request) -> Dict[str, float]:
+    route = request.app.url_path_for("generate_chat_response")
+    return metrics.REQUEST_DURATION.summary(route=route, status_class="2xx")
 
 # AI chat endpoint
 @router.post("/chat", response_model=ChatResponse)
 async def generate_chat_response(
+    request: Request,
     message_data: ChatMessage,
     user_id: str = Depends(get_user_id),
     x_request_id: Optional[str] = Header(None),
@@ -375,12 +394,12 @@ async def generate_chat_response(
     request_id = x_request_id or f"req_{time.time()}_{id(message_data)}"
     logger.info(f"Generating chat response for user {user_id} (ID: {request_id})")
     
-    # Update metrics
+    # Update metrics; the model labels this request's latency histogram
     ai_metrics["total_requests"] += 1
-    start_time = time.time()
+    request.state.model = message_data.model or DEFAULT_MODEL
     
     # Check rate limiting
-    rate_status = is_rate_limited(user_id)
+    rate_status = await is_rate_limited(user_id)
     if rate_status["limited"]:
         logger.warning(f"Rate limit exceeded for user: {user_id}, consecutive windows: {rate_status['consecutive_windows']}")
         
@@ -415,7 +434,7 @@ async def generate_chat_response(
         existing_conversation = None
         
         if conversation_id:
-            existing_conversation = get_conversation(conversation_id)
+            existing_conversation = await get_conversation(conversation_id)
             if existing_conversation and existing_conversation["user_id"] != user_id:
                 # Conversation exists but belongs to another user
                 logger.warning(f"User {user_id} attempted to access conversation {conversation_id} belonging to user {existing_conversation['user_id']}")
@@ -479,7 +498,7 @@ async def generate_chat_response(
         response_text = response.text
         
         # Store conversation in history
-        store_conversation(
+        await store_conversation(
             user_id=user_id,
             conversation_id=conversation_id,
             message=message_data.message,
@@ -488,12 +507,6 @@ async def generate_chat_response(
             system_prompt=system_prompt
         )
         
-        # Calculate response time
-        response_time = time.time() - start_time
-        ai_metrics["response_times"].append(response_time)
-        if len(ai_metrics["response_times"]) > 1000:  # Limit size
-            ai_metrics["response_times"] = ai_metrics["response_times"][-1000:]
-        
         # Update metrics
         ai_metrics["successful_requests"] += 1
         
@@ -502,24 +515,26 @@ async def generate_chat_response(
         output_tokens = len(response_text.split()) * 1.3  # Rough estimate
         total_tokens = input_tokens + output_tokens
         ai_metrics["tokens_processed"] += int(total_tokens)
+        AI_TOKENS.labels(model_name, "input").inc(int(input_tokens))
+        AI_TOKENS.labels(model_name, "output").inc(int(output_tokens))
         
-        # Schedule background cleanup
+        # Schedule background cleanup; stored conversations expire on the periodic cleanup
         background_tasks.add_task(cleanup_old_sessions)
-        background_tasks.add_task(cleanup_old_conversations)
         
-        # Return response
-        return ChatResponse(
-            response=response_text,
-            conversation_id=conversation_id,
-            tokens={
+        # Return response; the fields are built here, so ChatResponse validation is skipped
+        return FastJSONResponse(content={
+            "response": response_text,
+            "conversation_id": conversation_id,
+            "tokens": {
                 "input": int(input_tokens),
                 "output": int(output_tokens),
                 "total": int(total_tokens)
             },
-            model=model_name,
-            hasError=False,
-            timestamp=time.time()
-        )
+            "model": model_name,
+            "hasError": False,
+            "errorType": None,
+            "timestamp": time.time()
+        })
         
     except Exception as e:
         logger.error(f"Error generating response: {str(e)}")
@@ -532,7 +547,7 @@ async def generate_chat_response(
         fallback = get_fallback_response(error_type, user_id)
         
         # Return error response with appropriate status code
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=fallback["status_code"],
             content={
                 "response": fallback["response"],
@@ -570,14 +585,13 @@ async def get_suggested_topics(
         )
         
         # Generate suggested topics based on user context if available
-        if user_id and user_id in conversation_history:
-            # Get recent user conversations to personalize topics
+        if user_id and await conversation_history.contains(user_id):
+            # Get recent user conversations to personalize topics, selected by the store
             recent_messages = []
-            for conv_id, conv in conversation_history.items():
-                if conv["user_id"] == user_id:
-                    for msg in conv["messages"][-10:]:  # Get last 10 messages
-                        if msg["role"] == "user":
-                            recent_messages.append(msg["content"])
+            for conv in await conversation_history.find("user_id", user_id):
+                for msg in conv["messages"][-10:]:  # Get last 10 messages
+                    if msg["role"] == "user":
+                        recent_messages.append(msg["content"])
             
             if recent_messages:
                 # Create a personalized prompt
@@ -600,21 +614,21 @@ async def get_suggested_topics(
         # Limit to 5 topics
         topics = topics[:5]
         
-        return TopicsResponse(topics=topics, timestamp=time.time())
+        return FastJSONResponse(content={"topics": topics, "timestamp": time.time()})
     
     except Exception as e:
         logger.error(f"Error generating topics: {str(e)}")
         # Fallback topics
-        return TopicsResponse(
-            topics=[
+        return FastJSONResponse(content={
+            "topics": [
                 "Mathematics and Problem Solving",
                 "Science and Technology Innovations",
                 "Historical Events and Their Impact",
                 "Literature and Creative Writing",
                 "Computer Science and Programming"
             ],
-            timestamp=time.time()
-        )
+            "timestamp": time.time()
+        })
 
 # Get AI metrics endpoint
 @router.get("/metrics")
@@ -630,7 +644,7 @@ async def get_ai_metrics(
     
     # Calculate metrics
     uptime = time.time() - ai_metrics["start_time"]
-    avg_response_time = calculate_average_response_time()
+    response_times = response_time_summary(request)
     
     return {
         "total_requests": ai_metrics["total_requests"],
@@ -638,11 +652,14 @@ async def get_ai_metrics(
         "failed_requests": ai_metrics["failed_requests"],
         "rate_limited_requests": ai_metrics["rate_limited_requests"],
         "tokens_processed": ai_metrics["tokens_processed"],
-        "average_response_time": avg_response_time,
+        "average_response_time": response_times["mean"],
+        "response_time_p50": response_times["p50"],
+        "response_time_p95": response_times["p95"],
+        "response_time_p99": response_times["p99"],
         "uptime_seconds": uptime,
         "requests_per_minute": (ai_metrics["total_requests"] / (uptime / 60)) if uptime > 0 else 0,
         "success_rate": (ai_metrics["successful_requests"] / max(1, ai_metrics["total_requests"])) * 100,
-        "conversation_count": len(conversation_history),
+        "conversation_count": await refresh_conversation_count(),
         "timestamp": time.time()
     }
 
@@ -653,7 +670,7 @@ async def get_conversation_history(
     user_id: str = Depends(get_user_id)
 ):
     # Get conversation
-    conversation = get_conversation(conversation_id)
+    conversation = await get_conversation(conversation_id)
     
     # Check if conversation exists
     if not conversation:
@@ -670,7 +687,7 @@ async def get_conversation_history(
         )
     
     # Return conversation history
-    return conversation
+    return FastJSONResponse(content=conversation)
 
 # Clear conversation history endpoint
 @router.delete("/conversations/{conversation_id}")
@@ -679,7 +696,7 @@ async def clear_conversation_history(
     user_id: str = Depends(get_user_id)
 ):
     # Get conversation
-    conversation = get_conversation(conversation_id)
+    conversation = await get_conversation(conversation_id)
     
     # Check if conversation exists
     if not conversation:
@@ -696,7 +713,7 @@ async def clear_conversation_history(
         )
     
     # Delete conversation
-    del conversation_history[conversation_id]
+    await conversation_history.pop(conversation_id, None)
     
     return {"success": True, "message": "Conversation deleted successfully"}
 
@@ -720,6 +737,12 @@ async def startup_event():
     except Exception as e:
         logger.error(f"Failed to initialize AI Router: {str(e)}")
     
+    # Seed the conversation gauge; the periodic cleanup keeps it current
+    try:
+        await refresh_conversation_count()
+    except Exception as e:
+        logger.warning(f"Could not count stored conversations: {str(e)}")
+    
     # Start periodic cleanup
     asyncio.create_task(periodic_cleanup())
 
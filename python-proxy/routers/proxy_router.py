@@ -1,17 +1,49 @@
-from fastapi import APIRouter, Request, Response, HTTPException, status, Depends, Header
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import APIRouter, Request, Response, HTTPException, status, Depends, Header, WebSocket
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
 from fastapi.encoders import jsonable_encoder
 import httpx
+import websockets
 import asyncio
 import time
 import os
 import json
 import base64
 import hashlib
-from typing import Dict, Any, List, Optional, Union
-from pydantic import BaseModel, Field
+import math
+import struct
+from contextlib import AsyncExitStack
+from typing import Dict, Any, List, Optional, Set, Union, Mapping, Callable, Awaitable, Tuple
+from pydantic import BaseModel, Field, ValidationError, TypeAdapter
 import logging
 from utils.auth import get_optional_user_id, validate_service_token
+from utils import http_pool, metrics, shared_state, json_codec
+from utils.cache import LRUCache, TinyLFUCache, FrequencySketch, HeavyHitters
+from utils.disk_cache import DiskCache, read_body_file
+from utils.cache_snapshot import CacheSnapshot, SnapshotEntry, write_snapshot
+from utils.singleflight import SingleFlight
+from utils.stream_fill import StreamFills, CacheFill, FillAbandoned, decoded_body_headers
+from utils.prefetch import SubresourceScanner, Prefetcher, ACCEPT_BY_KIND
+from utils.warmup import WarmJob, TokenBucket, build_games_manifest
+from utils.circuit_breaker import HostUnavailable
+from utils.deadline import (
+    Deadline, DeadlineExceeded, send_within, stream_within, deadline_metrics,
+    CONNECT_TIMEOUT, READ_TIMEOUT, POOL_TIMEOUT, MAX_DEADLINE
+)
+from utils.admission import AdmissionController, Overloaded, PRIORITY_INTERACTIVE, PRIORITY_BULK, PRIORITY_NAMES
+from utils.ws_tunnel import WebSocketTunnel, tunnel_metrics
+from utils.spool import SpooledBody, BodyTooLarge, buffer_metrics, check_body_size, declared_length, write_json_envelope
+from utils.compression import (
+    available_encodings, is_compressible, compress, decompress, negotiate_encoding, accepts_encoding
+)
+from utils.http_range import (
+    parse_range, resolve_range, parse_content_range, content_range, strong_validator, if_range_matches
+)
+from utils.http_cache import (
+    get_header, parse_cache_control, parse_vary, is_cacheable, has_validators,
+    freshness_lifetime, stale_allowances, conditional_headers, has_client_conditionals,
+    merge_not_modified_headers, shareable_headers, UNSHARED_RESPONSE_HEADERS
+)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -24,12 +56,176 @@ router = APIRouter()
 DEFAULT_TIMEOUT = float(os.getenv('PROXY_TIMEOUT', '30.0'))  # seconds
 MAX_REDIRECTS = int(os.getenv('MAX_REDIRECTS', '10'))
 MAX_REQUEST_SIZE = int(os.getenv('MAX_REQUEST_SIZE', '31457280'))  # 30MB
+SPOOL_THRESHOLD = int(os.getenv('PROXY_SPOOL_THRESHOLD', '1048576'))  # buffer bodies in memory up to 1MB
+SPOOL_DIR = os.getenv('PROXY_SPOOL_DIR') or None  # system temp directory by default
 ENABLE_CACHING = os.getenv('ENABLE_PROXY_CACHE', 'false').lower() == 'true'
-CACHE_TTL = int(os.getenv('PROXY_CACHE_TTL', '300'))  # 5 minutes in seconds
+CACHE_TTL = int(os.getenv('PROXY_CACHE_TTL', '300'))  # default freshness when upstream sends none, in seconds
+CACHE_STALE_WHILE_REVALIDATE = float(os.getenv('PROXY_CACHE_STALE_WHILE_REVALIDATE', '60'))  # seconds
+CACHE_STALE_IF_ERROR = float(os.getenv('PROXY_CACHE_STALE_IF_ERROR', '300'))  # seconds
+CACHE_MAX_BYTES = int(os.getenv('PROXY_CACHE_MAX_BYTES', '67108864'))  # 64MB
+CACHE_MAX_ENTRIES = int(os.getenv('PROXY_CACHE_MAX_ENTRIES', '10000'))
+CACHE_MAX_OBJECT_BYTES = int(os.getenv('PROXY_CACHE_MAX_OBJECT_BYTES', '5242880'))  # 5MB
+CACHE_WINDOW_RATIO = float(os.getenv('PROXY_CACHE_WINDOW_RATIO', '0.01'))  # share of the budget admitted without a frequency check
+CACHE_HOT_TRACKED = int(os.getenv('PROXY_CACHE_HOT_TRACKED', '64'))  # candidate keys and hosts kept for the hottest lists
+CACHE_COMPRESSION = os.getenv('PROXY_CACHE_COMPRESSION', 'true').lower() == 'true'
+COMPRESSION_LEVEL = int(os.getenv('PROXY_COMPRESSION_LEVEL', '6'))
+COMPRESSION_MIN_BYTES = int(os.getenv('PROXY_COMPRESSION_MIN_BYTES', '1024'))
+COMPRESSION_THREAD_BYTES = 262144  # compress larger bodies off the event loop
+DISK_CACHE_DIR = os.getenv('PROXY_DISK_CACHE_DIR', '')  # empty disables the disk tier
+DISK_CACHE_MAX_BYTES = int(os.getenv('PROXY_DISK_CACHE_MAX_BYTES', '536870912'))  # 512MB
+DISK_CACHE_MAX_OBJECT_BYTES = int(os.getenv('PROXY_DISK_CACHE_MAX_OBJECT_BYTES', '104857600'))  # 100MB
+CACHE_SNAPSHOT_PATH = os.getenv('PROXY_CACHE_SNAPSHOT_PATH', '')  # empty disables warm-restart snapshots
+CACHE_SNAPSHOT_INTERVAL = float(os.getenv('PROXY_CACHE_SNAPSHOT_INTERVAL', '300'))  # seconds between snapshots, 0 for shutdown only
+CACHE_SNAPSHOT_BATCH = 64  # entries restored per event loop turn
+BATCH_MAX_ITEMS = int(os.getenv('PROXY_BATCH_MAX_ITEMS', '100'))
+BATCH_CONCURRENCY = int(os.getenv('PROXY_BATCH_CONCURRENCY', '6'))  # per batch, like a browser's per-host limit
+BATCH_MAX_CONCURRENCY = int(os.getenv('PROXY_BATCH_MAX_CONCURRENCY', '16'))
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv('PROXY_MAX_IN_FLIGHT', '256'))  # proxied requests doing upstream work at once, 0 for no limit
+ADMISSION_MAX_QUEUE = int(os.getenv('PROXY_ADMISSION_MAX_QUEUE', '512'))  # requests waiting for a slot before new ones are shed
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('PROXY_ADMISSION_QUEUE_TIMEOUT', '5.0'))  # seconds
+ADMISSION_BULK_SHARE = float(os.getenv('PROXY_ADMISSION_BULK_SHARE', '0.5'))  # share of the slots /stream downloads may hold
+PREFETCH_ENABLED = os.getenv('PROXY_PREFETCH', 'false').lower() == 'true'
+PREFETCH_PER_PAGE = int(os.getenv('PROXY_PREFETCH_PER_PAGE', '16'))  # subresources warmed per HTML page
+PREFETCH_CONCURRENCY = int(os.getenv('PROXY_PREFETCH_CONCURRENCY', '4'))  # prefetches running at once across all pages
+PREFETCH_MAX_PENDING = int(os.getenv('PROXY_PREFETCH_MAX_PENDING', '64'))  # queued prefetches before new URLs are dropped
+PREFETCH_SCAN_BYTES = int(os.getenv('PROXY_PREFETCH_SCAN_BYTES', '262144'))  # 256KB of each page scanned
+RANGE_CACHE_ENABLED = os.getenv('PROXY_RANGE_CACHE', 'true').lower() == 'true'
+RANGE_CHUNK_SIZE = int(os.getenv('PROXY_RANGE_CHUNK_SIZE', '1048576'))  # 1MB cached chunks of large objects
+RANGE_MAX_SPAN = int(os.getenv('PROXY_RANGE_MAX_SPAN', '8388608'))  # 8MB returned for an open-ended range
+STREAM_REPLAY_CHUNK = 65536  # bytes per chunk frame when a stream is answered from the cache
+WARM_CONCURRENCY = int(os.getenv('PROXY_WARM_CONCURRENCY', '2'))  # fetches per warm-up job by default
+WARM_MAX_CONCURRENCY = int(os.getenv('PROXY_WARM_MAX_CONCURRENCY', '4'))  # warm-up fetches at once across all jobs
+WARM_BANDWIDTH = int(os.getenv('PROXY_WARM_BANDWIDTH', '5242880'))  # bytes per second per job, 0 for no limit
+WARM_MAX_URLS = int(os.getenv('PROXY_WARM_MAX_URLS', '5000'))
+WARM_MAX_JOBS = 20  # job statuses kept
+WARM_YIELD_IN_FLIGHT = int(os.getenv('PROXY_WARM_YIELD_IN_FLIGHT', '50'))  # upstream requests in flight before warm-up pauses
+WARM_YIELD_DELAY = 0.2  # seconds between checks while live traffic is busy
+GAMES_DIR = os.getenv('PROXY_GAMES_DIR') or os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'games')
+WS_IDLE_TIMEOUT = float(os.getenv('PROXY_WS_IDLE_TIMEOUT', '300'))  # seconds without frames in either direction
+WS_MAX_BYTES = int(os.getenv('PROXY_WS_MAX_BYTES', '104857600'))  # 100MB relayed per tunnel
+WS_MAX_MESSAGE_BYTES = int(os.getenv('PROXY_WS_MAX_MESSAGE_BYTES', '1048576'))  # 1MB per frame
+WS_QUEUE_SIZE = int(os.getenv('PROXY_WS_QUEUE_SIZE', '16'))  # upstream frames buffered before reads pause
+
+# Length-prefixed stream framing: 1-byte frame type, 4-byte big-endian payload length, payload
+FRAMED_MEDIA_TYPE = "application/x-bare-frames"
+FRAME_HEADERS = 0x01
+FRAME_CHUNK = 0x02
+FRAME_END = 0x03
+FRAME_ERROR = 0x04
+FRAME_PREFIX = struct.Struct("!BI")
+
+# Bare v2 raw protocol: upstream headers that are copied onto the response by default
+BARE_PASS_HEADERS = ['content-type', 'content-encoding', 'content-length', 'last-modified', 'etag']
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate",
+    "proxy-authorization", "te", "trailers",
+    "transfer-encoding", "upgrade"
+}
+
+# Headers of a ranged response that describe the transfer rather than the object
+RANGE_TRANSFER_HEADERS = {
+    "content-range", "content-length", "content-encoding", "transfer-encoding", "accept-ranges"
+}
+
+# Page request headers not copied onto prefetches: credentials, conditionals and body headers
+PREFETCH_DROPPED_HEADERS = {
+    "cookie", "authorization", "range", "if-range", "if-none-match", "if-modified-since",
+    "if-match", "if-unmodified-since", "content-type", "content-length", "accept",
+    "cache-control", "pragma", "host", "referer"
+}
 
 # In-memory caches
 active_connections: Dict[str, Any] = {}
-response_cache: Dict[str, Dict[str, Any]] = {}
+response_cache = TinyLFUCache(
+    max_bytes=CACHE_MAX_BYTES,
+    max_entries=CACHE_MAX_ENTRIES,
+    max_object_bytes=CACHE_MAX_OBJECT_BYTES,
+    window_ratio=CACHE_WINDOW_RATIO
+)
+disk_cache: Optional[DiskCache] = DiskCache(
+    directory=DISK_CACHE_DIR,
+    max_bytes=DISK_CACHE_MAX_BYTES,
+    max_object_bytes=DISK_CACHE_MAX_OBJECT_BYTES
+) if DISK_CACHE_DIR else None
+
+# Fields kept on cache entries that are not part of the client envelope
+ENTRY_ONLY_FIELDS = {'expires_at', 'stale_while_revalidate', 'stale_if_error', 'body_encoding', 'body_charset'}
+
+# Recent 5xx responses, answered again for a short time instead of hitting a failing upstream
+negative_cache = LRUCache(
+    max_bytes=int(os.getenv('PROXY_NEGATIVE_CACHE_MAX_BYTES', '4194304')),  # 4MB
+    max_entries=1000,
+    max_object_bytes=262144
+)
+
+# Most requested cache keys and upstream hosts, estimated from frequency sketches
+hot_keys = HeavyHitters(response_cache.sketch, CACHE_HOT_TRACKED)
+host_frequency = FrequencySketch(1024)
+hot_hosts = HeavyHitters(host_frequency, CACHE_HOT_TRACKED)
+
+# Partial content served from cached chunks of large objects
+range_metrics = {
+    "requests": 0,
+    "served": 0,
+    "unsatisfiable": 0,
+    "fallbacks": 0,
+    "chunk_hits": 0,
+    "chunk_misses": 0,
+    "upstream_fetches": 0,
+    "bytes_from_cache": 0,
+    "bytes_from_upstream": 0,
+    "cache_rejected": 0
+}
+
+# Background warming of the subresources found in proxied HTML pages
+prefetcher = Prefetcher(PREFETCH_CONCURRENCY, PREFETCH_MAX_PENDING)
+
+# Background cache warm-up jobs; statuses are shared so any worker can report them
+warm_jobs: Dict[str, WarmJob] = {}
+warm_status = shared_state.namespace("cache_warm")
+warm_semaphore = asyncio.Semaphore(WARM_MAX_CONCURRENCY)
+warm_metrics = {
+    "fetches": 0,
+    "bytes": 0,
+    "yields": 0
+}
+
+# Warm-restart snapshot of the memory tier: the file being restored from and the periodic writer
+cache_snapshot: Optional[CacheSnapshot] = None
+snapshot_tasks: Set[asyncio.Task] = set()
+snapshot_metrics = {
+    "restored": 0,
+    "restored_on_demand": 0,
+    "restore_seconds": None,
+    "written": 0,
+    "written_bytes": 0,
+    "written_at": None,
+    "write_seconds": None,
+    "write_errors": 0
+}
+
+# Global cap on requests doing upstream work; cache hits never take a slot
+admission = AdmissionController(
+    max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+    max_queue=ADMISSION_MAX_QUEUE,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+    bulk_share=ADMISSION_BULK_SHARE
+)
+
+# Concurrent identical cache misses share one upstream request
+upstream_flights = SingleFlight()
+
+# Deadlines of the shared upstream fetches started by client requests, by cache key
+flight_deadlines: Dict[str, Deadline] = {}
+
+# Streamed responses being copied into the cache, which concurrent streams of the same key follow
+stream_fills = StreamFills(CACHE_MAX_OBJECT_BYTES)
+
+# Background stale-while-revalidate refreshes
+refresh_tasks: Set[asyncio.Task] = set()
+
+# Pending writes to the cache tier shared between workers
+shared_cache_tasks: Set[asyncio.Task] = set()
 
 # Performance metrics
 request_metrics = {
@@ -40,6 +236,43 @@ request_metrics = {
     "start_time": time.time()
 }
 
+# Helper function to report proxy gauges to the Prometheus endpoint at scrape time
+def collect_proxy_metrics():
+    pool = http_pool.pool_metrics
+    yield ("proxy_cache_entries", "gauge", "Entries in the in-memory response cache", {}, len(response_cache))
+    yield ("proxy_cache_bytes", "gauge", "Estimated bytes held by the in-memory response cache", {}, response_cache.bytes)
+    yield ("proxy_cache_admissions_total", "counter", "Window entries offered to the main cache region", {"result": "admitted"}, response_cache.counters["admitted"])
+    yield ("proxy_cache_admissions_total", "counter", "Window entries offered to the main cache region", {"result": "rejected"}, response_cache.counters["admission_rejected"])
+    if disk_cache is not None:
+        yield ("proxy_disk_cache_entries", "gauge", "Entries in the disk cache tier", {}, len(disk_cache))
+    for result in ("completed", "failed", "dropped", "hits", "wasted"):
+        yield ("proxy_prefetch_total", "counter", "Subresource prefetches by outcome", {"result": result}, prefetcher.counters[result])
+    for index, name in enumerate(PRIORITY_NAMES):
+        yield ("proxy_admission_in_flight", "gauge", "Proxied requests holding an admission slot", {"priority": name}, admission.in_flight[index])
+        yield ("proxy_admission_queue_depth", "gauge", "Proxied requests waiting for an admission slot", {"priority": name}, admission.queue_depth_of(index))
+    yield ("proxy_admission_shed_total", "counter", "Proxied requests answered 503 by admission control", {"reason": "queue_full"}, admission.counters["shed_queue_full"])
+    yield ("proxy_admission_shed_total", "counter", "Proxied requests answered 503 by admission control", {"reason": "timeout"}, admission.counters["shed_timeout"])
+    yield ("proxy_admission_queued_total", "counter", "Proxied requests that waited for an admission slot", {}, admission.counters["queued"])
+    yield ("proxy_deadline_exceeded_total", "counter", "Proxied requests given up on their end-to-end deadline", {"stage": "before_upstream"}, deadline_metrics["abandoned"])
+    yield ("proxy_deadline_exceeded_total", "counter", "Proxied requests given up on their end-to-end deadline", {"stage": "in_flight"}, deadline_metrics["exceeded"])
+    for result in ("completed", "uncacheable", "too_large", "abandoned"):
+        yield ("proxy_stream_cache_fills_total", "counter", "Streamed responses teed into the cache by outcome", {"result": result}, stream_fills.counters[result])
+    yield ("proxy_stream_cache_followers_total", "counter", "Streams served by following another stream's cache fill", {}, stream_fills.counters["followers"])
+    yield ("proxy_stream_cache_follower_resumes_total", "counter", "Following streams that fetched the rest of their body after the fill stopped", {}, stream_fills.counters["follower_resumes"])
+    yield ("proxy_streams_in_flight", "gauge", "Streamed responses and WebSocket tunnels currently open", {}, len(active_connections))
+    yield ("proxy_upstream_requests_in_flight", "gauge", "Upstream requests currently holding a host slot", {}, pool["in_flight"])
+    yield ("proxy_upstream_requests_total", "counter", "Upstream requests started", {}, pool["requests"])
+    yield ("proxy_host_queue_rejected_total", "counter", "Requests rejected because a host queue was full", {}, pool["host_queue_rejected"])
+    yield ("proxy_websockets_active", "gauge", "Open WebSocket tunnels", {}, tunnel_metrics["active"])
+    yield ("proxy_websocket_bytes_total", "counter", "Bytes relayed through WebSocket tunnels", {"direction": "up"}, tunnel_metrics["bytes_up"])
+    yield ("proxy_websocket_bytes_total", "counter", "Bytes relayed through WebSocket tunnels", {"direction": "down"}, tunnel_metrics["bytes_down"])
+    yield ("proxy_buffered_bytes", "gauge", "Body bytes currently buffered in memory", {}, buffer_metrics["buffered_bytes"])
+    yield ("proxy_bodies_spilled_total", "counter", "Bodies spilled to temporary files", {}, buffer_metrics["spilled"])
+    yield ("proxy_open_breakers", "gauge", "Upstream hosts whose circuit breaker is not closed", {},
+           sum(1 for breaker in http_pool.host_breakers.values() if breaker.state != "closed"))
+
+metrics.registry.add_collector(collect_proxy_metrics)
+
 # Models
 class BareRequest(BaseModel):
     url: str
@@ -50,6 +283,22 @@ class BareRequest(BaseModel):
     cache: Optional[bool] = None
     follow_redirects: Optional[bool] = True
 
+class WarmRequest(BaseModel):
+    urls: List[str] = []
+    manifest: Optional[Dict[str, Any]] = None
+    games: bool = False
+    base_url: Optional[str] = None
+    headers: Optional[Dict[str, str]] = None
+    concurrency: Optional[int] = Field(None, ge=1)
+    bandwidth: Optional[int] = Field(None, ge=0)
+
+class BatchRequest(BaseModel):
+    requests: List[BareRequest]
+    concurrency: Optional[int] = None
+
+# A batch body is either a BatchRequest object or a bare list of requests, validated straight from JSON
+batch_adapter = TypeAdapter(Union[BatchRequest, List[BareRequest]])
+
 class BareResponse(BaseModel):
     status: int
     statusText: str
@@ -77,11 +326,7 @@ async def headers_to_dict(headers) -> Dict[str, str]:
     result = {}
     for name, value in headers.items():
         # Skip hop-by-hop headers
-        if name.lower() in [
-            "connection", "keep-alive", "proxy-authenticate", 
-            "proxy-authorization", "te", "trailers", 
-            "transfer-encoding", "upgrade"
-        ]:
+        if name.lower() in HOP_BY_HOP_HEADERS:
             continue
         # Convert header values to strings
         if isinstance(value, (list, tuple)):
@@ -90,16 +335,61 @@ async def headers_to_dict(headers) -> Dict[str, str]:
             result[name] = str(value)
     return result
 
+# Helper function to encode a single length-prefixed stream frame
+def encode_frame(frame_type: int, payload: bytes = b"") -> bytes:
+    return FRAME_PREFIX.pack(frame_type, len(payload)) + payload
+
+# Helper function to encode the status and headers as a compact binary payload:
+# status (u16), reason length (u8) + reason, header count (u16),
+# then per header name length (u16) + name and value length (u32) + value
+def encode_headers_frame(status_code: int, headers: Dict[str, str]) -> bytes:
+    reason = httpx.codes.get_reason_phrase(status_code).encode("latin-1")[:255]
+    parts = [struct.pack("!HB", status_code, len(reason)), reason, struct.pack("!H", len(headers))]
+    for name, value in headers.items():
+        name_bytes = name.encode("latin-1", errors="replace")
+        value_bytes = value.encode("latin-1", errors="replace")
+        parts.append(struct.pack("!H", len(name_bytes)))
+        parts.append(name_bytes)
+        parts.append(struct.pack("!I", len(value_bytes)))
+        parts.append(value_bytes)
+    return encode_frame(FRAME_HEADERS, b"".join(parts))
+
+# Helper function to compress data, moving large payloads off the event loop
+async def compress_payload(data: bytes, encoding: str) -> bytes:
+    if len(data) >= COMPRESSION_THREAD_BYTES:
+        return await asyncio.to_thread(compress, data, encoding, COMPRESSION_LEVEL)
+    return compress(data, encoding, COMPRESSION_LEVEL)
+
+# Helper function to return an envelope as JSON, compressed when the client accepts it
+async def envelope_response(request: Request, content: Dict[str, Any]) -> Response:
+    body = json_codec.dumps(content)
+    encoding = negotiate_encoding(request.headers.get('accept-encoding')) \
+        if len(body) >= COMPRESSION_MIN_BYTES else None
+    if encoding is None:
+        return Response(content=body, media_type="application/json")
+    return Response(
+        content=await compress_payload(body, encoding),
+        media_type="application/json",
+        headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"}
+    )
+
 # Helper function to generate cache key
-def generate_cache_key(method: str, url: str, headers: Optional[Dict[str, str]] = None, body: Optional[str] = None) -> str:
+def generate_cache_key(
+    method: str,
+    url: str,
+    headers: Optional[Dict[str, str]] = None,
+    body: Optional[str] = None,
+    vary: Optional[List[str]] = None
+) -> str:
     # Create a unique cache key based on the request details
     key_parts = [method.upper(), url]
     
-    # Add relevant headers that might affect the response
-    if headers:
-        for header in ['accept', 'accept-language', 'content-type']:
-            if header in headers:
-                key_parts.append(f"{header}:{headers[header]}")
+    # Add the request headers the response varies on (a conservative default set when unknown)
+    header_names = vary if vary is not None else ['accept', 'accept-language', 'content-type']
+    for header in header_names:
+        value = get_header(headers, header)
+        if value is not None:
+            key_parts.append(f"{header}:{value}")
     
     # Add body hash if present
     if body:
@@ -110,53 +400,1167 @@ def generate_cache_key(method: str, url: str, headers: Optional[Dict[str, str]]
     key_string = '|'.join(key_parts)
     return hashlib.sha256(key_string.encode('utf-8')).hexdigest()
 
-# Helper to create HTTP client with appropriate settings
-async def get_client(timeout: Optional[float] = None, follow_redirects: bool = True):
-    return httpx.AsyncClient(
-        timeout=httpx.Timeout(timeout or DEFAULT_TIMEOUT),
-        follow_redirects=follow_redirects,
-        max_redirects=MAX_REDIRECTS,
-        http2=True,  # Enable HTTP/2 for better performance
-        verify=True   # Verify SSL certificates
+# Helper function to resolve the cache key for a request, following a Vary marker if one is stored
+def resolve_cache_key(method: str, url: str, headers: Optional[Dict[str, str]] = None) -> str:
+    base_key = generate_cache_key(method, url, vary=[])
+    marker = response_cache.peek(base_key)
+    if marker is None and disk_cache is not None:
+        marker = disk_cache.peek_meta(base_key)
+    if marker is not None and marker.get('vary_marker'):
+        # Every variant lookup goes through the marker, so it must stay as hot as its variants
+        response_cache.sketch.increment(base_key)
+        return generate_cache_key(method, url, headers, vary=marker['vary'])
+    return base_key
+
+# Helper to get the shared pooled HTTP client
+def get_client() -> httpx.AsyncClient:
+    return http_pool.get_client()
+
+# Helper function to build the freshness metadata stored with a cache entry
+def cache_metadata(headers: Dict[str, str], now: float) -> Dict[str, float]:
+    stale_while_revalidate, stale_if_error = stale_allowances(
+        headers, CACHE_STALE_WHILE_REVALIDATE, CACHE_STALE_IF_ERROR
     )
+    return {
+        'timestamp': now,
+        'expires_at': now + freshness_lifetime(headers, CACHE_TTL, now),
+        'stale_while_revalidate': stale_while_revalidate,
+        'stale_if_error': stale_if_error
+    }
+
+# Helper function to get when a cache entry stops being fresh (entries stored before freshness metadata use the TTL)
+def entry_expires_at(cached_data: Dict[str, Any]) -> float:
+    return cached_data.get('expires_at', cached_data['timestamp'] + CACHE_TTL)
+
+# Helper function to check whether a cache entry is still within its freshness lifetime
+def is_fresh(cached_data: Dict[str, Any]) -> bool:
+    return time.time() < entry_expires_at(cached_data)
+
+# Helper function to check whether an expired entry is still inside one of its stale windows
+def can_serve_stale(cached_data: Dict[str, Any], window: str) -> bool:
+    return time.time() < entry_expires_at(cached_data) + cached_data.get(window, 0)
+
+# Helper function to run a shared cache tier write without blocking the request
+def schedule_shared_cache_write(coroutine) -> None:
+    task = asyncio.ensure_future(coroutine)
+    shared_cache_tasks.add(task)
+    task.add_done_callback(shared_cache_tasks.discard)
+
+# Helper function to write an entry to the memory tier and, when enabled, the disk and shared tiers
+def cache_put(cache_key: str, cached_data: Dict[str, Any]) -> None:
+    response_cache.put(cache_key, cached_data)
+    if disk_cache is not None:
+        # Write-through: entries evicted from memory stay available on disk
+        disk_cache.schedule_store(cache_key, cached_data)
+    if shared_state.store is not None:
+        # Other workers find the entry in the shared tier
+        schedule_shared_cache_write(shared_state.store.cache_store(cache_key, cached_data))
+
+# Helper function to remove an entry from every cache tier
+def cache_discard(cache_key: str) -> None:
+    response_cache.pop(cache_key)
+    if disk_cache is not None:
+        disk_cache.discard(cache_key)
+    if shared_state.store is not None:
+        schedule_shared_cache_write(shared_state.store.cache_discard(cache_key))
+
+# Helper function to copy an entry another worker stored in the shared tier into memory
+async def promote_from_shared(cache_key: str) -> Optional[Dict[str, Any]]:
+    if shared_state.store is None:
+        return None
+    cached_data = await shared_state.store.cache_load(cache_key)
+    if cached_data is not None:
+        response_cache.put(cache_key, cached_data)
+        response_cache.counters['promotions'] += 1
+    return cached_data
+
+# Helper function to promote an entry from the disk tier back into memory; with read_body off, the body
+# stays in its file for the caller to stream and the entry is not promoted
+async def promote_from_disk(cache_key: str, read_body: bool = True) -> Optional[Dict[str, Any]]:
+    if disk_cache is None or cache_key not in disk_cache:
+        return None
+    cached_data = await disk_cache.load(cache_key, read_body)
+    if cached_data is not None and 'body_path' not in cached_data:
+        response_cache.put(cache_key, cached_data)
+        response_cache.counters['promotions'] += 1
+    return cached_data
+
+# Helper function to move one entry from the snapshot being restored into memory, keeping its frequency
+def restore_snapshot_entry(cache_key: str) -> Optional[Dict[str, Any]]:
+    if cache_snapshot is None or cache_key not in cache_snapshot or cache_key in response_cache:
+        return None
+    restored = cache_snapshot.take(cache_key)
+    if restored is None:
+        return None
+    cached_data, frequency = restored
+    response_cache.sketch.seed(cache_key, frequency)
+    response_cache.put(cache_key, cached_data)
+    return cached_data
+
+# Helper function to serve a cache miss from the snapshot while the background restore is still running
+def promote_from_snapshot(cache_key: str) -> Optional[Dict[str, Any]]:
+    cached_data = restore_snapshot_entry(cache_key)
+    if cached_data is not None:
+        snapshot_metrics['restored_on_demand'] += 1
+    return cached_data
+
+# Helper function to tell until when a cache entry is worth restoring after a restart
+def snapshot_usable_until(cached_data: Dict[str, Any]) -> float:
+    if cached_data.get('vary_marker') or has_validators(cached_data.get('headers') or {}):
+        return math.inf
+    return entry_expires_at(cached_data) + max(cached_data.get('stale_while_revalidate', 0), cached_data.get('stale_if_error', 0))
 
-# Helper function to check cache and return cached response if available
-async def check_cache(cache_key: str) -> Optional[Dict[str, Any]]:
+# Helper function to list the memory tier for a snapshot, hottest entries first
+def snapshot_entries() -> List[SnapshotEntry]:
+    now = time.time()
+    entries = []
+    for cache_key, cached_data in reversed(list(response_cache.items())):
+        usable_until = snapshot_usable_until(cached_data)
+        if usable_until > now:
+            entries.append((cache_key, cached_data, response_cache.sketch.estimate(cache_key), usable_until))
+    return entries
+
+# Helper function to write the memory tier to the snapshot file off the event loop
+async def save_cache_snapshot() -> None:
+    started = time.monotonic()
+    # Entries are never modified once cached, so the writer thread can serialize them as listed
+    entries = snapshot_entries()
+    try:
+        written, size = await asyncio.to_thread(write_snapshot, CACHE_SNAPSHOT_PATH, entries)
+    except Exception as e:
+        snapshot_metrics['write_errors'] += 1
+        logger.error(f"Failed to write cache snapshot to {CACHE_SNAPSHOT_PATH}: {str(e)}")
+        return
+    snapshot_metrics.update(
+        written=written,
+        written_bytes=size,
+        written_at=time.time(),
+        write_seconds=round(time.monotonic() - started, 3)
+    )
+    logger.info(f"Wrote {written} cache entries ({size} bytes) to {CACHE_SNAPSHOT_PATH}")
+
+# Helper function to snapshot the memory tier on an interval
+async def snapshot_periodically() -> None:
+    while True:
+        await asyncio.sleep(CACHE_SNAPSHOT_INTERVAL)
+        await save_cache_snapshot()
+
+# Helper function to restore a snapshot in the background, hottest entries first, while requests are served
+async def restore_cache_snapshot() -> None:
+    global cache_snapshot
+    started = time.monotonic()
+    try:
+        keys = cache_snapshot.keys()
+        for start in range(0, len(keys), CACHE_SNAPSHOT_BATCH):
+            batch = [cache_key for cache_key in keys[start:start + CACHE_SNAPSHOT_BATCH] if cache_key in cache_snapshot]
+            rejected = response_cache.counters['admission_rejected']
+            for cache_key in batch:
+                if restore_snapshot_entry(cache_key) is not None:
+                    snapshot_metrics['restored'] += 1
+                else:
+                    # Cached again since startup, expired or unreadable
+                    cache_snapshot.take(cache_key)
+            if batch and response_cache.counters['admission_rejected'] - rejected >= len(batch):
+                # The cache is full of entries used more often than the rest of the snapshot
+                break
+            await asyncio.sleep(0)
+    finally:
+        snapshot_metrics['restore_seconds'] = round(time.monotonic() - started, 3)
+        logger.info(f"Restored {snapshot_metrics['restored']} cache entries from {CACHE_SNAPSHOT_PATH} "
+                    f"({cache_snapshot.stats()})")
+        cache_snapshot.close()
+        cache_snapshot = None
+
+# Helper function to track the most requested cache keys and hosts for /cache/stats
+def record_hot_request(cache_key: str, url: str) -> None:
+    hot_keys.observe(cache_key, label=url)
+    host = metrics.host_label(url)
+    hot_hosts.observe(host, estimate=host_frequency.increment(host))
+
+# Helper function to check cache and return cached response if it is still fresh
+async def check_cache(cache_key: str, url: Optional[str] = None, disk_files: bool = False) -> Optional[Dict[str, Any]]:
     if not ENABLE_CACHING:
         return None
         
-    if cache_key in response_cache:
-        cached_data = response_cache[cache_key]
-        # Check if cache entry is still valid
-        if time.time() - cached_data['timestamp'] < CACHE_TTL:
+    # The lookup itself counts towards the key's frequency for cache admission
+    cached_data = response_cache.get(cache_key)
+    if url is not None:
+        record_hot_request(cache_key, url)
+    fresh = cached_data is not None and not cached_data.get('vary_marker') and is_fresh(cached_data)
+    prefetcher.record_lookup(cache_key, fresh)
+    if cached_data is None:
+        cached_data = promote_from_snapshot(cache_key)
+    if cached_data is None:
+        cached_data = await promote_from_shared(cache_key)
+    if cached_data is None:
+        cached_data = await promote_from_disk(cache_key, read_body=not disk_files)
+    if cached_data is not None and not cached_data.get('vary_marker'):
+        # Check if cache entry is still fresh
+        if is_fresh(cached_data):
             # Update metrics
             request_metrics['cache_hits'] += 1
+            response_cache.counters['hits'] += 1
+            metrics.cache_hit.inc()
             return cached_data
-        else:
-            # Remove expired cache entry
-            del response_cache[cache_key]
+        elif not has_validators(cached_data['headers']) \
+                and not can_serve_stale(cached_data, 'stale_while_revalidate') \
+                and not can_serve_stale(cached_data, 'stale_if_error'):
+            # Remove expired cache entry that can neither be revalidated nor served stale
+            cache_discard(cache_key)
+            response_cache.counters['expired'] += 1
     
+    response_cache.counters['misses'] += 1
+    metrics.cache_miss.inc()
+    return None
+
+# Helper function to get an expired entry that can be revalidated or served stale
+def get_stale_entry(cache_key: str) -> Optional[Dict[str, Any]]:
+    if not ENABLE_CACHING:
+        return None
+    cached_data = response_cache.peek(cache_key)
+    if cached_data is None or cached_data.get('vary_marker'):
+        return None
+    if has_validators(cached_data['headers']) \
+            or can_serve_stale(cached_data, 'stale_while_revalidate') \
+            or can_serve_stale(cached_data, 'stale_if_error'):
+        return cached_data
     return None
 
+# Helper function to get the raw body bytes of a cache entry
+def entry_body_bytes(cached_data: Dict[str, Any]) -> bytes:
+    body = cached_data.get('body')
+    if body is None:
+        return b''
+    if isinstance(body, str):
+        return body.encode('utf-8')
+    if cached_data.get('body_encoding'):
+        return decompress(body, cached_data['body_encoding'])
+    return body
+
+# Helper function to get the body of a cache entry as text, as the JSON envelope carries it
+def entry_body_text(cached_data: Dict[str, Any]) -> Optional[str]:
+    body = cached_data.get('body')
+    if body is None or isinstance(body, str):
+        return body
+    try:
+        return entry_body_bytes(cached_data).decode(cached_data.get('body_charset') or 'utf-8', errors='replace')
+    except LookupError:
+        return entry_body_bytes(cached_data).decode('utf-8', errors='replace')
+
+# Helper function to turn a cache entry into the envelope returned to clients
+def cached_envelope(cached_data: Dict[str, Any], **extra) -> Dict[str, Any]:
+    envelope = {name: value for name, value in cached_data.items() if name not in ENTRY_ONLY_FIELDS}
+    envelope['body'] = entry_body_text(cached_data)
+    envelope.update(extra)
+    return envelope
+
+# Helper function to return a stale copy and count why it was served
+def serve_stale(cached_data: Dict[str, Any], counter: str) -> Dict[str, Any]:
+    request_metrics['cache_hits'] += 1
+    response_cache.counters[counter] += 1
+    metrics.cache_stale.inc()
+    return cached_envelope(cached_data, stale=True)
+
+# Helper function to store compressible text bodies compressed in the cache
+async def compress_cached_body(cached_data: Dict[str, Any]) -> Dict[str, Any]:
+    body = cached_data.get('body')
+    if not CACHE_COMPRESSION or body is None or cached_data.get('body_encoding') \
+            or len(body) < COMPRESSION_MIN_BYTES:
+        return cached_data
+    if not is_compressible(get_header(cached_data['headers'], 'content-type')):
+        return cached_data
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+        cached_data['body_charset'] = 'utf-8'
+    encoding = available_encodings()[0]
+    cached_data['body'] = await compress_payload(body, encoding)
+    cached_data['body_encoding'] = encoding
+    response_cache.counters['compressed'] += 1
+    return cached_data
+
 # Helper function to store response in cache
-async def store_in_cache(cache_key: str, response_data: Dict[str, Any]):
+async def store_in_cache(
+    cache_key: str,
+    response_data: Dict[str, Any],
+    request_headers: Optional[Dict[str, str]] = None,
+    method: Optional[str] = None,
+    url: Optional[str] = None,
+    raw_body: Optional[bytes] = None,
+    charset: Optional[str] = None
+):
     if not ENABLE_CACHING:
         return
+    
+    # Respect Cache-Control, Vary and authorization rules for shared caches
+    response_headers = response_data['headers']
+    if not is_cacheable(response_data['status'], response_headers, request_headers):
+        return
+    
+    now = time.time()
+    metadata = cache_metadata(response_headers, now)
+    if metadata['expires_at'] <= now and not has_validators(response_headers):
+        return
+    
+    # Store variants under their own key, with a marker at the base key listing the Vary headers
+    if method and url:
+        vary = parse_vary(response_headers)
+        if vary:
+            cache_put(
+                generate_cache_key(method, url, vary=[]),
+                {'vary_marker': True, 'vary': vary, 'timestamp': now}
+            )
+            cache_key = generate_cache_key(method, url, request_headers, vary=vary)
+        else:
+            cache_key = generate_cache_key(method, url, vary=[])
+    
+    # Store a timestamped copy marked as cached; the LRU evicts in O(1) to stay within its byte budget.
+    # Cookies stay with the client that caused them, in every tier the entry is written to
+    cached_data = {**response_data, **metadata, 'headers': shareable_headers(response_headers), 'cached': True}
+    if raw_body is not None:
+        # Keep the undecoded bytes so binary bodies survive and the raw endpoint can serve them
+        cached_data['body'] = raw_body
+        cached_data['body_charset'] = charset
+    cached_data = await compress_cached_body(cached_data)
+    cache_put(cache_key, cached_data)
+
+# Helper function to refresh a stored entry from a 304 Not Modified response
+def refresh_cached_entry(cache_key: str, cached_data: Dict[str, Any], not_modified_headers: Dict[str, str]) -> Dict[str, Any]:
+    headers = merge_not_modified_headers(cached_data['headers'], not_modified_headers)
+    refreshed = {**cached_data, **cache_metadata(headers, time.time()), 'headers': headers}
+    cache_put(cache_key, refreshed)
+    response_cache.counters['revalidated'] += 1
+    request_metrics['cache_hits'] += 1
+    metrics.cache_revalidated.inc()
+    return cached_envelope(refreshed)
+
+# Helper function to read a request body, rejecting it once it crosses MAX_REQUEST_SIZE
+async def read_limited_body(request: Request) -> bytes:
+    check_body_size(declared_length(request.headers) or 0, MAX_REQUEST_SIZE)
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        check_body_size(size, MAX_REQUEST_SIZE)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+# Helper function to stream a request body through, stopping once it crosses MAX_REQUEST_SIZE
+async def limited_request_stream(request: Request):
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        check_body_size(size, MAX_REQUEST_SIZE)
+        yield chunk
+
+# Helper function to read an upstream body, spilling it to disk past SPOOL_THRESHOLD
+async def read_upstream_body(response: httpx.Response, on_chunk: Optional[Callable[[bytes], None]] = None) -> SpooledBody:
+    check_body_size(declared_length(response.headers) or 0, MAX_REQUEST_SIZE)
+    body = SpooledBody(SPOOL_THRESHOLD, MAX_REQUEST_SIZE, SPOOL_DIR)
+    try:
+        async for chunk in response.aiter_bytes():
+            await body.write(chunk)
+            if on_chunk is not None:
+                on_chunk(chunk)
+    except BaseException:
+        body.close()
+        raise
+    metrics.upstream_bytes(response.url.host).inc(body.size)
+    return body
+
+# Helper function to warm the cache for one subresource of a proxied page
+async def prefetch_subresource(url: str, kind: str, page_url: str, page_headers: Mapping[str, str]) -> Optional[Tuple[str, bool]]:
+    headers = {name: value for name, value in page_headers.items() if name.lower() not in PREFETCH_DROPPED_HEADERS}
+    headers['accept'] = ACCEPT_BY_KIND[kind]
+    headers['referer'] = page_url
+    cache_key = resolve_cache_key('GET', url, headers)
+    cached_data = response_cache.peek(cache_key)
+    if cache_key in upstream_flights or (
+        cached_data is not None and is_fresh(cached_data)
+    ):
+        return None
+    
+    # Share the flight with a client request for the same URL that arrives meanwhile
+    bare_request = BareRequest(url=url, method='GET', headers=headers)
+    request_id = f"prefetch_{time.time()}_{id(bare_request)}"
+    await upstream_flights.do(
+        cache_key,
+        lambda: fetch_upstream(bare_request, request_id, cache_key, prefetch=False),
+        timeout=DEFAULT_TIMEOUT
+    )
+    stored_key = resolve_cache_key('GET', url, headers)
+    return stored_key, stored_key in response_cache
+
+# Helper function to scan a 2xx HTML response as it streams in and prefetch its subresources as they are found
+def start_prefetch_scan(method: str, response: httpx.Response, page_headers: Mapping[str, str]) -> Optional[Callable[[bytes], None]]:
+    if not (PREFETCH_ENABLED and ENABLE_CACHING) or method.upper() != 'GET' or not 200 <= response.status_code < 300:
+        return None
+    content_type = (response.headers.get('content-type') or '').lower()
+    if not content_type.startswith(('text/html', 'application/xhtml+xml')):
+        return None
+    
+    page_url = str(response.url)
+    scanner = SubresourceScanner(page_url, response.charset_encoding, PREFETCH_PER_PAGE, PREFETCH_SCAN_BYTES)
+    prefetcher.counters['pages_scanned'] += 1
+    
+    def fetch(url: str, kind: str):
+        return prefetch_subresource(url, kind, page_url, page_headers)
+    
+    def feed(chunk: bytes) -> None:
+        if scanner.done:
+            return
+        scanner.feed_bytes(chunk)
+        found = scanner.take_new()
+        if found:
+            prefetcher.schedule(found, fetch)
+    
+    return feed
+
+# Helper function to serve an envelope that was spilled to a temporary file
+def file_envelope_response(response_data: Dict[str, Any]) -> FileResponse:
+    envelope_file = response_data['body_file']
+    
+    async def release_envelope(file=envelope_file):
+        # Holding the file object keeps the temporary file on disk until the response is sent
+        del file
+    
+    return FileResponse(envelope_file.name, media_type="application/json", background=BackgroundTask(release_envelope))
+
+# Helper function to fetch a request from upstream and store the result in the cache
+async def fetch_upstream(
+    bare_request: BareRequest,
+    request_id: str,
+    cache_key: Optional[str] = None,
+    stale_entry: Optional[Dict[str, Any]] = None,
+    prefetch: bool = True,
+    deadline: Optional[Deadline] = None,
+    on_body: Optional[Callable[[int], None]] = None
+) -> Dict[str, Any]:
+    # Background fetches get the request's own timeout as their budget
+    if deadline is None:
+        deadline = Deadline(bare_request.timeout or DEFAULT_TIMEOUT)
+    
+    # Prepare request
+    request_headers = dict(bare_request.headers or {})
+    if stale_entry is not None:
+        request_headers.update(conditional_headers(stale_entry))
+    
+    request_kwargs = {
+        "method": bare_request.method,
+        "url": bare_request.url,
+        "headers": request_headers,
+    }
+    
+    if bare_request.body:
+        request_kwargs["content"] = bare_request.body
+    
+    # Make the request over the shared connection pool, buffering the body up to the spool threshold;
+    # redirects and the body transfer all draw on the same deadline
+    client = get_client()
+    async with http_pool.host_slot(bare_request.url) as slot:
+        start_time = time.time()
+        response = await send_within(
+            client,
+            client.build_request(**request_kwargs),
+            deadline,
+            bare_request.follow_redirects
+        )
+        slot.record_status(response.status_code)
+        scan = start_prefetch_scan(bare_request.method, response, request_headers) if prefetch else None
+        try:
+            body = await deadline.run(read_upstream_body(response, scan), "reading the response body")
+        finally:
+            await response.aclose()
+        request_time = time.time() - start_time
+    if on_body is not None:
+        on_body(body.size)
+    
+    # Origin confirmed the stored copy is still valid: refresh it without a new body
+    if stale_entry is not None and response.status_code == 304:
+        body.close()
+        logger.info(f"Cache revalidated for {bare_request.url} (ID: {request_id})")
+        return refresh_cached_entry(cache_key, stale_entry, await headers_to_dict(response.headers))
+    
+    # Process response
+    response_headers = await headers_to_dict(response.headers)
+    
+    # Add custom headers with proxy information
+    response_headers['x-proxy-time'] = str(request_time)
+    response_headers['x-proxy-id'] = request_id
+    
+    # Construct response data
+    response_data = {
+        "status": response.status_code,
+        "statusText": httpx.codes.get_reason_phrase(response.status_code),
+        "headers": response_headers,
+        "body": None,
+        "timestamp": time.time(),
+        "cached": False
+    }
+    charset = response.encoding or 'utf-8'
+    
+    # Large bodies skip the cache and are served from a file instead of an in-memory string
+    if body.spilled:
+        try:
+            response_data['body_file'] = await asyncio.to_thread(
+                write_json_envelope, response_data, body, charset, SPOOL_DIR
+            )
+        finally:
+            body.close()
+        return response_data
+    
+    raw_body = body.getvalue()
+    body.close()
+    try:
+        response_data['body'] = raw_body.decode(charset, errors='replace')
+    except LookupError:
+        response_data['body'] = raw_body.decode('utf-8', errors='replace')
+    
+    # Store in cache if appropriate
+    if cache_key:
+        await store_in_cache(
+            cache_key,
+            response_data,
+            request_headers=bare_request.headers,
+            method=bare_request.method,
+            url=bare_request.url,
+            raw_body=raw_body,
+            charset=charset
+        )
+    
+    return response_data
+
+# Helper function to refresh a stale entry without blocking the request that found it
+async def refresh_in_background(bare_request: BareRequest, request_id: str, cache_key: str, stale_entry: Dict[str, Any]):
+    try:
+        await upstream_flights.do(
+            cache_key,
+            lambda: fetch_upstream(bare_request, request_id, cache_key, stale_entry),
+            timeout=bare_request.timeout or DEFAULT_TIMEOUT
+        )
+    except Exception as e:
+        logger.warning(f"Background refresh failed for {bare_request.url} (ID: {request_id}): {str(e)}")
+
+# Helper function to schedule a background refresh unless one is already running for the key
+def schedule_background_refresh(bare_request: BareRequest, request_id: str, cache_key: str, stale_entry: Dict[str, Any]):
+    if cache_key in upstream_flights:
+        return
+    response_cache.counters['background_refreshes'] += 1
+    task = asyncio.ensure_future(refresh_in_background(bare_request, request_id, cache_key, stale_entry))
+    refresh_tasks.add(task)
+    task.add_done_callback(refresh_tasks.discard)
+
+# Helper function to check whether a request uses the raw Bare v2 protocol (X-Bare-* headers)
+def is_bare_raw_request(request: Request) -> bool:
+    return 'x-bare-url' in request.headers or 'x-bare-host' in request.headers
+
+# Helper function to read a JSON-encoded X-Bare-* header
+def parse_bare_json_header(request: Union[Request, WebSocket], name: str, default: Any) -> Any:
+    value = request.headers.get(name)
+    if not value:
+        return default
+    try:
+        return json.loads(value)
+    except ValueError:
+        raise ValueError(f"Header {name} is not valid JSON")
+
+# Helper function to build the target URL from X-Bare-* headers
+def bare_target_url(fields: Mapping[str, str]) -> str:
+    url = fields.get('x-bare-url')
+    if url:
+        return url
+    protocol = fields.get('x-bare-protocol', 'https').rstrip(':')
+    host = fields['x-bare-host']
+    port = fields.get('x-bare-port')
+    path = fields.get('x-bare-path', '/')
+    if not path.startswith('/'):
+        path = '/' + path
+    default_port = {'http': '80', 'https': '443', 'ws': '80', 'wss': '443'}.get(protocol)
+    if ':' in host and not host.startswith('['):
+        host = f"[{host}]"
+    netloc = host if not port or port == default_port else f"{host}:{port}"
+    return f"{protocol}://{netloc}{path}"
+
+# Helper function to build the upstream request headers from X-Bare-Headers and X-Bare-Forward-Headers
+def bare_upstream_headers(request: Union[Request, WebSocket]) -> Dict[str, str]:
+    headers = {}
+    for name, value in parse_bare_json_header(request, 'x-bare-headers', {}).items():
+        if name.lower() in HOP_BY_HOP_HEADERS:
+            continue
+        # Bare v2 allows repeated headers as a list of values
+        headers[name] = ", ".join(value) if isinstance(value, list) else str(value)
+    for name in parse_bare_json_header(request, 'x-bare-forward-headers', []):
+        value = request.headers.get(name)
+        if value is not None and name.lower() not in HOP_BY_HOP_HEADERS:
+            headers[name] = value
+    return headers
+
+# Helper function to build the upstream WebSocket URL from bare_* query parameters or X-Bare-* headers
+def bare_websocket_url(websocket: WebSocket) -> str:
+    params = websocket.query_params
+    if 'bare_host' in params:
+        fields = {
+            'x-bare-host': params['bare_host'],
+            'x-bare-protocol': params.get('bare_protocol', 'wss'),
+            'x-bare-port': params.get('bare_port', ''),
+            'x-bare-path': params.get('bare_path', '/')
+        }
+    else:
+        fields = websocket.headers
+    url = bare_target_url(fields)
+    # Targets may be given with their HTTP scheme
+    if url.startswith('http'):
+        url = 'ws' + url[4:]
+    return url
+
+# Helper function to build the headers of a raw Bare v2 response
+def bare_response_headers(
+    request: Request,
+    status_code: int,
+    upstream_headers: Dict[str, str],
+    pass_values: Dict[str, str]
+) -> Dict[str, str]:
+    headers = {
+        'x-bare-status': str(status_code),
+        'x-bare-status-text': httpx.codes.get_reason_phrase(status_code),
+        'x-bare-headers': json.dumps(upstream_headers)
+    }
+    pass_headers = parse_bare_json_header(request, 'x-bare-pass-headers', [])
+    for name in BARE_PASS_HEADERS + [name.lower() for name in pass_headers]:
+        if name in pass_values:
+            headers[name] = pass_values[name]
+        elif name not in ('content-encoding', 'content-length'):
+            value = get_header(upstream_headers, name)
+            if value is not None:
+                headers[name] = value
+    return headers
+
+# Helper function to pick the status of a raw Bare v2 response (200 unless the client asked to pass it)
+def bare_response_status(request: Request, status_code: int) -> int:
+    pass_status = parse_bare_json_header(request, 'x-bare-pass-status', [])
+    return status_code if status_code in pass_status else 200
+
+# Helper function to serve a cache entry over the raw Bare v2 protocol
+def raw_cached_response(request: Request, method: str, cached_data: Dict[str, Any]) -> Response:
+    # Stored bodies are decoded, so the transfer encoding is whatever the cache holds
+    upstream_headers = {
+        name: value for name, value in cached_data['headers'].items()
+        if name.lower() not in ('content-encoding', 'content-length')
+    }
+    encoding = cached_data.get('body_encoding')
+    if encoding and accepts_encoding(request.headers.get('accept-encoding'), encoding):
+        # Passthrough: send the stored compressed bytes as they are
+        content = cached_data['body']
+        pass_values = {'content-encoding': encoding, 'content-length': str(len(content))}
+    else:
+        content = entry_body_bytes(cached_data)
+        pass_values = {'content-length': str(len(content))}
+    
+    headers = bare_response_headers(request, cached_data['status'], upstream_headers, pass_values)
+    headers['x-bare-cached'] = 'true'
+    return Response(
+        content=b'' if method == 'HEAD' else content,
+        status_code=bare_response_status(request, cached_data['status']),
+        headers=headers
+    )
+
+# Helper function to serve a disk-tier hit over the raw Bare v2 protocol by streaming its body file,
+# or None when the file has gone; the body is never read into memory unless it must be decompressed
+async def raw_disk_response(request: Request, method: str, cached_data: Dict[str, Any]) -> Optional[Response]:
+    path = cached_data['body_path']
+    encoding = cached_data.get('body_encoding')
+    try:
+        if encoding and not accepts_encoding(request.headers.get('accept-encoding'), encoding):
+            body = await asyncio.to_thread(read_body_file, path, cached_data['body_size'], 'bytes')
+            return raw_cached_response(request, method, {**cached_data, 'body': body})
+        stat_result = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        return None
+    
+    upstream_headers = {
+        name: value for name, value in cached_data['headers'].items()
+        if name.lower() not in ('content-encoding', 'content-length')
+    }
+    pass_values = {'content-length': str(cached_data['body_size'])}
+    if encoding:
+        # Passthrough: the file holds the stored compressed bytes
+        pass_values['content-encoding'] = encoding
+    headers = bare_response_headers(request, cached_data['status'], upstream_headers, pass_values)
+    headers['x-bare-cached'] = 'true'
+    status_code = bare_response_status(request, cached_data['status'])
+    if method == 'HEAD':
+        return Response(content=b'', status_code=status_code, headers=headers)
+    
+    # Sent in chunks from the file, or with sendfile where the server supports it
+    response = FileResponse(
+        path,
+        status_code=status_code,
+        headers=headers,
+        media_type=get_header(upstream_headers, 'content-type'),
+        stat_result=stat_result
+    )
+    # The file's own validators are not the origin's
+    for name in ('etag', 'last-modified'):
+        if name not in headers:
+            del response.headers[name]
+    return response
+
+# Helper function to serve a partial content response over the raw Bare v2 protocol
+def raw_partial_response(request: Request, partial: Dict[str, Any]) -> Response:
+    headers = bare_response_headers(request, partial['status'], partial['headers'], {'content-length': str(len(partial['body']))})
+    if partial['cached']:
+        headers['x-bare-cached'] = 'true'
+    return Response(
+        content=partial['body'],
+        status_code=bare_response_status(request, partial['status']),
+        headers=headers
+    )
+
+# Helper function to look up a short-lived negative entry for a URL that recently failed with a 5xx
+def get_negative_entry(negative_key: str) -> Optional[Dict[str, Any]]:
+    entry = negative_cache.get(negative_key)
+    if entry is None:
+        return None
+    if time.time() >= entry['expires_at']:
+        negative_cache.pop(negative_key)
+        return None
+    negative_cache.counters['hits'] += 1
+    return entry
+
+# Helper function to remember a 5xx response for NEGATIVE_CACHE_TTL seconds
+def put_negative_entry(negative_key: str, response_data: Dict[str, Any]) -> None:
+    now = time.time()
+    negative_cache.put(negative_key, {
+        **response_data,
+        'timestamp': now,
+        'expires_at': now + http_pool.NEGATIVE_CACHE_TTL,
+        'cached': True
+    })
+
+# Helper function to fail fast with 503 and Retry-After when a host is down or overloaded
+def host_unavailable_response(error: HostUnavailable, request_id: str, url: Optional[str]) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={
+            "error": "Service Unavailable",
+            "message": str(error),
+            "request_id": request_id,
+            "url": url
+        },
+        headers={"Retry-After": str(max(1, int(error.retry_after + 0.999)))}
+    )
+
+# Helper function to key the stored description of a range-cached object
+def range_meta_key(url: str) -> str:
+    return generate_cache_key('RANGE', url, vary=[])
+
+# Helper function to key one cached chunk of a specific version of an object
+def range_chunk_key(meta_key: str, validator: str, index: int) -> str:
+    return hashlib.sha256(f"{meta_key}|{validator}|{index}".encode('utf-8')).hexdigest()
+
+# Helper function to group sorted chunk indexes into runs fetched with one request each
+def consecutive_runs(indexes: List[int]) -> List[Tuple[int, int]]:
+    runs: List[Tuple[int, int]] = []
+    for index in indexes:
+        if runs and runs[-1][1] == index - 1:
+            runs[-1] = (runs[-1][0], index)
+        else:
+            runs.append((index, index))
+    return runs
+
+# Helper function to read the body of a 206 response, refusing more bytes than its Content-Range covers
+async def read_range_body(response: httpx.Response, length: int) -> bytearray:
+    body = bytearray()
+    async for chunk in response.aiter_bytes():
+        body += chunk
+        check_body_size(len(body), length)
+    return body
+
+# Helper function to cache a range description or chunk, counting the ones the cache declines
+def put_range_entry(cache_key: str, entry: Dict[str, Any]) -> bool:
+    stored = response_cache.put(cache_key, entry)
+    if not stored:
+        range_metrics['cache_rejected'] += 1
+    return stored
+
+# Helper function to fetch chunks first..last of an object with one ranged request and cache them,
+# returning the object's description and the chunks, or None without usable partial content of that version
+async def fetch_range_chunks(
+    url: str,
+    request_headers: Mapping[str, str],
+    first: int,
+    last: int,
+    meta: Optional[Dict[str, Any]],
+    deadline: Deadline
+) -> Optional[Tuple[Dict[str, Any], Dict[int, bytes]]]:
+    start = first * RANGE_CHUNK_SIZE
+    end = (last + 1) * RANGE_CHUNK_SIZE - 1
+    if meta is not None:
+        end = min(end, meta['total'] - 1)
+    headers = {
+        name: value for name, value in request_headers.items()
+        if name.lower() not in ('range', 'accept-encoding') and not name.lower().startswith('if-')
+    }
+    headers['Range'] = f"bytes={start}-{end}"
+    # Offsets refer to the unencoded bytes, so ask for them unencoded
+    headers['Accept-Encoding'] = 'identity'
+    if meta is not None:
+        headers['If-Range'] = meta['validator']
+    
+    meta_key = range_meta_key(url)
+    client = get_client()
+    
+    # Chunk fetches are bulk transfers: they queue behind interactive requests within the caller's deadline
+    deadline.check("before queueing")
+    async with admission.slot(PRIORITY_BULK, deadline.remaining()), http_pool.host_slot(url) as slot:
+        range_metrics['upstream_fetches'] += 1
+        response = await send_within(client, client.build_request('GET', url, headers=headers), deadline, follow_redirects=False)
+        try:
+            slot.record_status(response.status_code)
+            response_headers = await headers_to_dict(response.headers)
+            span = parse_content_range(response.headers.get('content-range'))
+            validator = strong_validator(response_headers)
+            if response.status_code == 200 and meta is None:
+                # The origin ignores ranges for this URL; stop asking it for a while
+                now = time.time()
+                put_range_entry(meta_key, {'range_meta': True, 'no_ranges': True, 'timestamp': now, 'expires_at': now + CACHE_TTL})
+            if response.status_code != 206 or span is None or span[2] is None or validator is None \
+                    or (response.headers.get('content-encoding') or 'identity').lower() != 'identity' \
+                    or not is_cacheable(200, response_headers, dict(request_headers)) \
+                    or (meta is not None and validator != meta['validator']):
+                return None
+            body = await deadline.run(read_range_body(response, span[1] - span[0] + 1), "reading the response body")
+        finally:
+            await response.aclose()
+    
+    span_start, span_end, total = span
+    metrics.upstream_bytes(response.url.host).inc(len(body))
+    range_metrics['bytes_from_upstream'] += len(body)
+    if len(body) != span_end - span_start + 1:
+        return None
+    
+    now = time.time()
+    meta = {
+        'range_meta': True,
+        'status': 200,
+        'headers': {
+            name: value for name, value in response_headers.items()
+            if name.lower() not in RANGE_TRANSFER_HEADERS and name.lower() not in UNSHARED_RESPONSE_HEADERS
+        },
+        'total': total,
+        'validator': validator,
+        **cache_metadata(response_headers, now)
+    }
+    put_range_entry(meta_key, meta)
+    
+    # Keep every whole chunk the response covered; only the object's last chunk may be short
+    pieces: Dict[int, bytes] = {}
+    index = -(-span_start // RANGE_CHUNK_SIZE)
+    while index * RANGE_CHUNK_SIZE < total:
+        chunk_start = index * RANGE_CHUNK_SIZE
+        chunk_end = min(chunk_start + RANGE_CHUNK_SIZE, total) - 1
+        if chunk_end > span_end:
+            break
+        pieces[index] = bytes(body[chunk_start - span_start:chunk_end - span_start + 1])
+        put_range_entry(range_chunk_key(meta_key, validator, index), {
+            'range_chunk': True,
+            'body': pieces[index],
+            'timestamp': now,
+            'expires_at': meta['expires_at']
+        })
+        index += 1
+    return meta, pieces
+
+# Helper function to build a 206 response for bytes start..end of an object
+def partial_content(headers: Dict[str, str], start: int, end: int, total: int, body: bytes, cached: bool) -> Dict[str, Any]:
+    range_metrics['served'] += 1
+    return {
+        "status": 206,
+        "statusText": httpx.codes.get_reason_phrase(206),
+        "headers": {
+            **headers,
+            'content-range': content_range(start, end, total),
+            'content-length': str(len(body)),
+            'accept-ranges': 'bytes'
+        },
+        "body": body,
+        "timestamp": time.time(),
+        "cached": cached
+    }
+
+# Helper function to build a 416 response for a range outside the object
+def range_not_satisfiable(total: int) -> Dict[str, Any]:
+    range_metrics['unsatisfiable'] += 1
+    return {
+        "status": 416,
+        "statusText": httpx.codes.get_reason_phrase(416),
+        "headers": {'content-range': f"bytes */{total}"},
+        "body": b'',
+        "timestamp": time.time(),
+        "cached": True
+    }
+
+# Helper function to answer a single-range GET from the cache, fetching missing chunks on demand.
+# Objects are kept as RANGE_CHUNK_SIZE chunks keyed by their strong validator, next to a description
+# holding length and headers. Returns None when the request should be proxied as usual: several
+# ranges, an If-Range that does not match, an origin that ignores ranges, or an object that changed.
+async def serve_range(url: str, request_headers: Mapping[str, str], deadline: Optional[Deadline] = None) -> Optional[Dict[str, Any]]:
+    spec = parse_range(get_header(request_headers, 'range'))
+    if spec is None:
+        return None
+    if deadline is None:
+        deadline = Deadline(DEFAULT_TIMEOUT)
+    range_metrics['requests'] += 1
+    if_range = get_header(request_headers, 'if-range')
+    
+    # A complete cached copy answers any range of itself
+    full_key = resolve_cache_key('GET', url, dict(request_headers))
+    full = response_cache.peek(full_key)
+    if full is not None and not full.get('vary_marker') and full.get('status') == 200 and is_fresh(full) \
+            and 'body' in full and (if_range is None or if_range_matches(if_range, full['headers'])):
+        response_cache.get(full_key)
+        body = entry_body_bytes(full)
+        byte_range = resolve_range(spec, len(body))
+        if byte_range is None:
+            return range_not_satisfiable(len(body))
+        start, end = byte_range
+        range_metrics['bytes_from_cache'] += end - start + 1
+        headers = {name: value for name, value in full['headers'].items() if name.lower() not in RANGE_TRANSFER_HEADERS}
+        return partial_content(headers, start, end, len(body), body[start:end + 1], cached=True)
+    
+    meta_key = range_meta_key(url)
+    meta = response_cache.get(meta_key)
+    if meta is not None and not is_fresh(meta):
+        # Chunks are keyed by validator, so they are reused if the object turns out unchanged
+        meta = None
+    if meta is not None and (meta.get('no_ranges') or (if_range is not None and not if_range_matches(if_range, meta['headers']))):
+        range_metrics['fallbacks'] += 1
+        return None
+    
+    pieces: Dict[int, bytes] = {}
+    if meta is None:
+        if spec[0] is None:
+            # A suffix range cannot be placed before the length is known
+            range_metrics['fallbacks'] += 1
+            return None
+        span_end = spec[0] + RANGE_MAX_SPAN - 1 if spec[1] is None else min(spec[1], spec[0] + RANGE_MAX_SPAN - 1)
+        first, last = spec[0] // RANGE_CHUNK_SIZE, span_end // RANGE_CHUNK_SIZE
+        fetched = await upstream_flights.do(
+            f"range|{meta_key}|{first}-{last}",
+            lambda: fetch_range_chunks(url, request_headers, first, last, None, deadline),
+            timeout=deadline.remaining()
+        )
+        if fetched is None or (if_range is not None and not if_range_matches(if_range, fetched[0]['headers'])):
+            range_metrics['fallbacks'] += 1
+            return None
+        meta, pieces = fetched
+        range_metrics['chunk_misses'] += len(pieces)
+    
+    byte_range = resolve_range(spec, meta['total'])
+    if byte_range is None:
+        return range_not_satisfiable(meta['total'])
+    start, end = byte_range
+    # Open-ended ranges are answered in spans of at most RANGE_MAX_SPAN; clients ask again for the rest
+    end = min(end, start + RANGE_MAX_SPAN - 1)
+    first, last = start // RANGE_CHUNK_SIZE, end // RANGE_CHUNK_SIZE
+    
+    missing = []
+    cached = not pieces
+    for index in range(first, last + 1):
+        if index in pieces:
+            continue
+        chunk = response_cache.get(range_chunk_key(meta_key, meta['validator'], index))
+        if chunk is None:
+            missing.append(index)
+        else:
+            pieces[index] = chunk['body']
+            range_metrics['chunk_hits'] += 1
+            range_metrics['bytes_from_cache'] += len(chunk['body'])
+    
+    # Each run of consecutive missing chunks is one upstream request, shared with concurrent readers
+    for run_first, run_last in consecutive_runs(missing):
+        cached = False
+        fetched = await upstream_flights.do(
+            f"range|{meta_key}|{meta['validator']}|{run_first}-{run_last}",
+            lambda: fetch_range_chunks(url, request_headers, run_first, run_last, meta, deadline),
+            timeout=deadline.remaining()
+        )
+        if fetched is None:
+            # The object changed upstream: forget its description and proxy this request normally
+            response_cache.pop(meta_key)
+            range_metrics['fallbacks'] += 1
+            return None
+        pieces.update(fetched[1])
+        range_metrics['chunk_misses'] += run_last - run_first + 1
+    
+    if any(index not in pieces for index in range(first, last + 1)):
+        range_metrics['fallbacks'] += 1
+        return None
+    offset = first * RANGE_CHUNK_SIZE
+    body = b''.join(pieces[index] for index in range(first, last + 1))[start - offset:end - offset + 1]
+    return partial_content(meta['headers'], start, end, meta['total'], body, cached=cached)
+
+# Helper function to turn a partial content response into the envelope returned to clients
+def partial_envelope(partial: Dict[str, Any]) -> Dict[str, Any]:
+    charset = httpx.Headers(partial['headers']).get('content-type', '')
+    charset = charset.partition('charset=')[2].split(';')[0].strip() or 'utf-8'
+    try:
+        body = partial['body'].decode(charset, errors='replace')
+    except LookupError:
+        body = partial['body'].decode('utf-8', errors='replace')
+    return {**partial, 'body': body}
+
+# Helper function to hold a warm-up fetch back while live traffic needs the pool or the target host
+async def wait_for_idle_capacity(url: str) -> None:
+    host = httpx.URL(url).host
+    while http_pool.pool_metrics['in_flight'] >= WARM_YIELD_IN_FLIGHT \
+            or http_pool.host_waiting.get(host, 0) > 0 \
+            or http_pool.host_in_flight.get(host, 0) >= max(1, http_pool.POOL_MAX_PER_HOST // 2):
+        warm_metrics['yields'] += 1
+        await asyncio.sleep(WARM_YIELD_DELAY)
+
+# Helper function to fetch one URL into the cache for a warm-up job, returning the outcome and bytes transferred
+async def warm_url(url: str, headers: Dict[str, str]) -> Tuple[str, int]:
+    cache_key = resolve_cache_key('GET', url, headers)
+    cached_data = response_cache.peek(cache_key)
+    if cached_data is not None and not cached_data.get('vary_marker') and is_fresh(cached_data):
+        return 'already_cached', 0
+    
+    bare_request = BareRequest(url=url, method='GET', headers=headers, cache=True)
+    request_id = f"warm_{time.time()}_{id(bare_request)}"
+    # Count the bytes read from upstream, whether the body was kept in memory or spilled to a file;
+    # joining a fetch already in flight costs nothing
+    sizes = []
+    async with warm_semaphore:
+        warm_metrics['fetches'] += 1
+        response_data = await upstream_flights.do(
+            cache_key,
+            lambda: fetch_upstream(bare_request, request_id, cache_key, prefetch=False, on_body=sizes.append),
+            timeout=DEFAULT_TIMEOUT
+        )
+    size = sum(sizes)
+    warm_metrics['bytes'] += size
+    if resolve_cache_key('GET', url, headers) in response_cache:
+        return 'fetched', size
+    if response_data['status'] >= 400:
+        raise RuntimeError(f"HTTP {response_data['status']}")
+    return 'uncacheable', size
+
+# Helper function to answer a proxy request from the cache or upstream, returning the envelope
+async def proxy_bare_request(bare_request: BareRequest, request_id: str, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    if deadline is None:
+        deadline = Deadline(bare_request.timeout or DEFAULT_TIMEOUT)
+    
+    # Check if we should use cache
+    use_cache = ENABLE_CACHING
+    if bare_request.cache is not None:
+        use_cache = bare_request.cache
         
-    # Only cache successful responses
-    if 200 <= response_data['status'] < 300:
-        # Add timestamp and mark as cached
-        response_data['timestamp'] = time.time()
-        response_data['cached'] = True
-        response_cache[cache_key] = response_data
+    # Single byte ranges are answered from cached chunks, fetching missing ones on demand
+    if use_cache and ENABLE_CACHING and RANGE_CACHE_ENABLED and bare_request.method.upper() == 'GET' \
+            and get_header(bare_request.headers, 'range') is not None:
+        try:
+            partial = await serve_range(bare_request.url, bare_request.headers, deadline)
+        except (httpx.RequestError, asyncio.TimeoutError, HostUnavailable, BodyTooLarge) as e:
+            # The normal path below reports the failure
+            logger.warning(f"Range cache fetch failed for {bare_request.url}: {str(e)} (ID: {request_id})")
+            partial = None
+        if partial is not None:
+            logger.info(f"Range request for {bare_request.url} answered from chunk cache (ID: {request_id})")
+            return partial_envelope(partial)
+    
+    # Generate cache key if caching is enabled
+    cache_key = None
+    stale_entry = None
+    if use_cache and bare_request.method.upper() in ['GET', 'HEAD']:
+        cache_key = resolve_cache_key(
+            bare_request.method, 
+            bare_request.url, 
+            bare_request.headers
+        )
         
-        # Cleanup old cache entries if cache is too large (simple LRU-like approach)
-        if len(response_cache) > 1000:  # Limit cache size
-            # Remove oldest 10% of entries
-            sorted_keys = sorted(response_cache.keys(), 
-                                key=lambda k: response_cache[k]['timestamp'])
-            for key in sorted_keys[:len(sorted_keys) // 10]:
-                del response_cache[key]
+        # Check cache for existing response, unless the client asked for revalidation
+        request_directives = parse_cache_control(get_header(bare_request.headers, 'cache-control'))
+        if 'no-cache' not in request_directives:
+            cached_response = await check_cache(cache_key, bare_request.url)
+            if cached_response:
+                logger.info(f"Cache hit for {bare_request.url} (ID: {request_id})")
+                return cached_envelope(cached_response)
+        
+        # A stale copy is revalidated instead of downloaded again, or served while it refreshes
+        if not has_client_conditionals(bare_request.headers):
+            stale_entry = get_stale_entry(cache_key)
+        
+        if stale_entry is not None and 'no-cache' not in request_directives \
+                and can_serve_stale(stale_entry, 'stale_while_revalidate'):
+            logger.info(f"Serving stale copy of {bare_request.url} while revalidating (ID: {request_id})")
+            schedule_background_refresh(bare_request, request_id, cache_key, stale_entry)
+            return serve_stale(stale_entry, 'stale_hits')
+    
+    # A recent 5xx for the same URL is answered again without going upstream
+    negative_key = None
+    if bare_request.cache is not False and bare_request.method.upper() in ['GET', 'HEAD']:
+        negative_key = generate_cache_key(bare_request.method, bare_request.url, vary=[])
+        negative_entry = get_negative_entry(negative_key)
+        if negative_entry is not None:
+            if stale_entry is not None and can_serve_stale(stale_entry, 'stale_if_error'):
+                return serve_stale(stale_entry, 'stale_if_error')
+            logger.info(f"Negative cache hit for {bare_request.url} (ID: {request_id})")
+            return cached_envelope(negative_entry, negative=True)
+    
+    # Only the request that goes upstream takes an admission slot, queueing no longer than its deadline allows
+    async def admitted_fetch(fetch_deadline: Deadline) -> Dict[str, Any]:
+        fetch_deadline.check("before queueing")
+        async with admission.slot(PRIORITY_INTERACTIVE, fetch_deadline.remaining()):
+            return await fetch_upstream(bare_request, request_id, cache_key, stale_entry, deadline=fetch_deadline)
+    
+    # A shared fetch runs under its own deadline, registered before any other request can join it
+    def shared_fetch() -> Awaitable[Dict[str, Any]]:
+        flight_deadline = Deadline(DEFAULT_TIMEOUT)
+        flight_deadline.extend(deadline)
+        flight_deadlines[cache_key] = flight_deadline
+        return run_shared_fetch(flight_deadline)
+    
+    async def run_shared_fetch(flight_deadline: Deadline) -> Dict[str, Any]:
+        try:
+            return await admitted_fetch(flight_deadline)
+        finally:
+            if flight_deadlines.get(cache_key) is flight_deadline:
+                del flight_deadlines[cache_key]
+    
+    # Fetch from upstream; concurrent misses for the same cache key share one request.
+    # The shared fetch lasts as long as the proxy default or the longest deadline among the
+    # requests waiting on it, so a short deadline on the request that started it does not fail
+    # the others; each request applies its own deadline only to how long it waits
+    try:
+        if cache_key:
+            if cache_key in upstream_flights:
+                logger.info(f"Joining in-flight request for {bare_request.url} (ID: {request_id})")
+                flight_deadline = flight_deadlines.get(cache_key)
+                if flight_deadline is not None:
+                    flight_deadline.extend(deadline)
+            response_data = await upstream_flights.do(
+                cache_key,
+                shared_fetch,
+                timeout=deadline.remaining()
+            )
+        else:
+            response_data = await admitted_fetch(deadline)
+    except (httpx.RequestError, asyncio.TimeoutError, HostUnavailable) as e:
+        # Upstream failed, timed out or is known to be down: fall back to the stale copy if it is still allowed
+        if stale_entry is not None and can_serve_stale(stale_entry, 'stale_if_error'):
+            logger.warning(f"Serving stale copy of {bare_request.url} after upstream error: {str(e)} (ID: {request_id})")
+            return serve_stale(stale_entry, 'stale_if_error')
+        raise
+    
+    if response_data['status'] >= 500 and negative_key and 'body_file' not in response_data:
+        put_negative_entry(negative_key, response_data)
+    
+    if response_data['status'] >= 500 and stale_entry is not None \
+            and can_serve_stale(stale_entry, 'stale_if_error'):
+        logger.warning(f"Serving stale copy of {bare_request.url} after upstream {response_data['status']} (ID: {request_id})")
+        return serve_stale(stale_entry, 'stale_if_error')
+    
+    return response_data
 
 # Main endpoint for bare proxy requests
 @router.post("/")
@@ -165,14 +1569,30 @@ async def bare_proxy(
     user_id: Optional[str] = Depends(get_optional_user_id),
     x_request_id: Optional[str] = Header(None)
 ):
+    # Bare v2 clients send the target in X-Bare-* headers with a raw body
+    if is_bare_raw_request(request):
+        return await bare_proxy_raw(request)
+    
     # Update metrics
     request_metrics['total_requests'] += 1
     request_id = x_request_id or f"req_{time.time()}_{id(request)}"
     
     try:
-        # Parse request
-        request_data = await request.json()
-        bare_request = BareRequest(**request_data)
+        # Parse and validate the request in one step, rejecting oversized bodies before they are fully read
+        try:
+            bare_request = BareRequest.model_validate_json(await read_limited_body(request))
+        except BodyTooLarge as e:
+            request_metrics['failed_requests'] += 1
+            return JSONResponse(
+                status_code=413,
+                content={"error": "Payload Too Large", "message": str(e), "request_id": request_id}
+            )
+        except ValidationError as e:
+            request_metrics['failed_requests'] += 1
+            return JSONResponse(
+                status_code=400,
+                content={"error": "Bad Request", "message": str(e), "request_id": request_id}
+            )
         
         if not bare_request.url:
             request_metrics['failed_requests'] += 1
@@ -180,6 +1600,7 @@ async def bare_proxy(
                 status_code=400,
                 content={"error": "Missing URL parameter", "request_id": request_id}
             )
+        request.state.upstream_host = metrics.host_label(bare_request.url)
         
         # Log request with user context if available
         if user_id:
@@ -187,72 +1608,31 @@ async def bare_proxy(
         else:
             logger.info(f"Anonymous proxying request to: {bare_request.url} (ID: {request_id})")
         
-        # Check if we should use cache
-        use_cache = ENABLE_CACHING
-        if bare_request.cache is not None:
-            use_cache = bare_request.cache
-            
-        # Generate cache key if caching is enabled
-        cache_key = None
-        if use_cache and bare_request.method.upper() in ['GET', 'HEAD']:
-            cache_key = generate_cache_key(
-                bare_request.method, 
-                bare_request.url, 
-                bare_request.headers
-            )
-            
-            # Check cache for existing response
-            cached_response = await check_cache(cache_key)
-            if cached_response:
-                logger.info(f"Cache hit for {bare_request.url} (ID: {request_id})")
-                return cached_response
+        # Answer from the cache or upstream within the request's end-to-end deadline
+        deadline = Deadline.for_request(bare_request.timeout, request.headers, DEFAULT_TIMEOUT)
+        response_data = await proxy_bare_request(bare_request, request_id, deadline)
         
-        # Create HTTP client with appropriate settings
-        async with await get_client(
-            timeout=bare_request.timeout,
-            follow_redirects=bare_request.follow_redirects
-        ) as client:
-            # Prepare request
-            request_kwargs = {
-                "method": bare_request.method,
-                "url": bare_request.url,
-                "headers": bare_request.headers or {},
-            }
-            
-            if bare_request.body:
-                request_kwargs["content"] = bare_request.body
-            
-            # Make the request
-            start_time = time.time()
-            response = await client.request(**request_kwargs)
-            request_time = time.time() - start_time
-            
-            # Process response
-            response_headers = await headers_to_dict(response.headers)
-            
-            # Add custom headers with proxy information
-            response_headers['x-proxy-time'] = str(request_time)
-            response_headers['x-proxy-id'] = request_id
-            
-            # Construct response data
-            response_data = {
-                "status": response.status_code,
-                "statusText": httpx.codes.get_reason_phrase(response.status_code),
-                "headers": response_headers,
-                "body": response.text,
-                "timestamp": time.time(),
-                "cached": False
+        # Update metrics
+        request_metrics['successful_requests'] += 1
+        
+        if 'body_file' in response_data:
+            return file_envelope_response(response_data)
+        
+        # Return the response, compressed when the client accepts it
+        return await envelope_response(request, response_data)
+    
+    except asyncio.TimeoutError as e:
+        request_metrics['failed_requests'] += 1
+        logger.error(f"Timed out proxying {bare_request.url} (ID: {request_id}): {str(e) or 'waiting for in-flight request'}")
+        return JSONResponse(
+            status_code=504,
+            content={
+                "error": "Gateway Timeout", 
+                "message": "The request timed out",
+                "request_id": request_id,
+                "url": bare_request.url
             }
-            
-            # Store in cache if appropriate
-            if cache_key and 200 <= response.status_code < 300:
-                await store_in_cache(cache_key, response_data)
-            
-            # Update metrics
-            request_metrics['successful_requests'] += 1
-            
-            # Return the response
-            return response_data
+        )
     
     except httpx.TimeoutException as e:
         request_metrics['failed_requests'] += 1
@@ -267,6 +1647,24 @@ async def bare_proxy(
             }
         )
     
+    except HostUnavailable as e:
+        request_metrics['failed_requests'] += 1
+        logger.warning(f"Failing fast for {bare_request.url} (ID: {request_id}): {str(e)}")
+        return host_unavailable_response(e, request_id, bare_request.url)
+    
+    except BodyTooLarge as e:
+        request_metrics['failed_requests'] += 1
+        logger.error(f"Upstream response too large for {bare_request.url} (ID: {request_id}): {str(e)}")
+        return JSONResponse(
+            status_code=502,
+            content={
+                "error": "Bad Gateway",
+                "message": f"Upstream response exceeds MAX_REQUEST_SIZE: {str(e)}",
+                "request_id": request_id,
+                "url": bare_request.url
+            }
+        )
+    
     except httpx.RequestError as e:
         request_metrics['failed_requests'] += 1
         logger.error(f"Request error for {bare_request.url} (ID: {request_id}): {str(e)}")
@@ -293,12 +1691,296 @@ async def bare_proxy(
             }
         )
 
+# Helper function to describe a failed batch item the way bare_proxy reports errors
+def batch_item_error(error: Exception) -> Dict[str, Any]:
+    if isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException)):
+        return {"status": 504, "error": "Gateway Timeout", "message": "The request timed out"}
+    if isinstance(error, HostUnavailable):
+        return {"status": 503, "error": "Service Unavailable", "message": str(error), "retry_after": round(error.retry_after, 2)}
+    if isinstance(error, BodyTooLarge):
+        return {"status": 502, "error": "Bad Gateway", "message": f"Upstream response exceeds MAX_REQUEST_SIZE: {str(error)}"}
+    if isinstance(error, httpx.RequestError):
+        return {"status": 502, "error": "Bad Gateway", "message": str(error)}
+    return {"status": 500, "error": "Internal Server Error", "message": str(error)}
+
+# Batch endpoint: many proxy requests in one round-trip, results streamed as NDJSON as they complete
+@router.post("/batch")
+async def bare_proxy_batch(
+    request: Request,
+    user_id: Optional[str] = Depends(get_optional_user_id),
+    x_request_id: Optional[str] = Header(None)
+):
+    batch_id = x_request_id or f"batch_{time.time()}_{id(request)}"
+    
+    # Parse the batch: either {"requests": [...], "concurrency": n} or a bare list of requests
+    try:
+        batch = batch_adapter.validate_json(await read_limited_body(request))
+        if isinstance(batch, list):
+            batch = BatchRequest(requests=batch)
+    except BodyTooLarge as e:
+        return JSONResponse(
+            status_code=413,
+            content={"error": "Payload Too Large", "message": str(e), "request_id": batch_id}
+        )
+    except (ValueError, TypeError, ValidationError) as e:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Bad Request", "message": str(e), "request_id": batch_id}
+        )
+    
+    if len(batch.requests) > BATCH_MAX_ITEMS:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "error": "Bad Request",
+                "message": f"Batch has {len(batch.requests)} requests; the limit is {BATCH_MAX_ITEMS}",
+                "request_id": batch_id
+            }
+        )
+    
+    concurrency = max(1, min(batch.concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    logger.info(
+        f"{'User ' + user_id if user_id else 'Anonymous'} batch of {len(batch.requests)} requests "
+        f"with concurrency {concurrency} (ID: {batch_id})"
+    )
+    
+    async def run_item(index: int, bare_request: BareRequest, semaphore: asyncio.Semaphore):
+        if not bare_request.url:
+            return index, None, {"status": 400, "error": "Missing URL parameter"}
+        # Time spent waiting behind other items counts against each item's deadline
+        deadline = Deadline.for_request(bare_request.timeout, request.headers, DEFAULT_TIMEOUT)
+        async with semaphore:
+            request_metrics['total_requests'] += 1
+            try:
+                # Each item goes through the cache, stale serving and request coalescing
+                response_data = await proxy_bare_request(bare_request, f"{batch_id}_{index}", deadline)
+                request_metrics['successful_requests'] += 1
+                return index, response_data, None
+            except Exception as e:
+                request_metrics['failed_requests'] += 1
+                logger.error(f"Batch item {index} failed for {bare_request.url} (ID: {batch_id}): {str(e)}")
+                return index, None, batch_item_error(e)
+    
+    async def stream_results():
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = [
+            asyncio.ensure_future(run_item(index, bare_request, semaphore))
+            for index, bare_request in enumerate(batch.requests)
+        ]
+        try:
+            # Emit each result as soon as it is ready rather than in request order
+            for next_result in asyncio.as_completed(tasks):
+                index, response_data, error = await next_result
+                if error is not None:
+                    yield json_codec.dumps_line({"index": index, "error": error})
+                elif 'body_file' in response_data:
+                    # Spilled envelopes are already JSON on disk; copy them into the line
+                    yield f'{{"index": {index}, "response": '.encode("utf-8")
+                    with open(response_data['body_file'].name, 'rb') as envelope_file:
+                        while True:
+                            chunk = await asyncio.to_thread(envelope_file.read, 65536)
+                            if not chunk:
+                                break
+                            yield chunk
+                    yield b"}\n"
+                else:
+                    yield json_codec.dumps_line({"index": index, "response": response_data})
+        finally:
+            # Stop outstanding items if the client goes away
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+# Helper function to encode the status and headers of a streamed response in the client's framing
+def stream_head_frame(status_code: int, headers: Dict[str, str], framed: bool, cached: bool = False) -> bytes:
+    if framed:
+        return encode_headers_frame(status_code, headers)
+    head = {
+        "type": "headers",
+        "status": status_code,
+        "statusText": httpx.codes.get_reason_phrase(status_code),
+        "headers": headers
+    }
+    if cached:
+        head["cached"] = True
+    return json_codec.dumps_line(head)
+
+# Helper function to relay a streamed body in the client's framing, ending with the end marker
+async def relay_stream(status_code: int, headers: Dict[str, str], chunks, framed: bool, cached: bool = False):
+    yield stream_head_frame(status_code, headers, framed, cached)
+    async for chunk in chunks:
+        if framed:
+            # Forward raw upstream bytes without decoding
+            yield encode_frame(FRAME_CHUNK, chunk)
+        else:
+            yield json_codec.dumps_line({
+                "type": "chunk",
+                "data": chunk.decode("utf-8", errors="replace")
+            })
+    if framed:
+        yield encode_frame(FRAME_END)
+    else:
+        yield json_codec.dumps_line({"type": "end"})
+
+# Helper function to encode a stream error in the client's framing
+def stream_error_frame(error: Exception, framed: bool) -> bytes:
+    if framed:
+        return encode_frame(FRAME_ERROR, str(error).encode("utf-8"))
+    return json_codec.dumps_line({
+        "type": "error",
+        "error": str(error)
+    })
+
+# Helper function to replay a cached body as stream chunks
+async def cached_body_chunks(cached_data: Dict[str, Any]):
+    body = entry_body_bytes(cached_data)
+    for start in range(0, len(body), STREAM_REPLAY_CHUNK):
+        yield body[start:start + STREAM_REPLAY_CHUNK]
+
+# Helper function to decide whether a streamed response is copied into the cache and whether other streams may follow it
+def start_stream_fill(
+    cache_key: str,
+    fill: Optional[CacheFill],
+    response: httpx.Response,
+    response_headers: Dict[str, str],
+    request_headers: Dict[str, str]
+) -> Optional[CacheFill]:
+    if fill is None:
+        return None
+    if not is_cacheable(response.status_code, response_headers, request_headers):
+        stream_fills.counters['uncacheable'] += 1
+        fill.fail(FillAbandoned("response is not cacheable"))
+    elif (declared_length(response.headers) or 0) > fill.max_bytes:
+        stream_fills.counters['too_large'] += 1
+        fill.fail(FillAbandoned(f"response is larger than {fill.max_bytes} bytes"))
+    if not fill.active:
+        # Waiting followers fetch on their own
+        stream_fills.detach(cache_key, fill)
+        return None
+    # Variants are keyed by request headers the followers may not share, so only the writer's copy is kept
+    followable = not parse_vary(response_headers)
+    fill.start(response.status_code, response_headers, followable)
+    if not followable:
+        stream_fills.detach(cache_key, fill)
+    return fill
+
+# Helper function to relay an upstream body while copying it into a cache fill, storing the entry once the transfer completes
+async def tee_upstream_body(
+    response: httpx.Response,
+    cache_key: Optional[str],
+    fill: Optional[CacheFill],
+    request_headers: Dict[str, str],
+    url: str
+):
+    received = metrics.upstream_bytes(metrics.host_label(url))
+    async for chunk in response.aiter_bytes():
+        received.inc(len(chunk))
+        if fill is not None and not fill.append(chunk):
+            # Past the cache's object size limit: keep relaying without a copy
+            stream_fills.counters['too_large'] += 1
+            stream_fills.detach(cache_key, fill)
+            fill = None
+        yield chunk
+    
+    if fill is None:
+        return
+    # Followers finish from the buffer while the entry is stored
+    fill.finish()
+    stream_fills.counters['completed'] += 1
+    stream_fills.counters['completed_bytes'] += fill.size
+    try:
+        await store_in_cache(
+            cache_key,
+            {
+                "status": fill.status,
+                "statusText": httpx.codes.get_reason_phrase(fill.status),
+                "headers": fill.upstream_headers,
+                "body": None,
+                "timestamp": time.time(),
+                "cached": False
+            },
+            request_headers=request_headers,
+            method='GET',
+            url=url,
+            raw_body=fill.body(),
+            charset=response.encoding or 'utf-8'
+        )
+    finally:
+        stream_fills.detach(cache_key, fill)
+
+# Helper function to fetch the rest of a body from upstream once the download a stream was following stopped at offset
+async def resume_stream_body(
+    url: str,
+    request_headers: Dict[str, str],
+    response_headers: Dict[str, str],
+    offset: int,
+    deadline: Deadline
+):
+    resume_headers = dict(request_headers)
+    validator = strong_validator(response_headers)
+    encoding = (get_header(response_headers, 'content-encoding') or 'identity').strip().lower()
+    # Ranges count encoded bytes, so encoded bodies and ones without a validator are fetched whole and skipped ahead
+    ranged = offset > 0 and validator is not None and encoding == 'identity'
+    if ranged:
+        resume_headers['Range'] = f"bytes={offset}-"
+        resume_headers['If-Range'] = validator
+    
+    client = get_client()
+    async with admission.slot(PRIORITY_BULK, deadline.remaining()), http_pool.host_slot(url) as slot:
+        async with stream_within(client, client.build_request('GET', url, headers=resume_headers), deadline, True) as response:
+            slot.record_status(response.status_code)
+            span = parse_content_range(response.headers.get('content-range'))
+            if response.status_code == 206 and ranged and span is not None and span[0] == offset:
+                skip = 0
+            elif response.status_code == 200 and (validator is None or strong_validator(await headers_to_dict(response.headers)) == validator):
+                skip = offset
+            else:
+                # A different representation cannot be spliced onto the bytes already sent
+                raise FillAbandoned(f"upstream answered the resumed download with HTTP {response.status_code}", offset)
+            
+            received = metrics.upstream_bytes(metrics.host_label(url))
+            async for chunk in response.aiter_bytes():
+                received.inc(len(chunk))
+                if skip:
+                    dropped = min(skip, len(chunk))
+                    chunk = chunk[dropped:]
+                    skip -= dropped
+                if chunk:
+                    yield chunk
+
+# Helper function to serve a stream by following another stream's cache fill of the same key
+async def follow_stream_fill(fill: CacheFill, framed: bool, url: str, request_headers: Dict[str, str], deadline: Deadline):
+    async def body():
+        try:
+            async for chunk in fill.follow():
+                yield chunk
+        except FillAbandoned as e:
+            # The download stopped short, too large to buffer or cut off: fetch the rest independently,
+            # with a budget of its own since the one for the original response headers is spent
+            stream_fills.counters['follower_resumes'] += 1
+            logger.info(f"Resuming the followed download of {url} at byte {e.offset}: {e.reason}")
+            async for chunk in resume_stream_body(url, request_headers, fill.upstream_headers, e.offset, Deadline(deadline.budget)):
+                yield chunk
+    
+    try:
+        async for frame in relay_stream(fill.status, fill.headers, body(), framed):
+            yield frame
+    except Exception as e:
+        yield stream_error_frame(e, framed)
+
 # Streaming endpoint for larger responses
 @router.post("/stream")
 async def bare_proxy_stream(request: Request):
     try:
-        # Parse request
-        request_data = await request.json()
+        # Parse request, rejecting oversized bodies before they are fully read
+        try:
+            request_data = json_codec.loads(await read_limited_body(request))
+        except BodyTooLarge as e:
+            return JSONResponse(
+                status_code=413,
+                content={"error": "Payload Too Large", "message": str(e)}
+            )
         target_url = request_data.get("url")
         
         if not target_url:
@@ -308,28 +1990,75 @@ async def bare_proxy_stream(request: Request):
             )
         
         logger.info(f"Streaming proxied request to: {target_url}")
+        request.state.upstream_host = metrics.host_label(target_url)
         
         # Extract request details
         method = request_data.get("method", "GET")
         headers = request_data.get("headers", {})
         body = request_data.get("body")
         
+        # Raw length-prefixed frames are opt-in; NDJSON remains the default
+        framed = (
+            request_data.get("framing") == "binary"
+            or FRAMED_MEDIA_TYPE in request.headers.get("accept", "")
+        )
+        media_type = FRAMED_MEDIA_TYPE if framed else "application/x-ndjson"
+        
         # Generate a unique ID for this connection
         connection_id = f"conn_{time.time()}_{id(request)}"
         
+        # The caller's timeout bounds queueing, redirects and the wait for response headers
+        deadline = Deadline.for_request(request_data.get("timeout"), request.headers, DEFAULT_TIMEOUT)
+        
+        # Plain GETs go through the cache: hits and downloads already in progress are served without going upstream
+        cache_key = None
+        if ENABLE_CACHING and request_data.get("cache") is not False and method.upper() == 'GET' and not body \
+                and get_header(headers, 'range') is None and not has_client_conditionals(headers):
+            cache_key = resolve_cache_key('GET', target_url, headers)
+            if 'no-cache' not in parse_cache_control(get_header(headers, 'cache-control')):
+                cached_response = await check_cache(cache_key, target_url)
+                if cached_response:
+                    logger.info(f"Cache hit for stream of {target_url}")
+                    # Stored bodies are decoded, so the upstream transfer headers no longer apply
+                    cached_headers = decoded_body_headers(cached_response['headers'])
+                    return StreamingResponse(
+                        relay_stream(cached_response['status'], cached_headers, cached_body_chunks(cached_response), framed, cached=True),
+                        media_type=media_type
+                    )
+                
+                fill = stream_fills.get(cache_key)
+                if fill is not None:
+                    try:
+                        await asyncio.wait_for(fill.wait_started(), deadline.remaining())
+                    except Exception as e:
+                        # The download being followed failed or cannot be shared: fetch independently
+                        stream_fills.counters['follower_fallbacks'] += 1
+                        logger.info(f"Not following the download of {target_url}: {str(e) or type(e).__name__}")
+                    else:
+                        stream_fills.counters['followers'] += 1
+                        logger.info(f"Following in-progress download of {target_url}")
+                        return StreamingResponse(follow_stream_fill(fill, framed, target_url, headers, deadline), media_type=media_type)
+        
+        # This stream is copied into the cache unless another one for the key already is
+        fill = stream_fills.begin(cache_key) if cache_key is not None else None
+        
+        # Downloads queue behind interactive requests and hold at most a share of the admission slots
+        try:
+            lease = await admission.acquire(PRIORITY_BULK, deadline.remaining())
+        except Overloaded as e:
+            if fill is not None:
+                stream_fills.end(cache_key, fill)
+            logger.warning(f"Shedding stream of {target_url}: {str(e)}")
+            return host_unavailable_response(e, connection_id, target_url)
+        
+        # Free the slot and settle the cache fill, whichever of the body or the background task gets here first
+        def release_stream():
+            if fill is not None:
+                stream_fills.end(cache_key, fill)
+            lease.release()
+        
         async def stream_response():
-            client = None
             try:
-                # Create HTTP client
-                client = httpx.AsyncClient(
-                    timeout=httpx.Timeout(DEFAULT_TIMEOUT),
-                    follow_redirects=True,
-                    max_redirects=MAX_REDIRECTS
-                )
-                
-                # Store client in active connections
-                active_connections[connection_id] = client
-                
                 # Prepare request
                 request_kwargs = {
                     "method": method,
@@ -340,49 +2069,37 @@ async def bare_proxy_stream(request: Request):
                 if body:
                     request_kwargs["content"] = body
                 
-                # Make the request with streaming
-                async with client.stream(**request_kwargs) as response:
-                    # Send headers first
-                    response_headers = await headers_to_dict(response.headers)
-                    headers_json = json.dumps({
-                        "type": "headers",
-                        "status": response.status_code,
-                        "statusText": httpx.codes.get_reason_phrase(response.status_code),
-                        "headers": response_headers
-                    }) + "\n"
-                    
-                    yield headers_json.encode("utf-8")
-                    
-                    # Stream the body in chunks
-                    async for chunk in response.aiter_bytes():
-                        chunk_json = json.dumps({
-                            "type": "chunk",
-                            "data": chunk.decode("utf-8", errors="replace")
-                        }) + "\n"
-                        yield chunk_json.encode("utf-8")
-                    
-                    # End marker
-                    end_json = json.dumps({"type": "end"}) + "\n"
-                    yield end_json.encode("utf-8")
+                # Make the request with streaming over the shared connection pool
+                client = get_client()
+                async with http_pool.host_slot(target_url) as slot:
+                    async with stream_within(client, client.build_request(**request_kwargs), deadline, True) as response:
+                        slot.record_status(response.status_code)
+                        
+                        # Track the open response so shutdown can close it
+                        active_connections[connection_id] = response
+                        
+                        # Send headers first, then the body in chunks, copying cacheable bodies as they pass
+                        response_headers = await headers_to_dict(response.headers)
+                        tee = start_stream_fill(cache_key, fill, response, response_headers, headers)
+                        chunks = tee_upstream_body(response, cache_key, tee, headers, target_url)
+                        # The body is relayed decoded, like followers and cache hits get it
+                        async for frame in relay_stream(response.status_code, decoded_body_headers(response_headers), chunks, framed):
+                            yield frame
             
             except Exception as e:
-                error_json = json.dumps({
-                    "type": "error",
-                    "error": str(e)
-                }) + "\n"
-                yield error_json.encode("utf-8")
+                yield stream_error_frame(e, framed)
             
             finally:
                 # Clean up
                 if connection_id in active_connections:
                     del active_connections[connection_id]
-                if client:
-                    await client.aclose()
+                release_stream()
         
-        # Return a streaming response
+        # Return a streaming response; the background task cleans up if the body never starts
         return StreamingResponse(
             stream_response(),
-            media_type="application/x-ndjson"
+            media_type=media_type,
+            background=BackgroundTask(release_stream)
         )
     
     except Exception as e:
@@ -392,9 +2109,289 @@ async def bare_proxy_stream(request: Request):
             content={"error": "Internal Server Error", "message": str(e)}
         )
 
+# Raw Bare v2 endpoint: target and headers come in X-Bare-* headers and bodies stream as bytes
+@router.api_route("/v2/", methods=["POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"])
+async def bare_proxy_raw(request: Request):
+    # Update metrics
+    request_metrics['total_requests'] += 1
+    request_id = request.headers.get('x-request-id') or f"req_{time.time()}_{id(request)}"
+    target_url = None
+    
+    try:
+        target_url = bare_target_url(request.headers)
+        method = request.headers.get('x-bare-method', request.method).upper()
+        upstream_headers = bare_upstream_headers(request)
+    except (KeyError, ValueError) as e:
+        request_metrics['failed_requests'] += 1
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Bad Request", "message": str(e), "request_id": request_id}
+        )
+    
+    logger.info(f"Raw proxying {method} request to: {target_url} (ID: {request_id})")
+    request.state.upstream_host = metrics.host_label(target_url)
+    
+    # One deadline covers range chunk fetches, queueing and the upstream request
+    deadline = Deadline.for_request(None, request.headers, DEFAULT_TIMEOUT)
+    
+    # Single byte ranges are answered from cached chunks, fetching missing ones on demand
+    if ENABLE_CACHING and RANGE_CACHE_ENABLED and method == 'GET' and get_header(upstream_headers, 'range') is not None:
+        try:
+            partial = await serve_range(target_url, upstream_headers, deadline)
+        except (httpx.RequestError, asyncio.TimeoutError, HostUnavailable, BodyTooLarge) as e:
+            # The normal path below reports the failure
+            logger.warning(f"Range cache fetch failed for {target_url}: {str(e)} (ID: {request_id})")
+            partial = None
+        if partial is not None:
+            request_metrics['successful_requests'] += 1
+            return raw_partial_response(request, partial)
+    
+    # Fresh cached copies are served straight from the cache
+    if ENABLE_CACHING and method in ['GET', 'HEAD'] and not has_client_conditionals(upstream_headers):
+        request_directives = parse_cache_control(get_header(upstream_headers, 'cache-control'))
+        if 'no-cache' not in request_directives:
+            cache_key = resolve_cache_key(method, target_url, upstream_headers)
+            cached_response = await check_cache(cache_key, target_url, disk_files=True)
+            if cached_response and 'body_path' in cached_response:
+                disk_response = await raw_disk_response(request, method, cached_response)
+                if disk_response is None:
+                    # Evicted while it was looked up
+                    disk_cache.discard(cache_key)
+                else:
+                    logger.info(f"Disk cache hit for {target_url} (ID: {request_id})")
+                    request_metrics['successful_requests'] += 1
+                    return disk_response
+            elif cached_response:
+                logger.info(f"Cache hit for {target_url} (ID: {request_id})")
+                request_metrics['successful_requests'] += 1
+                return raw_cached_response(request, method, cached_response)
+    
+    # Stream the request body through unless there is none, rejecting it early when it is too large
+    content = None
+    if method not in ['GET', 'HEAD'] and (
+        request.headers.get('content-length', '0') != '0' or 'transfer-encoding' in request.headers
+    ):
+        try:
+            check_body_size(declared_length(request.headers) or 0, MAX_REQUEST_SIZE)
+        except BodyTooLarge as e:
+            request_metrics['failed_requests'] += 1
+            return JSONResponse(
+                status_code=413,
+                content={"error": "Payload Too Large", "message": str(e), "request_id": request_id}
+            )
+        content = limited_request_stream(request)
+    
+    # Hold the admission and per-host slots until the response body has been relayed
+    stack = AsyncExitStack()
+    slot = None
+    response = None
+    try:
+        deadline.check("before queueing")
+        await stack.enter_async_context(admission.slot(PRIORITY_INTERACTIVE, deadline.remaining()))
+        slot = await stack.enter_async_context(http_pool.host_slot(target_url))
+        client = get_client()
+        upstream_request = client.build_request(
+            method,
+            target_url,
+            headers=upstream_headers,
+            content=content
+        )
+        # Redirects are returned to the client, which follows them through the proxy
+        response = await send_within(client, upstream_request, deadline, follow_redirects=False)
+        stack.push_async_callback(response.aclose)
+        slot.record_status(response.status_code)
+        check_body_size(declared_length(response.headers) or 0, MAX_REQUEST_SIZE)
+    
+    except BodyTooLarge as e:
+        await stack.aclose()
+        request_metrics['failed_requests'] += 1
+        logger.error(f"Body too large for {target_url} (ID: {request_id}): {str(e)}")
+        # Once the upstream has answered, it is the response that is too large
+        response_too_large = response is not None
+        return JSONResponse(
+            status_code=502 if response_too_large else 413,
+            content={
+                "error": "Bad Gateway" if response_too_large else "Payload Too Large",
+                "message": str(e),
+                "request_id": request_id,
+                "url": target_url
+            }
+        )
+    
+    except HostUnavailable as e:
+        await stack.aclose()
+        request_metrics['failed_requests'] += 1
+        logger.warning(f"Failing fast for {target_url} (ID: {request_id}): {str(e)}")
+        return host_unavailable_response(e, request_id, target_url)
+    
+    except DeadlineExceeded as e:
+        # Running out of the client's budget says nothing about the host
+        if slot is not None:
+            slot.abandon()
+        await stack.aclose()
+        request_metrics['failed_requests'] += 1
+        logger.error(f"Request for {target_url} abandoned (ID: {request_id}): {str(e)}")
+        return JSONResponse(
+            status_code=504,
+            content={
+                "error": "Gateway Timeout",
+                "message": str(e),
+                "request_id": request_id,
+                "url": target_url
+            }
+        )
+    
+    except httpx.TimeoutException as e:
+        # The slot is released outside its block, so report the error to the breaker first
+        if slot is not None:
+            slot.record_error(e)
+        await stack.aclose()
+        request_metrics['failed_requests'] += 1
+        logger.error(f"Request timeout for URL: {target_url} (ID: {request_id})")
+        return JSONResponse(
+            status_code=504,
+            content={
+                "error": "Gateway Timeout",
+                "message": "The request timed out",
+                "request_id": request_id,
+                "url": target_url
+            }
+        )
+    
+    except httpx.RequestError as e:
+        if slot is not None:
+            slot.record_error(e)
+        await stack.aclose()
+        request_metrics['failed_requests'] += 1
+        logger.error(f"Request error for {target_url} (ID: {request_id}): {str(e)}")
+        return JSONResponse(
+            status_code=502,
+            content={
+                "error": "Bad Gateway",
+                "message": str(e),
+                "request_id": request_id,
+                "url": target_url
+            }
+        )
+    
+    except Exception as e:
+        await stack.aclose()
+        request_metrics['failed_requests'] += 1
+        logger.error(f"Raw proxy error for {target_url} (ID: {request_id}): {str(e)}")
+        return JSONResponse(
+            status_code=500,
+            content={
+                "error": "Internal Server Error",
+                "message": str(e),
+                "request_id": request_id,
+                "url": target_url
+            }
+        )
+    
+    request_metrics['successful_requests'] += 1
+    response_headers = await headers_to_dict(response.headers)
+    
+    # Passthrough: forward compressed bytes untouched when the client can decode them itself
+    upstream_encoding = (response.headers.get('content-encoding') or '').lower()
+    passthrough = (
+        request.headers.get('x-bare-passthrough', 'true').lower() != 'false'
+        and upstream_encoding not in ('', 'identity')
+        and accepts_encoding(request.headers.get('accept-encoding'), upstream_encoding)
+    )
+    pass_values = {}
+    if passthrough or upstream_encoding in ('', 'identity'):
+        for name in ('content-encoding', 'content-length'):
+            if name in response.headers:
+                pass_values[name] = response.headers[name]
+    
+    headers = bare_response_headers(request, response.status_code, response_headers, pass_values)
+    status_code = bare_response_status(request, response.status_code)
+    
+    if method == 'HEAD':
+        await stack.aclose()
+        return Response(status_code=status_code, headers=headers)
+    
+    # Track the open response so shutdown can close it
+    connection_id = f"conn_{time.time()}_{id(request)}"
+    active_connections[connection_id] = response
+    
+    received = metrics.upstream_bytes(request.state.upstream_host)
+    
+    async def relay_body():
+        try:
+            relayed = 0
+            chunks = response.aiter_raw() if passthrough else response.aiter_bytes()
+            # Compressed passthrough bytes are not scanned; decoded pages are
+            scan = None if passthrough else start_prefetch_scan(method, response, upstream_headers)
+            async for chunk in chunks:
+                # Abort the transfer once an undeclared body crosses the limit
+                relayed += len(chunk)
+                received.inc(len(chunk))
+                check_body_size(relayed, MAX_REQUEST_SIZE)
+                if scan is not None:
+                    scan(chunk)
+                yield chunk
+        finally:
+            active_connections.pop(connection_id, None)
+            await stack.aclose()
+    
+    return StreamingResponse(relay_body(), status_code=status_code, headers=headers)
+
+# WebSocket tunnel: the target comes from bare_* query parameters (assets/uv/bare.js) or X-Bare-* headers
+@router.websocket("/")
+@router.websocket("/v2/")
+async def bare_websocket(websocket: WebSocket):
+    connection_id = f"ws_{time.time()}_{id(websocket)}"
+    try:
+        target_url = bare_websocket_url(websocket)
+        upstream_headers = {
+            name: value for name, value in bare_upstream_headers(websocket).items()
+            if not name.lower().startswith('sec-websocket-') and name.lower() != 'host'
+        }
+    except (KeyError, ValueError) as e:
+        logger.warning(f"Rejecting WebSocket tunnel: {str(e)}")
+        await websocket.close(code=1008)
+        return
+    
+    logger.info(f"Opening WebSocket tunnel to: {target_url} (ID: {connection_id})")
+    
+    # Connect upstream before accepting so the client sees the subprotocol the upstream picked
+    try:
+        upstream = await websockets.connect(
+            target_url,
+            extra_headers=upstream_headers,
+            subprotocols=websocket.scope.get('subprotocols') or None,
+            open_timeout=DEFAULT_TIMEOUT,
+            max_size=WS_MAX_MESSAGE_BYTES,
+            max_queue=WS_QUEUE_SIZE
+        )
+    except Exception as e:
+        logger.error(f"WebSocket upstream connection failed for {target_url} (ID: {connection_id}): {str(e)}")
+        tunnel_metrics['errors'] += 1
+        await websocket.close(code=1011)
+        return
+    
+    await websocket.accept(subprotocol=upstream.subprotocol)
+    tunnel = WebSocketTunnel(websocket, upstream, idle_timeout=WS_IDLE_TIMEOUT, max_bytes=WS_MAX_BYTES)
+    
+    # Track the tunnel so shutdown can close it
+    active_connections[connection_id] = tunnel
+    try:
+        await tunnel.run()
+    finally:
+        active_connections.pop(connection_id, None)
+        logger.info(
+            f"WebSocket tunnel to {target_url} closed with {tunnel.close_code}: "
+            f"{tunnel.bytes_up} bytes up, {tunnel.bytes_down} bytes down (ID: {connection_id})"
+        )
+
 # Meta endpoint to get bare server information
 @router.get("/")
-async def bare_server_info():
+async def bare_server_info(request: Request):
+    # Bare v2 clients also send GET requests with X-Bare-* headers here
+    if is_bare_raw_request(request):
+        return await bare_proxy_raw(request)
+    
     # Calculate metrics
     uptime = time.time() - request_metrics['start_time']
     requests_per_second = request_metrics['total_requests'] / max(1, uptime)
@@ -433,7 +2430,11 @@ async def bare_server_info():
 
 # META endpoint to get server specifications
 @router.get("/v2/")
-async def bare_server_v2_info():
+async def bare_server_v2_info(request: Request):
+    # GET requests carrying X-Bare-* headers are proxied rather than answered
+    if is_bare_raw_request(request):
+        return await bare_proxy_raw(request)
+    
     # Calculate metrics
     uptime = time.time() - request_metrics['start_time']
     requests_per_second = request_metrics['total_requests'] / max(1, uptime)
@@ -463,8 +2464,51 @@ async def bare_server_v2_info():
             "cache": {
                 "enabled": ENABLE_CACHING,
                 "ttl": CACHE_TTL,
-                "size": len(response_cache)
-            }
+                "size": len(response_cache),
+                "bytes": response_cache.bytes,
+                "hits": response_cache.counters['hits'],
+                "misses": response_cache.counters['misses'],
+                "stale": response_cache.counters['stale_hits'],
+                "stale_if_error": response_cache.counters['stale_if_error'],
+                "revalidated": response_cache.counters['revalidated'],
+                "background_refreshes": response_cache.counters['background_refreshes'],
+                "stale_while_revalidate": CACHE_STALE_WHILE_REVALIDATE,
+                "stale_if_error_window": CACHE_STALE_IF_ERROR,
+                "disk": {
+                    "enabled": disk_cache is not None,
+                    "size": len(disk_cache) if disk_cache is not None else 0,
+                    "bytes": disk_cache.bytes if disk_cache is not None else 0
+                }
+            },
+            "memory": {
+                "max_request_size": MAX_REQUEST_SIZE,
+                "spool_threshold": SPOOL_THRESHOLD,
+                **buffer_metrics
+            },
+            "websockets": {
+                "idle_timeout": WS_IDLE_TIMEOUT,
+                "max_bytes": WS_MAX_BYTES,
+                **tunnel_metrics
+            },
+            "pool": http_pool.get_pool_stats(),
+            "admission": admission.stats(),
+            "deadlines": {
+                "default": DEFAULT_TIMEOUT,
+                "connect": CONNECT_TIMEOUT,
+                "read": READ_TIMEOUT,
+                "pool": POOL_TIMEOUT,
+                "max": MAX_DEADLINE,
+                **deadline_metrics
+            },
+            "breakers": {
+                **http_pool.get_breaker_stats(),
+                "negative_cache": {
+                    "size": len(negative_cache),
+                    "hits": negative_cache.counters['hits'],
+                    "inserts": negative_cache.counters['inserts']
+                }
+            },
+            "coalescing": upstream_flights.stats()
         }
     }
 
@@ -483,6 +2527,24 @@ async def clear_cache(
     # Clear the cache
     cache_size = len(response_cache)
     response_cache.clear()
+    negative_cache.clear()
+    hot_keys.clear()
+    hot_hosts.clear()
+    prefetcher.clear()
+    host_frequency.clear()
+    if cache_snapshot is not None:
+        # Stop restoring; the background restore finishes on its next batch
+        cache_size += len(cache_snapshot)
+        cache_snapshot.close()
+    if CACHE_SNAPSHOT_PATH:
+        try:
+            os.unlink(CACHE_SNAPSHOT_PATH)
+        except FileNotFoundError:
+            pass
+    if disk_cache is not None:
+        cache_size += await disk_cache.clear()
+    if shared_state.store is not None:
+        cache_size += await shared_state.store.cache_clear()
     
     return {
         "success": True,
@@ -490,10 +2552,170 @@ async def clear_cache(
         "timestamp": time.time()
     }
 
+# Endpoint to warm the cache in the background from a URL list or the games/ manifest
+@router.post("/cache/warm")
+async def warm_cache(
+    request: Request,
+    is_valid_service: bool = Depends(validate_service_token)
+):
+    if not is_valid_service:
+        return JSONResponse(
+            status_code=status.HTTP_403_FORBIDDEN,
+            content={"error": "Forbidden", "message": "Invalid service token"}
+        )
+    if not ENABLE_CACHING:
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content={"error": "Conflict", "message": "Caching is disabled"}
+        )
+    
+    try:
+        warm_request = WarmRequest.model_validate_json(await read_limited_body(request))
+    except ValidationError as e:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Bad Request", "message": str(e)}
+        )
+    
+    # Explicit URLs first, then a supplied manifest, then the manifest built from games/
+    urls: Dict[str, None] = {}
+    candidates = list(warm_request.urls)
+    if warm_request.manifest is not None:
+        candidates += [url for url in warm_request.manifest.get('urls', []) if isinstance(url, str)]
+    if warm_request.games:
+        manifest = await asyncio.to_thread(build_games_manifest, GAMES_DIR, warm_request.base_url)
+        candidates += manifest['urls']
+    for url in candidates:
+        if url.startswith(('http://', 'https://')):
+            urls[url] = None
+    if not urls:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Bad Request", "message": "No http(s) URLs to warm"}
+        )
+    if len(urls) > WARM_MAX_URLS:
+        return JSONResponse(
+            status_code=413,
+            content={"error": "Payload Too Large", "message": f"At most {WARM_MAX_URLS} URLs can be warmed per job"}
+        )
+    
+    # Keep the most recent job statuses only
+    while len(warm_jobs) >= WARM_MAX_JOBS:
+        oldest_id, oldest = next(iter(warm_jobs.items()))
+        if oldest.task is not None and not oldest.task.done():
+            break
+        warm_jobs.pop(oldest_id)
+        await warm_status.pop(oldest_id, None)
+    
+    concurrency = min(warm_request.concurrency or WARM_CONCURRENCY, WARM_MAX_CONCURRENCY)
+    bandwidth = warm_request.bandwidth if warm_request.bandwidth is not None else WARM_BANDWIDTH
+    if WARM_BANDWIDTH > 0:
+        bandwidth = min(bandwidth, WARM_BANDWIDTH) if bandwidth > 0 else WARM_BANDWIDTH
+    headers = dict(warm_request.headers or {})
+    
+    job = WarmJob(list(urls), concurrency, lambda snapshot: warm_status.set(snapshot['job_id'], snapshot))
+    warm_jobs[job.id] = job
+    job.task = asyncio.ensure_future(job.run(
+        lambda url: warm_url(url, headers),
+        wait_for_idle_capacity,
+        TokenBucket(bandwidth)
+    ))
+    logger.info(f"Started cache warm-up {job.id} for {len(urls)} URLs (concurrency {concurrency}, {bandwidth or 'unlimited'} B/s)")
+    
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={
+            "job_id": job.id,
+            "state": job.state,
+            "total": len(urls),
+            "concurrency": concurrency,
+            "bandwidth": bandwidth,
+            "status_url": request.app.url_path_for("cache_warm_status", job_id=job.id)
+        }
+    )
+
+# Endpoint to list recent warm-up jobs
+@router.get("/cache/warm")
+async def cache_warm_jobs(
+    request: Request,
+    is_valid_service: bool = Depends(validate_service_token)
+):
+    if not is_valid_service:
+        return JSONResponse(
+            status_code=status.HTTP_403_FORBIDDEN,
+            content={"error": "Forbidden", "message": "Invalid service token"}
+        )
+    
+    jobs = sorted((snapshot for _, snapshot in await warm_status.items()), key=lambda snapshot: snapshot['created_at'])
+    return {"jobs": jobs, **warm_metrics}
+
+# Endpoint to preview the manifest built from the games/ directory
+@router.get("/cache/warm/manifest")
+async def cache_warm_manifest(
+    request: Request,
+    base_url: Optional[str] = None,
+    is_valid_service: bool = Depends(validate_service_token)
+):
+    if not is_valid_service:
+        return JSONResponse(
+            status_code=status.HTTP_403_FORBIDDEN,
+            content={"error": "Forbidden", "message": "Invalid service token"}
+        )
+    
+    return await asyncio.to_thread(build_games_manifest, GAMES_DIR, base_url)
+
+# Endpoint to report the progress of one warm-up job, whichever worker runs it
+@router.get("/cache/warm/{job_id}", name="cache_warm_status")
+async def cache_warm_status(
+    job_id: str,
+    request: Request,
+    is_valid_service: bool = Depends(validate_service_token)
+):
+    if not is_valid_service:
+        return JSONResponse(
+            status_code=status.HTTP_403_FORBIDDEN,
+            content={"error": "Forbidden", "message": "Invalid service token"}
+        )
+    
+    job = warm_jobs.get(job_id)
+    snapshot = job.snapshot() if job is not None else await warm_status.get(job_id)
+    if snapshot is None:
+        return JSONResponse(
+            status_code=404,
+            content={"error": "Not Found", "message": f"No warm-up job {job_id}"}
+        )
+    return snapshot
+
+# Endpoint to cancel a running warm-up job
+@router.delete("/cache/warm/{job_id}")
+async def cancel_cache_warm(
+    job_id: str,
+    request: Request,
+    is_valid_service: bool = Depends(validate_service_token)
+):
+    if not is_valid_service:
+        return JSONResponse(
+            status_code=status.HTTP_403_FORBIDDEN,
+            content={"error": "Forbidden", "message": "Invalid service token"}
+        )
+    
+    job = warm_jobs.get(job_id)
+    if job is None:
+        # Jobs run in the worker that accepted them
+        return JSONResponse(
+            status_code=404,
+            content={"error": "Not Found", "message": f"No warm-up job {job_id} in this worker"}
+        )
+    if job.task is not None and not job.task.done():
+        job.task.cancel()
+        await asyncio.wait([job.task], timeout=5)
+    return job.snapshot()
+
 # Endpoint to get cache stats
 @router.get("/cache/stats")
 async def cache_stats(
     request: Request,
+    top: int = 10,
     is_valid_service: bool = Depends(validate_service_token)
 ):
     if not is_valid_service:
@@ -502,34 +2724,94 @@ async def cache_stats(
             content={"error": "Forbidden", "message": "Invalid service token"}
         )
     
-    # Calculate cache stats
-    cache_size = len(response_cache)
-    cache_keys = list(response_cache.keys())
-    cache_age = [time.time() - response_cache[k]['timestamp'] for k in cache_keys[:100]]
+    # Exact counters maintained by the cache itself
+    stats = response_cache.stats()
     
     return {
         "enabled": ENABLE_CACHING,
         "ttl": CACHE_TTL,
-        "size": cache_size,
-        "hits": request_metrics['cache_hits'],
-        "hit_ratio": request_metrics['cache_hits'] / max(1, request_metrics['total_requests']),
-        "avg_age": sum(cache_age) / max(1, len(cache_age)) if cache_age else 0,
-        "oldest": max(cache_age) if cache_age else 0,
-        "newest": min(cache_age) if cache_age else 0
+        "size": stats["entries"],
+        **stats,
+        "hottest_keys": [
+            {"key": item["key"], "url": item["label"], "estimate": item["estimate"], "cached": item["key"] in response_cache}
+            for item in hot_keys.top(top)
+        ],
+        "hottest_hosts": [
+            {"host": item["key"], "estimate": item["estimate"]}
+            for item in hot_hosts.top(top)
+        ],
+        "prefetch": {"enabled": PREFETCH_ENABLED, **prefetcher.stats()},
+        "ranges": {"enabled": RANGE_CACHE_ENABLED, "chunk_size": RANGE_CHUNK_SIZE, **range_metrics},
+        "streams": stream_fills.stats(),
+        "disk": disk_cache.stats() if disk_cache is not None else None,
+        "snapshot": {
+            "enabled": bool(CACHE_SNAPSHOT_PATH),
+            "interval": CACHE_SNAPSHOT_INTERVAL,
+            "restoring": cache_snapshot.stats() if cache_snapshot is not None else None,
+            **snapshot_metrics
+        } if CACHE_SNAPSHOT_PATH else None,
+        "shared": await asyncio.to_thread(shared_state.store.stats) if shared_state.store is not None else None
     }
 
+# Open the disk cache tier and start restoring the last cache snapshot before serving requests
+@router.on_event("startup")
+async def startup_event():
+    global cache_snapshot
+    if disk_cache is not None:
+        try:
+            await disk_cache.open()
+        except Exception as e:
+            logger.error(f"Failed to open disk cache at {DISK_CACHE_DIR}: {str(e)}")
+    if CACHE_SNAPSHOT_PATH and ENABLE_CACHING:
+        # Only the index is read here; entries are restored in the background or on demand
+        snapshot = CacheSnapshot(CACHE_SNAPSHOT_PATH)
+        if await asyncio.to_thread(snapshot.open) and len(snapshot):
+            cache_snapshot = snapshot
+            logger.info(f"Restoring up to {len(snapshot)} cache entries from {CACHE_SNAPSHOT_PATH} "
+                        f"({snapshot.counters['expired']} expired)")
+            snapshot_tasks.add(asyncio.ensure_future(restore_cache_snapshot()))
+        else:
+            snapshot.close()
+        if CACHE_SNAPSHOT_INTERVAL > 0:
+            snapshot_tasks.add(asyncio.ensure_future(snapshot_periodically()))
+
 # Cleanup background task
 @router.on_event("shutdown")
 async def shutdown_event():
-    # Close any active connections
-    for conn_id, client in active_connections.items():
+    # Close any active streamed responses and WebSocket tunnels
+    for conn_id, connection in list(active_connections.items()):
         try:
-            await client.aclose()
+            await connection.aclose()
         except Exception as e:
             logger.error(f"Error closing connection {conn_id}: {str(e)}")
     
     # Clear the connections dictionary
     active_connections.clear()
     
+    # Stop any background cache refreshes
+    for task in list(refresh_tasks):
+        task.cancel()
+    
+    # Stop warm-ups and background prefetches, then flush pending disk and shared cache writes
+    for job in warm_jobs.values():
+        if job.task is not None and not job.task.done():
+            job.task.cancel()
+    await prefetcher.close()
+    
+    # Stop the snapshot tasks and write a final snapshot for the next start
+    for task in list(snapshot_tasks):
+        task.cancel()
+    if snapshot_tasks:
+        await asyncio.gather(*snapshot_tasks, return_exceptions=True)
+        snapshot_tasks.clear()
+    if CACHE_SNAPSHOT_PATH and ENABLE_CACHING:
+        await save_cache_snapshot()
+    
+    if disk_cache is not None:
+        await disk_cache.close()
+    if shared_cache_tasks:
+        await asyncio.wait(list(shared_cache_tasks), timeout=5)
+    
     # Log final stats
     logger.info(f"Proxy server shutting down. Final stats: {request_metrics}")
+    logger.info(f"Upstream pool stats at shutdown: {http_pool.get_pool_stats()}")
@@ -0,0 +1,63 @@
+import os
+import logging
+import uvicorn
+from dotenv import load_dotenv
+
+# Load environment variables before the worker settings are read
+load_dotenv()
+
+# uvloop and httptools are optional; uvicorn's asyncio loop and h11 parser are the fallback
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
+try:
+    import httptools
+    HTTPTOOLS_AVAILABLE = True
+except ImportError:
+    HTTPTOOLS_AVAILABLE = False
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("serve")
+
+# Configure constants from environment variables with defaults
+HOST = os.getenv("PYTHON_PROXY_HOST", "0.0.0.0")
+PORT = int(os.getenv("PYTHON_PROXY_PORT", "6078"))
+WORKERS = int(os.getenv("PYTHON_PROXY_WORKERS", str(os.cpu_count() or 1)))
+GRACEFUL_SHUTDOWN_TIMEOUT = int(os.getenv("PYTHON_PROXY_GRACEFUL_TIMEOUT", "30"))  # seconds to drain in-flight requests
+KEEPALIVE_TIMEOUT = int(os.getenv("PYTHON_PROXY_KEEPALIVE_TIMEOUT", "5"))  # seconds an idle client connection stays open
+DEFAULT_SHARED_STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "shared_state.sqlite3")
+
+# Production entry point: N workers behind one listening socket, each draining in-flight requests on shutdown
+def main() -> None:
+    if WORKERS > 1:
+        # Workers inherit the environment, so they all open the same shared store
+        os.environ.setdefault("SHARED_STATE_PATH", DEFAULT_SHARED_STATE_PATH)
+        if os.getenv("PROXY_DISK_CACHE_DIR"):
+            logger.warning("PROXY_DISK_CACHE_DIR keeps a per-process index and should not be shared between workers; "
+                           "the shared cache tier already serves every worker")
+
+    logger.info(
+        f"Starting {WORKERS} worker(s) on {HOST}:{PORT} "
+        f"(loop: {'uvloop' if UVLOOP_AVAILABLE else 'asyncio'}, http: {'httptools' if HTTPTOOLS_AVAILABLE else 'h11'}, "
+        f"shared state: {os.getenv('SHARED_STATE_PATH') or 'process-local'})"
+    )
+
+    uvicorn.run(
+        "main:app",
+        host=HOST,
+        port=PORT,
+        workers=WORKERS,
+        loop="uvloop" if UVLOOP_AVAILABLE else "asyncio",
+        http="httptools" if HTTPTOOLS_AVAILABLE else "h11",
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_TIMEOUT,
+        timeout_keep_alive=KEEPALIVE_TIMEOUT,
+        access_log=False,
+        proxy_headers=True
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import asyncio
+import pytest
+from utils.admission import AdmissionController, Overloaded, PRIORITY_INTERACTIVE, PRIORITY_BULK, PROXY_HOST
+from utils.circuit_breaker import HostUnavailable
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_disabled_controller_admits_everything():
+    async def scenario():
+        controller = AdmissionController(0, 0, 1.0)
+        leases = [await controller.acquire(PRIORITY_BULK) for _ in range(10)]
+        for lease in leases:
+            lease.release()
+        return controller
+    controller = run(scenario())
+    assert not controller.enabled
+    assert controller.counters["admitted"] == 0
+    assert controller.in_flight == [0, 0]
+
+def test_release_is_idempotent():
+    async def scenario():
+        controller = AdmissionController(2, 4, 1.0)
+        lease = await controller.acquire(PRIORITY_INTERACTIVE)
+        lease.release()
+        lease.release()
+        return controller
+    controller = run(scenario())
+    assert controller.in_flight == [0, 0]
+
+def test_freed_slots_go_to_interactive_waiters_first():
+    async def scenario():
+        controller = AdmissionController(1, 4, 5.0)
+        order = []
+
+        async def request(name, priority):
+            async with controller.slot(priority):
+                order.append(name)
+
+        holder = await controller.acquire(PRIORITY_INTERACTIVE)
+        tasks = [
+            asyncio.ensure_future(request("bulk", PRIORITY_BULK)),
+            asyncio.ensure_future(request("interactive", PRIORITY_INTERACTIVE))
+        ]
+        await settle()
+        assert controller.queue_depth == 2
+        holder.release()
+        await asyncio.gather(*tasks)
+        return controller, order
+    controller, order = run(scenario())
+    assert order == ["interactive", "bulk"]
+    assert controller.counters["queued"] == 2
+
+def test_bulk_requests_hold_at_most_their_share():
+    async def scenario():
+        controller = AdmissionController(2, 4, 5.0, bulk_share=0.5)
+        first = await controller.acquire(PRIORITY_BULK)
+        second = asyncio.ensure_future(controller.acquire(PRIORITY_BULK))
+        await settle()
+        # The remaining slot stays free for interactive requests
+        assert not second.done()
+        interactive = await controller.acquire(PRIORITY_INTERACTIVE)
+        first.release()
+        lease = await second
+        lease.release()
+        interactive.release()
+        return controller
+    controller = run(scenario())
+    assert controller.bulk_limit == 1
+    assert controller.counters["peak_in_flight"] == 2
+    assert controller.in_flight == [0, 0]
+
+def test_full_queue_sheds_at_once():
+    async def scenario():
+        controller = AdmissionController(1, 1, 5.0)
+        holder = await controller.acquire(PRIORITY_INTERACTIVE)
+        waiter = asyncio.ensure_future(controller.acquire(PRIORITY_INTERACTIVE))
+        await settle()
+        with pytest.raises(Overloaded) as shed:
+            await controller.acquire(PRIORITY_INTERACTIVE)
+        holder.release()
+        (await waiter).release()
+        return controller, shed.value
+    controller, error = run(scenario())
+    assert controller.counters["shed_queue_full"] == 1
+    assert isinstance(error, HostUnavailable)
+    assert error.host == PROXY_HOST
+    assert error.retry_after >= 1.0
+    assert str(error) == "Proxy overloaded: admission queue full"
+
+def test_waiter_is_shed_when_its_timeout_passes():
+    async def scenario():
+        controller = AdmissionController(1, 4, 5.0)
+        holder = await controller.acquire(PRIORITY_INTERACTIVE)
+        with pytest.raises(Overloaded):
+            await controller.acquire(PRIORITY_BULK, 0.05)
+        depth = controller.queue_depth
+        holder.release()
+        return controller, depth
+    controller, depth = run(scenario())
+    assert depth == 0
+    assert controller.counters["shed_timeout"] == 1
+    assert controller.in_flight == [0, 0]
+
+def test_no_time_left_sheds_without_queueing():
+    async def scenario():
+        controller = AdmissionController(1, 4, 5.0)
+        holder = await controller.acquire(PRIORITY_INTERACTIVE)
+        with pytest.raises(Overloaded) as shed:
+            await controller.acquire(PRIORITY_INTERACTIVE, 0)
+        holder.release()
+        return controller, shed.value
+    controller, error = run(scenario())
+    assert error.reason == "no time left to queue"
+    assert controller.counters["queued"] == 0
+    assert controller.counters["shed_timeout"] == 1
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        controller = AdmissionController(1, 4, 5.0)
+        holder = await controller.acquire(PRIORITY_INTERACTIVE)
+        waiter = asyncio.ensure_future(controller.acquire(PRIORITY_INTERACTIVE))
+        await settle()
+        waiter.cancel()
+        await settle()
+        depth = controller.queue_depth
+        holder.release()
+        return controller, depth
+    controller, depth = run(scenario())
+    assert depth == 0
+    assert controller.in_flight == [0, 0]
@@ -0,0 +1,97 @@
+from utils.cache import TinyLFUCache
+
+def entry(name: str):
+    return {"body": name, "timestamp": 1.0}
+
+# Bounded by bytes: the window holds one 100-byte entry and the main region nine. The entry cap is
+# generous so the frequency sketch is wide enough for estimates not to collide
+def make_cache(max_entries: int = 1000, max_bytes: int = 1000, max_object_bytes: int = 100) -> TinyLFUCache:
+    return TinyLFUCache(max_bytes, max_entries, max_object_bytes)
+
+def segment_entries(cache: TinyLFUCache, name: str) -> int:
+    return cache.stats()["segments"][name]["entries"]
+
+def test_window_holds_the_largest_admissible_object():
+    cache = make_cache(max_bytes=1000, max_object_bytes=100)
+    assert cache.window_max_bytes == 100
+    assert cache.put("big", entry("big"), size=100)
+    assert "big" in cache
+
+def test_window_is_capped_at_half_the_budget():
+    cache = make_cache(max_bytes=1000, max_object_bytes=800)
+    assert cache.window_max_bytes == 500
+
+def test_oversized_object_is_rejected():
+    cache = make_cache()
+    assert not cache.put("huge", entry("huge"), size=101)
+    assert "huge" not in cache
+    assert cache.counters["rejected"] == 1
+
+def test_oversized_replacement_drops_the_stale_copy():
+    cache = make_cache()
+    assert cache.put("key", entry("old"), size=50)
+    assert not cache.put("key", entry("new"), size=500)
+    assert "key" not in cache
+
+def test_new_entries_start_in_the_window():
+    cache = make_cache()
+    cache.put("first", entry("first"), size=100)
+    assert segment_entries(cache, "window") == 1
+    cache.put("second", entry("second"), size=100)
+    # The window holds one entry, so the first moved on to probation while the main region had room
+    assert segment_entries(cache, "window") == 1
+    assert segment_entries(cache, "probation") == 1
+    assert cache.counters["admitted"] == 1
+
+def test_hit_in_probation_promotes_to_protected():
+    cache = make_cache()
+    cache.put("first", entry("first"), size=100)
+    cache.put("second", entry("second"), size=100)
+    assert cache.get("first") == entry("first")
+    assert segment_entries(cache, "probation") == 0
+    assert segment_entries(cache, "protected") == 1
+
+def test_scan_of_one_off_keys_does_not_flush_frequent_entries():
+    cache = make_cache()
+    hot = [f"hot{i}" for i in range(9)]
+    for key in hot:
+        cache.put(key, entry(key), size=100)
+    for _ in range(5):
+        for key in hot:
+            assert cache.get(key) is not None
+
+    for i in range(50):
+        cache.put(f"scan{i}", entry(f"scan{i}"), size=100)
+
+    assert all(key in cache for key in hot)
+    assert cache.counters["admission_rejected"] > 0
+    assert cache.bytes <= cache.max_bytes
+
+def test_frequent_newcomer_displaces_cold_entries():
+    cache = make_cache()
+    for i in range(10):
+        cache.put(f"cold{i}", entry(f"cold{i}"), size=100)
+    # Misses are counted too, so a key requested often before it is stored wins admission
+    for _ in range(3):
+        assert cache.get("popular") is None
+    cache.put("popular", entry("popular"), size=100)
+    cache.put("next", entry("next"), size=100)
+
+    assert "popular" in cache
+    assert "cold0" not in cache
+    assert cache.counters["evictions"] >= 1
+
+def test_byte_budget_is_respected():
+    cache = make_cache()
+    for i in range(100):
+        cache.get(f"key{i}")
+        cache.put(f"key{i}", entry(f"key{i}"), size=60)
+    assert cache.bytes <= cache.max_bytes
+
+def test_clear_empties_every_segment():
+    cache = make_cache()
+    for i in range(5):
+        cache.put(f"key{i}", entry(f"key{i}"), size=100)
+    cache.clear()
+    assert len(cache) == 0
+    assert all(segment["entries"] == 0 for segment in cache.stats()["segments"].values())
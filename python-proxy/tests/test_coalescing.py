@@ -0,0 +1,61 @@
+import asyncio
+import httpx
+import pytest
+from routers import proxy_router
+from utils.deadline import Deadline
+
+URL = "http://slow.test/page"
+
+class SlowOrigin:
+    """
+    Upstream that takes `delay` seconds to answer, counting the requests it gets
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.requests = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        await asyncio.sleep(self.delay)
+        return httpx.Response(200, headers={"cache-control": "max-age=60"}, content=b"slow body")
+
+@pytest.fixture
+def origin(monkeypatch):
+    origin = SlowOrigin(0.3)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(origin))
+    monkeypatch.setattr(proxy_router, "ENABLE_CACHING", True)
+    monkeypatch.setattr(proxy_router, "disk_cache", None)
+    monkeypatch.setattr(proxy_router, "get_client", lambda: client)
+    proxy_router.response_cache.clear()
+    yield origin
+    proxy_router.response_cache.clear()
+
+def fetch(deadline: float):
+    return proxy_router.proxy_bare_request(proxy_router.BareRequest(url=URL), "test", Deadline(deadline))
+
+def test_short_leader_deadline_does_not_fail_waiters(origin):
+    async def run():
+        leader = asyncio.ensure_future(fetch(0.1))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(fetch(5.0))
+        return await asyncio.gather(leader, waiter, return_exceptions=True)
+
+    leader, waiter = asyncio.run(run())
+    assert isinstance(leader, asyncio.TimeoutError)
+    assert waiter["status"] == 200
+    assert waiter["body"] == "slow body"
+    assert origin.requests == 1
+    assert not proxy_router.flight_deadlines
+
+def test_waiter_gives_up_at_its_own_deadline(origin):
+    async def run():
+        leader = asyncio.ensure_future(fetch(5.0))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(fetch(0.1))
+        return await asyncio.gather(leader, waiter, return_exceptions=True)
+
+    leader, waiter = asyncio.run(run())
+    assert leader["status"] == 200
+    assert isinstance(waiter, asyncio.TimeoutError)
+    assert origin.requests == 1
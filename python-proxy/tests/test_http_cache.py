@@ -0,0 +1,125 @@
+import asyncio
+import pytest
+from email.utils import formatdate
+from routers import proxy_router
+from utils.http_cache import (
+    is_cacheable, freshness_lifetime, stale_allowances, conditional_headers,
+    merge_not_modified_headers, parse_vary, shareable_headers
+)
+
+NOW = 1_700_000_000.0
+
+def http_date(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(proxy_router, "ENABLE_CACHING", True)
+    monkeypatch.setattr(proxy_router, "disk_cache", None)
+    proxy_router.response_cache.clear()
+    yield proxy_router.response_cache
+    proxy_router.response_cache.clear()
+
+def store(headers, request_headers=None, url="http://example.test/page"):
+    response = {"status": 200, "statusText": "OK", "headers": headers, "body": "hello", "timestamp": NOW, "cached": False}
+    asyncio.run(proxy_router.store_in_cache("unused", response, request_headers=request_headers, method="GET", url=url))
+
+def test_plain_response_is_cacheable():
+    assert is_cacheable(200, {"cache-control": "max-age=60"})
+
+def test_no_store_and_private_responses_are_not_cacheable():
+    assert not is_cacheable(200, {"cache-control": "no-store"})
+    assert not is_cacheable(200, {"Cache-Control": "private, max-age=60"})
+    assert not is_cacheable(200, {"cache-control": "max-age=60"}, {"cache-control": "no-store"})
+
+def test_authorized_responses_need_explicit_permission():
+    auth = {"authorization": "Bearer token"}
+    assert not is_cacheable(200, {"cache-control": "max-age=60"}, auth)
+    assert is_cacheable(200, {"cache-control": "public, max-age=60"}, auth)
+    assert is_cacheable(200, {"cache-control": "s-maxage=60"}, auth)
+
+def test_set_cookie_responses_are_only_shared_when_public():
+    assert not is_cacheable(200, {"cache-control": "max-age=60", "set-cookie": "sid=1"})
+    assert is_cacheable(200, {"cache-control": "public, max-age=60", "set-cookie": "sid=1"})
+
+def test_error_statuses_need_an_explicit_lifetime():
+    assert not is_cacheable(404, {})
+    assert is_cacheable(404, {"cache-control": "max-age=30"})
+    assert not is_cacheable(500, {"cache-control": "max-age=30"})
+
+def test_vary_star_and_unvalidated_no_cache_are_not_cacheable():
+    assert not is_cacheable(200, {"vary": "*"})
+    assert not is_cacheable(200, {"cache-control": "no-cache"})
+    assert is_cacheable(200, {"cache-control": "no-cache", "etag": '"v1"'})
+
+def test_s_maxage_beats_max_age_and_expires():
+    headers = {"cache-control": "max-age=10, s-maxage=100", "expires": http_date(NOW + 1000), "date": http_date(NOW)}
+    assert freshness_lifetime(headers, 300, NOW) == 100
+
+def test_expires_is_relative_to_date():
+    headers = {"expires": http_date(NOW + 120), "date": http_date(NOW)}
+    assert freshness_lifetime(headers, 300, NOW) == 120
+    assert freshness_lifetime({"expires": "not a date"}, 300, NOW) == 0
+
+def test_age_is_subtracted_from_the_lifetime():
+    assert freshness_lifetime({"cache-control": "max-age=60", "age": "45"}, 300, NOW) == 15
+    assert freshness_lifetime({"cache-control": "max-age=60", "age": "90"}, 300, NOW) == 0
+
+def test_heuristic_freshness_uses_a_tenth_of_the_last_modified_age():
+    headers = {"date": http_date(NOW), "last-modified": http_date(NOW - 1000)}
+    assert freshness_lifetime(headers, 300, NOW) == pytest.approx(100)
+    # Capped by the configured TTL, which is also the fallback without Last-Modified
+    headers = {"date": http_date(NOW), "last-modified": http_date(NOW - 100000)}
+    assert freshness_lifetime(headers, 300, NOW) == 300
+    assert freshness_lifetime({}, 300, NOW) == 300
+
+def test_no_cache_response_is_never_fresh():
+    assert freshness_lifetime({"cache-control": "no-cache, max-age=60"}, 300, NOW) == 0
+
+def test_stale_allowances_follow_directives():
+    assert stale_allowances({"cache-control": "stale-while-revalidate=30, stale-if-error=60"}, 5, 10) == (30.0, 60.0)
+    assert stale_allowances({}, 5, 10) == (5.0, 10.0)
+    assert stale_allowances({"cache-control": "max-age=60, must-revalidate"}, 5, 10) == (0.0, 0.0)
+
+def test_conditional_headers_come_from_stored_validators():
+    entry = {"headers": {"ETag": '"v1"', "Last-Modified": http_date(NOW)}}
+    assert conditional_headers(entry) == {"If-None-Match": '"v1"', "If-Modified-Since": http_date(NOW)}
+    assert conditional_headers({"headers": {}}) == {}
+
+def test_not_modified_updates_headers_except_body_and_cookie_ones():
+    stored = {"Content-Type": "text/html", "Cache-Control": "max-age=10", "ETag": '"v1"'}
+    fresh = {"cache-control": "max-age=60", "content-type": "text/plain", "set-cookie": "sid=1"}
+    merged = merge_not_modified_headers(stored, fresh)
+    assert merged == {"Content-Type": "text/html", "Cache-Control": "max-age=60", "ETag": '"v1"'}
+
+def test_shareable_headers_drop_cookies():
+    headers = {"Set-Cookie": "sid=1", "set-cookie2": "old=1", "Content-Type": "text/plain"}
+    assert shareable_headers(headers) == {"Content-Type": "text/plain"}
+
+def test_parse_vary_normalizes_names():
+    assert parse_vary({"Vary": "Accept-Encoding, accept ,ACCEPT"}) == ["accept", "accept-encoding"]
+
+def test_vary_splits_variants_under_a_marker(cache):
+    url = "http://example.test/page"
+    headers = {"cache-control": "max-age=60", "vary": "Accept-Language"}
+    store(headers, {"accept-language": "en"}, url)
+    store(headers, {"accept-language": "fr"}, url)
+
+    marker = cache.peek(proxy_router.generate_cache_key("GET", url, vary=[]))
+    assert marker["vary_marker"] and marker["vary"] == ["accept-language"]
+    english = proxy_router.resolve_cache_key("GET", url, {"accept-language": "en"})
+    french = proxy_router.resolve_cache_key("GET", url, {"Accept-Language": "fr"})
+    assert english != french
+    assert english in cache and french in cache
+    assert proxy_router.resolve_cache_key("GET", url, {"accept-language": "de"}) not in cache
+
+def test_stored_entries_never_keep_cookies(cache):
+    url = "http://example.test/cookie"
+    store({"cache-control": "public, max-age=60", "Set-Cookie": "sid=secret"}, url=url)
+    entry = cache.peek(proxy_router.resolve_cache_key("GET", url))
+    assert entry is not None
+    assert "Set-Cookie" not in entry["headers"]
+
+def test_uncacheable_responses_are_not_stored(cache):
+    store({"cache-control": "private, max-age=60"}, url="http://example.test/private")
+    assert len(cache) == 0
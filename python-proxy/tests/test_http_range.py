@@ -0,0 +1,129 @@
+import asyncio
+import httpx
+import pytest
+from email.utils import formatdate
+from routers import proxy_router
+from utils.http_range import parse_range, resolve_range, parse_content_range, if_range_matches
+
+DATA = bytes(range(20))
+ETAG = '"v1"'
+
+def test_parse_range_forms():
+    assert parse_range("bytes=0-99") == (0, 99)
+    assert parse_range("bytes=100-") == (100, None)
+    assert parse_range("bytes=-50") == (None, 50)
+    assert parse_range(" Bytes = 5-5") == (5, 5)
+
+def test_parse_range_passes_unsupported_headers_through():
+    assert parse_range(None) is None
+    assert parse_range("items=0-5") is None
+    assert parse_range("bytes=0-5,10-15") is None
+    assert parse_range("bytes=9-3") is None
+    assert parse_range("bytes=-0") is None
+    assert parse_range("bytes=abc") is None
+
+def test_resolve_range_clamps_to_the_object():
+    assert resolve_range((0, 99), 20) == (0, 19)
+    assert resolve_range((5, None), 20) == (5, 19)
+    # A suffix longer than the object is the whole object
+    assert resolve_range((None, 100), 20) == (0, 19)
+    assert resolve_range((None, 5), 20) == (15, 19)
+
+def test_unsatisfiable_ranges():
+    assert resolve_range((20, None), 20) is None
+    assert resolve_range((0, None), 0) is None
+    assert resolve_range((None, 5), 0) is None
+
+def test_parse_content_range():
+    assert parse_content_range("bytes 0-9/20") == (0, 9, 20)
+    assert parse_content_range("bytes 0-9/*") == (0, 9, None)
+    assert parse_content_range("bytes */20") is None
+    assert parse_content_range("bytes 0-20/20") is None
+    assert parse_content_range("items 0-9/20") is None
+
+def test_if_range_needs_a_strong_match():
+    assert if_range_matches(ETAG, {"ETag": ETAG})
+    assert not if_range_matches('W/"v1"', {"ETag": ETAG})
+    assert not if_range_matches(ETAG, {"ETag": 'W/"v1"'})
+    assert not if_range_matches('"v2"', {"ETag": ETAG})
+    modified = formatdate(1_700_000_000, usegmt=True)
+    assert if_range_matches(modified, {"Last-Modified": modified})
+
+class Origin:
+    """
+    Upstream serving DATA with a strong ETag, honouring Range unless If-Range does not match
+    """
+
+    def __init__(self):
+        self.ranges = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        headers = {"etag": ETAG, "cache-control": "max-age=60", "accept-ranges": "bytes"}
+        spec = parse_range(request.headers.get("range"))
+        if_range = request.headers.get("if-range")
+        if spec is None or (if_range is not None and not if_range_matches(if_range, headers)):
+            self.ranges.append(None)
+            return httpx.Response(200, headers=headers, content=DATA)
+        byte_range = resolve_range(spec, len(DATA))
+        if byte_range is None:
+            return httpx.Response(416, headers={"content-range": f"bytes */{len(DATA)}"})
+        start, end = byte_range
+        self.ranges.append((start, end))
+        headers["content-range"] = f"bytes {start}-{end}/{len(DATA)}"
+        return httpx.Response(206, headers=headers, content=DATA[start:end + 1])
+
+@pytest.fixture
+def origin(monkeypatch):
+    origin = Origin()
+    client = httpx.AsyncClient(transport=httpx.MockTransport(origin))
+    monkeypatch.setattr(proxy_router, "ENABLE_CACHING", True)
+    monkeypatch.setattr(proxy_router, "disk_cache", None)
+    monkeypatch.setattr(proxy_router, "RANGE_CHUNK_SIZE", 4)
+    monkeypatch.setattr(proxy_router, "get_client", lambda: client)
+    proxy_router.response_cache.clear()
+    yield origin
+    proxy_router.response_cache.clear()
+
+URL = "http://media.test/video.bin"
+
+def serve(range_header, **headers):
+    return asyncio.run(proxy_router.serve_range(URL, {"range": range_header, **headers}))
+
+def test_range_beyond_the_object_is_416(origin):
+    assert serve("bytes=0-3")["status"] == 206
+    response = serve("bytes=50-")
+    assert response["status"] == 416
+    assert response["headers"]["content-range"] == "bytes */20"
+
+def test_suffix_larger_than_the_object_returns_all_of_it(origin):
+    serve("bytes=0-3")
+    response = serve("bytes=-100")
+    assert response["status"] == 206
+    assert response["headers"]["content-range"] == "bytes 0-19/20"
+    assert response["body"] == DATA
+
+def test_weak_if_range_falls_back_to_a_full_response(origin):
+    serve("bytes=0-3")
+    assert serve("bytes=4-7", **{"if-range": 'W/"v1"'}) is None
+
+    request = proxy_router.BareRequest(url=URL, headers={"Range": "bytes=4-7", "If-Range": 'W/"v1"'})
+    response = asyncio.run(proxy_router.proxy_bare_request(request, "test"))
+    assert response["status"] == 200
+    assert origin.ranges[-1] is None
+
+def test_partial_cache_hit_fetches_only_missing_chunks(origin):
+    first = serve("bytes=0-3")
+    assert first["body"] == DATA[0:4]
+    assert origin.ranges == [(0, 3)]
+
+    response = serve("bytes=2-11")
+    assert response["body"] == DATA[2:12]
+    assert response["headers"]["content-range"] == "bytes 2-11/20"
+    # Chunk 0 came from the cache; chunks 1 and 2 in one request
+    assert origin.ranges == [(0, 3), (4, 11)]
+    assert not response["cached"]
+
+    again = serve("bytes=5-10")
+    assert again["body"] == DATA[5:11]
+    assert again["cached"]
+    assert len(origin.ranges) == 2
@@ -0,0 +1,60 @@
+import asyncio
+import pytest
+from utils.shared_state import LocalNamespace, SharedStore
+
+@pytest.fixture(params=["local", "shared"])
+def namespace(request, tmp_path):
+    if request.param == "local":
+        yield LocalNamespace("test")
+        return
+    store = SharedStore(str(tmp_path / "state.sqlite3"))
+    yield store.namespace("test")
+    store.close()
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_get_set_pop(namespace):
+    async def scenario():
+        await namespace.set("key", {"count": 1})
+        assert await namespace.get("key") == {"count": 1}
+        assert await namespace.contains("key")
+        assert await namespace.pop("key") == {"count": 1}
+        assert await namespace.get("key", "missing") == "missing"
+        assert await namespace.pop("key", "missing") == "missing"
+    run(scenario())
+
+def test_null_values_are_present(namespace):
+    async def scenario():
+        await namespace.set("empty", None)
+        assert await namespace.contains("empty")
+        assert await namespace.get("empty", "missing") is None
+        assert await namespace.count() == 1
+    run(scenario())
+
+def test_update_reads_and_writes_the_value(namespace):
+    async def scenario():
+        increment = lambda value: (value or 0) + 1
+        for _ in range(3):
+            await namespace.update("counter", increment)
+        return await namespace.get("counter")
+    assert run(scenario()) == 3
+
+def test_find_selects_by_field(namespace):
+    async def scenario():
+        await namespace.set("a", {"user_id": "u1", "n": 1})
+        await namespace.set("b", {"user_id": "u2", "n": 2})
+        await namespace.set("c", {"user_id": "u1", "n": 3})
+        return sorted(value["n"] for value in await namespace.find("user_id", "u1"))
+    assert run(scenario()) == [1, 3]
+
+def test_expire_removes_only_older_values(namespace):
+    async def scenario():
+        await namespace.set("old", {"updated_at": 10.0})
+        await namespace.set("new", {"updated_at": 100.0})
+        await namespace.set("undated", {"other": 1})
+        expired = await namespace.expire("updated_at", 50.0)
+        return expired, sorted(key for key, _ in await namespace.items())
+    expired, remaining = run(scenario())
+    assert expired == 1
+    assert remaining == ["new", "undated"]
@@ -0,0 +1,156 @@
+import asyncio
+import pytest
+from utils.stream_fill import CacheFill, FillAbandoned, StreamFills
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+async def collect(fill: CacheFill, received: list):
+    async for chunk in fill.follow():
+        received.append(chunk)
+
+def test_follower_replays_buffered_chunks_then_waits_for_new_ones():
+    async def scenario():
+        fill = CacheFill(100)
+        fill.start(200, {"content-type": "text/plain"}, followable=True)
+        fill.append(b"abc")
+        received = []
+        follower = asyncio.ensure_future(collect(fill, received))
+        await settle()
+        assert received == [b"abc"]
+        fill.append(b"def")
+        await settle()
+        assert not follower.done()
+        fill.finish()
+        await follower
+        return fill, received
+    fill, received = run(scenario())
+    assert received == [b"abc", b"def"]
+    assert fill.body() == b"abcdef"
+    assert not fill.active
+
+def test_published_head_drops_transfer_headers_of_the_decoded_body():
+    async def scenario():
+        fill = CacheFill(100)
+        fill.start(200, {"Content-Type": "text/plain", "Content-Encoding": "gzip", "Content-Length": "42"}, followable=True)
+        return fill
+    fill = run(scenario())
+    assert fill.headers == {"Content-Type": "text/plain"}
+    assert fill.upstream_headers["Content-Encoding"] == "gzip"
+
+def test_wait_started_returns_once_the_head_is_published():
+    async def scenario():
+        fill = CacheFill(100)
+        waiter = asyncio.ensure_future(fill.wait_started())
+        await settle()
+        assert not waiter.done()
+        fill.start(200, {}, followable=True)
+        await waiter
+        return fill
+    assert run(scenario()).status == 200
+
+def test_unshareable_response_is_not_followed():
+    async def scenario():
+        fill = CacheFill(100)
+        fill.start(200, {"vary": "accept"}, followable=False)
+        with pytest.raises(FillAbandoned):
+            await fill.wait_started()
+    run(scenario())
+
+def test_fill_abandoned_before_the_head_fails_waiters():
+    async def scenario():
+        fill = CacheFill(100)
+        waiter = asyncio.ensure_future(fill.wait_started())
+        await settle()
+        fill.fail(FillAbandoned("response is not cacheable"))
+        with pytest.raises(FillAbandoned):
+            await waiter
+    run(scenario())
+
+def test_overflow_hands_followers_their_offset():
+    async def scenario():
+        fill = CacheFill(10)
+        fill.start(200, {}, followable=True)
+        received = []
+        follower = asyncio.ensure_future(collect(fill, received))
+        assert fill.append(b"123456")
+        await settle()
+        assert not fill.append(b"7890ab")
+        with pytest.raises(FillAbandoned) as abandoned:
+            await follower
+        return fill, received, abandoned.value
+    fill, received, error = run(scenario())
+    assert received == [b"123456"]
+    assert error.offset == 6
+    assert fill.chunks == []
+    assert not fill.active
+
+def test_lagging_follower_resumes_from_what_it_was_given():
+    async def scenario():
+        fill = CacheFill(100)
+        fill.start(200, {}, followable=True)
+        for chunk in (b"aa", b"bb", b"cc"):
+            fill.append(chunk)
+        received = []
+        follower = fill.follow()
+        received.append(await follower.__anext__())
+        fill.fail(FillAbandoned("transfer did not complete"))
+        with pytest.raises(FillAbandoned) as abandoned:
+            await follower.__anext__()
+        return received, abandoned.value
+    received, error = run(scenario())
+    assert received == [b"aa"]
+    assert error.offset == 2
+    assert error.reason == "transfer did not complete"
+
+def test_begin_allows_one_fill_per_key():
+    async def scenario():
+        fills = StreamFills(100)
+        fill = fills.begin("key")
+        assert fill is not None
+        assert fills.begin("key") is None
+        assert fills.get("key") is fill
+        # Detaching someone else's fill leaves the registered one in place
+        fills.detach("key", CacheFill(100))
+        assert fills.get("key") is fill
+        fills.detach("key", fill)
+        return fills
+    fills = run(scenario())
+    assert len(fills) == 0
+    assert fills.counters["writers"] == 1
+
+def test_ending_an_unfinished_fill_abandons_it_once():
+    async def scenario():
+        fills = StreamFills(100)
+        fill = fills.begin("key")
+        fill.start(200, {}, followable=True)
+        fill.append(b"partial")
+        received = []
+        follower = asyncio.ensure_future(collect(fill, received))
+        await settle()
+        fills.end("key", fill)
+        fills.end("key", fill)
+        with pytest.raises(FillAbandoned) as abandoned:
+            await follower
+        return fills, abandoned.value
+    fills, error = run(scenario())
+    assert error.offset == len(b"partial")
+    assert fills.counters["abandoned"] == 1
+    assert fills.stats()["in_progress"] == 0
+
+def test_ending_a_finished_fill_is_not_an_abandon():
+    async def scenario():
+        fills = StreamFills(100)
+        fill = fills.begin("key")
+        fill.start(200, {}, followable=True)
+        fill.append(b"body")
+        fill.finish()
+        fills.end("key", fill)
+        return fills, fill
+    fills, fill = run(scenario())
+    assert fills.counters["abandoned"] == 0
+    assert fill.body() == b"body"
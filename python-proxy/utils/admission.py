@@ -0,0 +1,193 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, Deque
+from utils.circuit_breaker import HostUnavailable
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("admission")
+
+# Request classes, served in this order when slots free up
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+PRIORITY_NAMES = ("interactive", "bulk")
+
+# Weight of the newest sample in the moving average of slot hold times
+HOLD_TIME_ALPHA = 0.1
+MAX_RETRY_AFTER = 30.0  # seconds
+
+# Stands in for the upstream host on errors about the proxy itself
+PROXY_HOST = "proxy"
+
+class Overloaded(HostUnavailable):
+    """
+    Raised when the proxy as a whole is at its in-flight limit; answered like an unavailable host
+    """
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(PROXY_HOST, reason, retry_after)
+
+    def __str__(self) -> str:
+        return f"Proxy overloaded: {self.reason}"
+
+class AdmissionLease:
+    """
+    A held admission slot; release is idempotent so it can be tied to several cleanup paths
+    """
+
+    def __init__(self, controller: "AdmissionController", priority: int):
+        self.controller = controller
+        self.priority = priority
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        self.controller._release(self.priority, time.monotonic() - self.started)
+
+class AdmissionController:
+    """
+    Global limit on proxied requests doing upstream work at once.
+
+    Up to max_in_flight requests run; the rest wait in one FIFO queue per
+    priority, at most max_queue in total and each for at most queue_timeout
+    seconds (or its own shorter deadline). Freed slots go to interactive
+    waiters before bulk ones, and bulk requests never hold more than
+    bulk_share of the slots, so long downloads cannot starve page loads.
+    A request that cannot be queued is shed at once with Overloaded, whose
+    retry_after estimates how long the queue ahead of it takes to drain.
+    A max_in_flight of 0 disables the limit.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, queue_timeout: float, bulk_share: float = 0.5):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.bulk_limit = max(1, int(max_in_flight * bulk_share))
+        self.in_flight = [0, 0]
+        self._waiters: tuple = (deque(), deque())
+        self._hold_time = 1.0
+        self.counters = {
+            "admitted": 0,
+            "queued": 0,
+            "shed_queue_full": 0,
+            "shed_timeout": 0,
+            "peak_in_flight": 0,
+            "peak_queue_depth": 0,
+            "queue_wait_seconds": 0.0
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_in_flight > 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters[PRIORITY_INTERACTIVE]) + len(self._waiters[PRIORITY_BULK])
+
+    def queue_depth_of(self, priority: int) -> int:
+        return len(self._waiters[priority])
+
+    def _has_room(self, priority: int) -> bool:
+        if sum(self.in_flight) >= self.max_in_flight:
+            return False
+        return priority != PRIORITY_BULK or self.in_flight[PRIORITY_BULK] < self.bulk_limit
+
+    def _grant(self, priority: int) -> None:
+        self.in_flight[priority] += 1
+        self.counters["admitted"] += 1
+        self.counters["peak_in_flight"] = max(self.counters["peak_in_flight"], sum(self.in_flight))
+
+    def retry_after(self) -> float:
+        """
+        Seconds until the current queue should have drained at the observed slot hold time
+        """
+        rounds = (self.queue_depth + 1) / max(1, self.max_in_flight)
+        return min(MAX_RETRY_AFTER, max(1.0, self._hold_time * rounds))
+
+    async def acquire(self, priority: int, timeout: Optional[float] = None) -> AdmissionLease:
+        """
+        Take a slot, queueing for at most timeout (default queue_timeout) seconds; raises Overloaded when shed
+        """
+        lease = AdmissionLease(self, priority)
+        if not self.enabled:
+            lease.released = True
+            return lease
+
+        # Nobody of equal or higher priority is waiting and there is room: run now
+        ahead = len(self._waiters[PRIORITY_INTERACTIVE]) + (len(self._waiters[PRIORITY_BULK]) if priority == PRIORITY_BULK else 0)
+        if ahead == 0 and self._has_room(priority):
+            self._grant(priority)
+            return lease
+
+        wait = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        if self.queue_depth >= self.max_queue or wait <= 0:
+            self.counters["shed_queue_full" if wait > 0 else "shed_timeout"] += 1
+            raise Overloaded("admission queue full" if wait > 0 else "no time left to queue", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(waiter)
+        self.counters["queued"] += 1
+        self.counters["peak_queue_depth"] = max(self.counters["peak_queue_depth"], self.queue_depth)
+        queued_at = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, wait)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as the wait ended: hand the slot on
+                self._release(priority, 0.0)
+            elif waiter in self._waiters[priority]:
+                self._waiters[priority].remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.counters["shed_timeout"] += 1
+                raise Overloaded(f"no slot free after {round(wait, 2)}s", self.retry_after())
+            raise
+        finally:
+            self.counters["queue_wait_seconds"] += time.monotonic() - queued_at
+        lease.started = time.monotonic()
+        return lease
+
+    @asynccontextmanager
+    async def slot(self, priority: int, timeout: Optional[float] = None):
+        lease = await self.acquire(priority, timeout)
+        try:
+            yield lease
+        finally:
+            lease.release()
+
+    def _release(self, priority: int, held: float) -> None:
+        self.in_flight[priority] -= 1
+        if priority == PRIORITY_INTERACTIVE and held > 0:
+            self._hold_time += HOLD_TIME_ALPHA * (held - self._hold_time)
+        self._wake()
+
+    def _wake(self) -> None:
+        # Hand freed slots to the oldest interactive waiters, then to bulk ones
+        for priority in (PRIORITY_INTERACTIVE, PRIORITY_BULK):
+            waiters: Deque[asyncio.Future] = self._waiters[priority]
+            while waiters and self._has_room(priority):
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    self._grant(priority)
+                    waiter.set_result(None)
+            if waiters:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "max_in_flight": self.max_in_flight,
+            "bulk_limit": self.bulk_limit,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "in_flight": {name: self.in_flight[index] for index, name in enumerate(PRIORITY_NAMES)},
+            "queue_depth": {name: len(self._waiters[index]) for index, name in enumerate(PRIORITY_NAMES)},
+            "avg_hold_time": round(self._hold_time, 4),
+            "retry_after": round(self.retry_after(), 2),
+            **self.counters
+        }
@@ -0,0 +1,484 @@
+import sys
+import time
+from itertools import chain
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable, Iterator, Tuple, List
+
+# Count-min sketch shape: rows hashed independently, counters saturating like 4-bit cells
+SKETCH_DEPTH = 4
+SKETCH_MAX_COUNT = 15
+SKETCH_SAMPLE_FACTOR = 10  # increments per tracked entry before all counters are halved
+
+# Helper function to estimate the memory held by a cached response entry
+def estimate_entry_size(entry: Dict[str, Any]) -> int:
+    size = 256  # dict and bookkeeping overhead
+    body = entry.get("body")
+    if body is not None:
+        size += sys.getsizeof(body)
+    for name, value in (entry.get("headers") or {}).items():
+        size += len(name) + len(value) + 64
+    return size
+
+class LRUCache:
+    """
+    Byte-budgeted LRU cache with O(1) get, put and evict.
+
+    Entries are kept in recency order in an OrderedDict; every insert evicts
+    from the least recently used end until both the byte budget and the
+    entry cap are satisfied. Objects larger than max_object_bytes are refused.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        max_entries: int,
+        max_object_bytes: int,
+        sizeof: Callable[[Dict[str, Any]], int] = estimate_entry_size
+    ):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_object_bytes = max_object_bytes
+        self.sizeof = sizeof
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._timestamp_sum = 0.0
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "inserts": 0,
+            "evictions": 0,
+            "rejected": 0,
+            "expired": 0,
+            "revalidated": 0,
+            "stale_hits": 0,
+            "stale_if_error": 0,
+            "background_refreshes": 0,
+            "promotions": 0,
+            "compressed": 0
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def keys(self) -> Iterator[str]:
+        return iter(list(self._entries.keys()))
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        return iter([(key, item[0]) for key, item in self._entries.items()])
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the entry for key and mark it most recently used
+        """
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        self._entries.move_to_end(key)
+        return item[0]
+
+    def peek(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the entry for key without touching recency
+        """
+        item = self._entries.get(key)
+        return item[0] if item is not None else None
+
+    def put(self, key: str, value: Dict[str, Any], size: Optional[int] = None) -> bool:
+        """
+        Insert or replace an entry; returns False if the object exceeds the per-object cap
+        """
+        if size is None:
+            size = self.sizeof(value)
+
+        if size > self.max_object_bytes or size > self.max_bytes:
+            self.counters["rejected"] += 1
+            # A replacement that no longer fits must not leave the stale copy behind
+            self.pop(key)
+            return False
+
+        self.pop(key)
+        inserted_at = value.get("timestamp") or time.time()
+        self._entries[key] = (value, size, inserted_at)
+        self._bytes += size
+        self._timestamp_sum += inserted_at
+        self.counters["inserts"] += 1
+
+        while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            self._evict_one()
+        return True
+
+    def pop(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Remove an entry if present and return it
+        """
+        item = self._entries.pop(key, None)
+        if item is None:
+            return None
+        value, size, inserted_at = item
+        self._bytes -= size
+        self._timestamp_sum -= inserted_at
+        return value
+
+    def _evict_one(self) -> None:
+        key, (value, size, inserted_at) = self._entries.popitem(last=False)
+        self._bytes -= size
+        self._timestamp_sum -= inserted_at
+        self.counters["evictions"] += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+        self._timestamp_sum = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Exact counters for the cache, computed in O(1)
+        """
+        entries = len(self._entries)
+        lookups = self.counters["hits"] + self.counters["misses"]
+        avg_timestamp = self._timestamp_sum / entries if entries else 0.0
+        return {
+            "entries": entries,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "max_entries": self.max_entries,
+            "max_object_bytes": self.max_object_bytes,
+            "utilization": round(self._bytes / max(1, self.max_bytes), 4),
+            "hit_ratio": self.counters["hits"] / max(1, lookups),
+            **self.counters,
+            "avg_age": time.time() - avg_timestamp if entries else 0
+        }
+
+class FrequencySketch:
+    """
+    Count-min sketch estimating how often keys were seen recently.
+
+    Each key maps to one counter per row through double hashing; estimates
+    are the minimum over the rows, and increments only raise the counters
+    holding that minimum, which keeps overestimation low. Counters saturate
+    at SKETCH_MAX_COUNT and are all halved once sample_size increments have
+    been made, so old popularity fades instead of pinning keys forever.
+    """
+
+    def __init__(self, capacity: int, sample_factor: int = SKETCH_SAMPLE_FACTOR):
+        width = 16
+        while width < capacity:
+            width <<= 1
+        self.width = width
+        self.sample_size = max(1, capacity) * sample_factor
+        self._mask = width - 1
+        self._table = bytearray(SKETCH_DEPTH * width)
+        self._additions = 0
+        self.resets = 0
+
+    def _indexes(self, key: str) -> List[int]:
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        step = (h >> 32) | 1
+        return [row * self.width + ((h + row * step) & self._mask) for row in range(SKETCH_DEPTH)]
+
+    def estimate(self, key: str) -> int:
+        table = self._table
+        return min(table[index] for index in self._indexes(key))
+
+    def increment(self, key: str) -> int:
+        """
+        Count one occurrence of key and return its new estimate
+        """
+        table = self._table
+        indexes = self._indexes(key)
+        current = min(table[index] for index in indexes)
+        if current < SKETCH_MAX_COUNT:
+            current += 1
+            for index in indexes:
+                if table[index] < current:
+                    table[index] = current
+        self._additions += 1
+        if self._additions >= self.sample_size:
+            self._age()
+        return current
+
+    def seed(self, key: str, count: int) -> None:
+        """
+        Raise key's estimate to at least count, as when restoring remembered frequencies
+        """
+        table = self._table
+        count = min(count, SKETCH_MAX_COUNT)
+        for index in self._indexes(key):
+            if table[index] < count:
+                table[index] = count
+
+    def _age(self) -> None:
+        self._table = bytearray(value >> 1 for value in self._table)
+        self._additions //= 2
+        self.resets += 1
+
+    def clear(self) -> None:
+        self._table = bytearray(len(self._table))
+        self._additions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "width": self.width,
+            "depth": SKETCH_DEPTH,
+            "bytes": len(self._table),
+            "sample_size": self.sample_size,
+            "additions": self._additions,
+            "resets": self.resets
+        }
+
+class HeavyHitters:
+    """
+    Candidate set for the most frequent keys of a FrequencySketch.
+
+    A sketch cannot list its keys, so the keys seen with the highest
+    estimates are remembered here, up to capacity, together with an optional
+    label such as the URL a cache key was built from. Estimates are read
+    back from the sketch when reporting, so aging is reflected.
+    """
+
+    def __init__(self, sketch: FrequencySketch, capacity: int):
+        self.sketch = sketch
+        self.capacity = max(1, capacity)
+        self._candidates: Dict[str, int] = {}
+        self._labels: Dict[str, Optional[str]] = {}
+        self._floor = 0
+        self._resets = sketch.resets
+
+    def observe(self, key: str, label: Optional[str] = None, estimate: Optional[int] = None) -> None:
+        if estimate is None:
+            estimate = self.sketch.estimate(key)
+        candidates = self._candidates
+        if self._resets != self.sketch.resets:
+            # The sketch halved its counters; stored estimates would keep newer keys out
+            self._resets = self.sketch.resets
+            for candidate in candidates:
+                candidates[candidate] = self.sketch.estimate(candidate)
+            self._floor = min(candidates.values(), default=0)
+
+        if key in candidates or len(candidates) < self.capacity:
+            candidates[key] = estimate
+        elif estimate > self._floor:
+            coldest = min(candidates, key=candidates.get)
+            del candidates[coldest]
+            self._labels.pop(coldest, None)
+            candidates[key] = estimate
+        else:
+            return
+        if label is not None:
+            self._labels[key] = label
+        if len(candidates) >= self.capacity:
+            self._floor = min(candidates.values())
+
+    def top(self, n: int) -> List[Dict[str, Any]]:
+        ranked = sorted(
+            ((self.sketch.estimate(key), key) for key in self._candidates),
+            key=lambda item: item[0],
+            reverse=True
+        )
+        return [
+            {"key": key, "label": self._labels.get(key), "estimate": estimate}
+            for estimate, key in ranked[:n]
+            if estimate > 0
+        ]
+
+    def clear(self) -> None:
+        self._candidates.clear()
+        self._labels.clear()
+        self._floor = 0
+
+# Segments of a TinyLFUCache
+WINDOW = "window"
+PROBATION = "probation"
+PROTECTED = "protected"
+
+class TinyLFUCache(LRUCache):
+    """
+    Byte-budgeted cache with Window-TinyLFU admission.
+
+    New entries land in a small LRU window. An entry pushed out of the window
+    only enters the main region if the frequency sketch estimates it is used
+    more often than every entry it would displace there, so a long tail of
+    one-off responses passes through the window without flushing the hot
+    set. The main region is a segmented LRU: hits in probation promote an
+    entry to protected, and protected overflow is demoted back to probation,
+    whose least recently used entries are the eviction victims.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        max_entries: int,
+        max_object_bytes: int,
+        window_ratio: float = 0.01,
+        protected_ratio: float = 0.8,
+        sizeof: Callable[[Dict[str, Any]], int] = estimate_entry_size
+    ):
+        super().__init__(max_bytes, max_entries, max_object_bytes, sizeof)
+        # The window must hold the largest admissible entry, or such entries would go straight to admission
+        # with no accesses counted and lose to anything already cached
+        self.window_max_bytes = max(1, min(max(int(max_bytes * window_ratio), max_object_bytes), max_bytes // 2))
+        self.window_max_entries = max(1, int(max_entries * window_ratio))
+        self.main_max_bytes = max(0, max_bytes - self.window_max_bytes)
+        self.main_max_entries = max(1, max_entries - self.window_max_entries)
+        self.protected_max_bytes = int(self.main_max_bytes * protected_ratio)
+        self.sketch = FrequencySketch(max_entries)
+        self._segments: Dict[str, "OrderedDict[str, None]"] = {
+            WINDOW: OrderedDict(),
+            PROBATION: OrderedDict(),
+            PROTECTED: OrderedDict()
+        }
+        self._segment_bytes = {WINDOW: 0, PROBATION: 0, PROTECTED: 0}
+        self._location: Dict[str, str] = {}
+        self.counters["admitted"] = 0
+        self.counters["admission_rejected"] = 0
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Iterate entries from the first eviction candidates to the most protected ones
+        """
+        keys = chain(self._segments[PROBATION], self._segments[WINDOW], self._segments[PROTECTED])
+        return iter([(key, self._entries[key][0]) for key in keys])
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Count an access to key and return its entry, promoting it within the cache
+        """
+        self.sketch.increment(key)
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        segment = self._location[key]
+        if segment == PROBATION:
+            self._move(key, PROTECTED)
+            self._demote_protected()
+        else:
+            self._segments[segment].move_to_end(key)
+        return item[0]
+
+    def put(self, key: str, value: Dict[str, Any], size: Optional[int] = None) -> bool:
+        """
+        Insert or replace an entry; new keys start in the window, replacements keep their segment
+        """
+        if size is None:
+            size = self.sizeof(value)
+
+        if size > self.max_object_bytes or size > self.max_bytes:
+            self.counters["rejected"] += 1
+            self.pop(key)
+            return False
+
+        segment = self._location.get(key, WINDOW)
+        self.pop(key)
+        inserted_at = value.get("timestamp") or time.time()
+        self._entries[key] = (value, size, inserted_at)
+        self._bytes += size
+        self._timestamp_sum += inserted_at
+        self._location[key] = segment
+        self._segments[segment][key] = None
+        self._segment_bytes[segment] += size
+        self.counters["inserts"] += 1
+
+        if segment == WINDOW:
+            self._drain_window()
+        else:
+            self._demote_protected()
+            self._trim_main()
+        return key in self._entries
+
+    def pop(self, key: str) -> Optional[Dict[str, Any]]:
+        item = self._entries.pop(key, None)
+        if item is None:
+            return None
+        value, size, inserted_at = item
+        self._bytes -= size
+        self._timestamp_sum -= inserted_at
+        segment = self._location.pop(key)
+        del self._segments[segment][key]
+        self._segment_bytes[segment] -= size
+        return value
+
+    def _move(self, key: str, segment: str) -> None:
+        size = self._entries[key][1]
+        source = self._location[key]
+        del self._segments[source][key]
+        self._segment_bytes[source] -= size
+        self._segments[segment][key] = None
+        self._segment_bytes[segment] += size
+        self._location[key] = segment
+
+    def _main_over(self, extra_bytes: int = 0, extra_entries: int = 0) -> Tuple[int, int]:
+        main_bytes = self._segment_bytes[PROBATION] + self._segment_bytes[PROTECTED] + extra_bytes
+        main_entries = len(self._segments[PROBATION]) + len(self._segments[PROTECTED]) + extra_entries
+        return main_bytes - self.main_max_bytes, main_entries - self.main_max_entries
+
+    def _drain_window(self) -> None:
+        window = self._segments[WINDOW]
+        while window and (self._segment_bytes[WINDOW] > self.window_max_bytes
+                          or len(window) > self.window_max_entries):
+            self._admit(next(iter(window)))
+
+    def _admit(self, candidate: str) -> None:
+        # Pick the main-region entries that would make room, least recently used probation first
+        size = self._entries[candidate][1]
+        excess_bytes, excess_entries = self._main_over(size, 1)
+        victims = []
+        if excess_bytes > 0 or excess_entries > 0:
+            candidate_frequency = self.sketch.estimate(candidate)
+            freed = 0
+            for key in chain(self._segments[PROBATION], self._segments[PROTECTED]):
+                if freed >= excess_bytes and len(victims) >= excess_entries:
+                    break
+                if self.sketch.estimate(key) >= candidate_frequency:
+                    break
+                victims.append(key)
+                freed += self._entries[key][1]
+            if freed < excess_bytes or len(victims) < excess_entries:
+                # The candidate is not used more often than what it would displace
+                self.pop(candidate)
+                self.counters["admission_rejected"] += 1
+                return
+
+        for key in victims:
+            self.pop(key)
+            self.counters["evictions"] += 1
+        self._move(candidate, PROBATION)
+        self.counters["admitted"] += 1
+
+    def _demote_protected(self) -> None:
+        protected = self._segments[PROTECTED]
+        while protected and self._segment_bytes[PROTECTED] > self.protected_max_bytes:
+            self._move(next(iter(protected)), PROBATION)
+
+    def _trim_main(self) -> None:
+        while True:
+            excess_bytes, excess_entries = self._main_over()
+            if excess_bytes <= 0 and excess_entries <= 0:
+                return
+            victim = next(iter(self._segments[PROBATION] or self._segments[PROTECTED]))
+            self.pop(victim)
+            self.counters["evictions"] += 1
+
+    def clear(self) -> None:
+        super().clear()
+        for segment in self._segments.values():
+            segment.clear()
+        self._segment_bytes = {WINDOW: 0, PROBATION: 0, PROTECTED: 0}
+        self._location.clear()
+        self.sketch.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["policy"] = "w-tinylfu"
+        stats["segments"] = {
+            name: {"entries": len(self._segments[name]), "bytes": self._segment_bytes[name]}
+            for name in (WINDOW, PROBATION, PROTECTED)
+        }
+        stats["sketch"] = self.sketch.stats()
+        return stats
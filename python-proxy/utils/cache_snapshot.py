@@ -0,0 +1,183 @@
+import os
+import mmap
+import time
+import struct
+import logging
+from typing import Dict, Any, List, Optional, Tuple, Iterable
+from utils.json_codec import dumps, loads
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("cache_snapshot")
+
+# File layout: magic, records (entry metadata JSON followed by the raw body), index, footer
+SNAPSHOT_MAGIC = b"PXSNAP01"
+SNAPSHOT_FOOTER = struct.Struct("!QI8s")  # index offset, entry count, magic
+# Index entry: key length, usable-until time, record offset, metadata length, body length, body type, frequency
+SNAPSHOT_INDEX_ENTRY = struct.Struct("!HdQIQBB")
+
+BODY_NONE = 0
+BODY_BYTES = 1
+BODY_STR = 2
+
+# (cache key, entry, estimated frequency, time after which the entry is useless)
+SnapshotEntry = Tuple[str, Dict[str, Any], int, float]
+
+def write_snapshot(path: str, entries: Iterable[SnapshotEntry]) -> Tuple[int, int]:
+    """
+    Write entries, hottest first, to a snapshot file and return (entries, bytes) written.
+
+    The file is written beside path and renamed over it, so a crash mid-write
+    leaves the previous snapshot in place. Runs blocking I/O; call it from a
+    worker thread.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    index: List[bytes] = []
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            offset = len(SNAPSHOT_MAGIC)
+            for key, entry, frequency, usable_until in entries:
+                body = entry.get("body")
+                if body is None:
+                    body_type, body_bytes = BODY_NONE, b""
+                elif isinstance(body, str):
+                    body_type, body_bytes = BODY_STR, body.encode("utf-8")
+                else:
+                    body_type, body_bytes = BODY_BYTES, bytes(body)
+                meta = dumps({name: value for name, value in entry.items() if name != "body"})
+                encoded_key = key.encode("utf-8")
+                index.append(SNAPSHOT_INDEX_ENTRY.pack(
+                    len(encoded_key), usable_until, offset, len(meta), len(body_bytes), body_type, min(frequency, 255)
+                ) + encoded_key)
+                f.write(meta)
+                f.write(body_bytes)
+                offset += len(meta) + len(body_bytes)
+            for item in index:
+                f.write(item)
+            f.write(SNAPSHOT_FOOTER.pack(offset, len(index), SNAPSHOT_MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    return len(index), size
+
+class CacheSnapshot:
+    """
+    Read side of a cache snapshot, memory-mapped so opening it is cheap.
+
+    Only the index at the end of the file is parsed when it is opened, and
+    entries that can no longer be served or revalidated are left out of it.
+    Entries are decoded from the mapping one at a time as they are loaded,
+    so the server can restore them in the background while it already
+    answers requests. Index order is the order they were written, hottest
+    first.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._mapped: Optional[mmap.mmap] = None
+        self._index: Dict[str, Tuple[int, int, int, int, int, float]] = {}
+        self.counters = {
+            "indexed": 0,
+            "expired": 0,
+            "loaded": 0,
+            "corrupt": 0
+        }
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def open(self) -> bool:
+        """
+        Map the snapshot and read its index; False when there is no usable snapshot. Blocking.
+        """
+        try:
+            self._file = open(self.path, "rb")
+        except FileNotFoundError:
+            return False
+        try:
+            size = os.fstat(self._file.fileno()).st_size
+            if size < len(SNAPSHOT_MAGIC) + SNAPSHOT_FOOTER.size:
+                raise ValueError("file is truncated")
+            self._mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            index_offset, count, magic = SNAPSHOT_FOOTER.unpack_from(self._mapped, size - SNAPSHOT_FOOTER.size)
+            if self._mapped[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC or magic != SNAPSHOT_MAGIC:
+                raise ValueError("not a cache snapshot")
+            now = time.time()
+            position = index_offset
+            for _ in range(count):
+                key_length, usable_until, offset, meta_length, body_length, body_type, frequency = \
+                    SNAPSHOT_INDEX_ENTRY.unpack_from(self._mapped, position)
+                position += SNAPSHOT_INDEX_ENTRY.size
+                key = self._mapped[position:position + key_length].decode("utf-8")
+                position += key_length
+                if offset + meta_length + body_length > index_offset:
+                    raise ValueError("index points outside the records")
+                if usable_until <= now:
+                    self.counters["expired"] += 1
+                    continue
+                self._index[key] = (offset, meta_length, body_length, body_type, frequency, usable_until)
+            self.counters["indexed"] = len(self._index)
+            return True
+        except (ValueError, struct.error, UnicodeDecodeError, OSError) as e:
+            logger.warning(f"Ignoring cache snapshot {self.path}: {str(e)}")
+            self.close()
+            return False
+
+    def keys(self) -> List[str]:
+        return list(self._index)
+
+    def take(self, key: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        """
+        Decode and remove an entry, returning it with its recorded frequency, or None if it is gone or has expired
+        """
+        location = self._index.pop(key, None)
+        if location is None or self._mapped is None:
+            return None
+        offset, meta_length, body_length, body_type, frequency, usable_until = location
+        if usable_until <= time.time():
+            self.counters["expired"] += 1
+            return None
+        try:
+            entry = loads(self._mapped[offset:offset + meta_length])
+            body = self._mapped[offset + meta_length:offset + meta_length + body_length]
+            if body_type == BODY_STR:
+                entry["body"] = body.decode("utf-8")
+            elif body_type == BODY_BYTES:
+                entry["body"] = body
+        except ValueError as e:
+            self.counters["corrupt"] += 1
+            logger.warning(f"Skipping unreadable snapshot entry {key}: {str(e)}")
+            return None
+        self.counters["loaded"] += 1
+        return entry, frequency
+
+    def close(self) -> None:
+        self._index.clear()
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "pending": len(self._index),
+            "open": self._mapped is not None
+        }
@@ -0,0 +1,132 @@
+import time
+import socket
+from typing import Dict, Any, Optional
+
+# Breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class HostUnavailable(Exception):
+    """
+    Raised instead of contacting an upstream host that is failing or overloaded
+    """
+
+    def __init__(self, host: str, reason: str, retry_after: float):
+        super().__init__(f"Upstream host {host} unavailable: {reason}")
+        self.host = host
+        self.reason = reason
+        self.retry_after = retry_after
+
+# Helper function to tell DNS resolution failures apart from other connection errors
+def is_dns_failure(error: BaseException) -> bool:
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, socket.gaierror):
+            return True
+        message = str(error)
+        if "Name or service not known" in message or "nodename nor servname" in message \
+                or "getaddrinfo failed" in message or "Temporary failure in name resolution" in message:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker.
+
+    Closed: requests flow and consecutive failures are counted. After
+    failure_threshold failures in a row the breaker opens and requests fail
+    fast for reset_timeout seconds. It then lets half_open_probes requests
+    through; a success closes it again and a failure reopens it. A DNS
+    failure opens it straight away for negative_ttl seconds, since retrying
+    a name that does not resolve only adds latency.
+    """
+
+    def __init__(self, host: str, failure_threshold: int, reset_timeout: float, negative_ttl: float, half_open_probes: int = 1):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.negative_ttl = negative_ttl
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.retry_at = 0.0
+        self.last_failure: Optional[str] = None
+        self._probes = 0
+        self.counters = {
+            "successes": 0,
+            "failures": 0,
+            "rejected": 0,
+            "opened": 0
+        }
+
+    def before_request(self) -> None:
+        """
+        Raise HostUnavailable if the breaker does not let this request through
+        """
+        if self.state == OPEN:
+            now = time.time()
+            if now < self.retry_at:
+                self.counters["rejected"] += 1
+                raise HostUnavailable(self.host, f"circuit open after {self.last_failure}", self.retry_at - now)
+            self.state = HALF_OPEN
+            self._probes = 0
+
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_probes:
+                self.counters["rejected"] += 1
+                raise HostUnavailable(self.host, "circuit half-open, probe in flight", 1.0)
+            self._probes += 1
+
+    def check(self) -> None:
+        """
+        Fail fast while open, without taking a half-open probe
+        """
+        if self.state == OPEN and time.time() < self.retry_at:
+            self.counters["rejected"] += 1
+            raise HostUnavailable(self.host, f"circuit open after {self.last_failure}", self.retry_at - time.time())
+
+    def release(self) -> None:
+        """
+        Give back a half-open probe whose request ended without a verdict
+        """
+        if self.state == HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record_success(self) -> None:
+        self.counters["successes"] += 1
+        self.consecutive_failures = 0
+        if self.state != CLOSED:
+            self.state = CLOSED
+            self._probes = 0
+
+    def record_failure(self, reason: str, dns: bool = False) -> None:
+        self.counters["failures"] += 1
+        self.consecutive_failures += 1
+        self.last_failure = reason
+        if dns:
+            self._open(self.negative_ttl)
+        elif self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._open(self.reset_timeout)
+
+    def _open(self, duration: float) -> None:
+        if self.state != OPEN:
+            self.counters["opened"] += 1
+        self.state = OPEN
+        self.retry_at = time.time() + duration
+        self._probes = 0
+
+    @property
+    def idle(self) -> bool:
+        return self.state == CLOSED and self.consecutive_failures == 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "last_failure": self.last_failure,
+            "retry_in": max(0.0, round(self.retry_at - time.time(), 2)) if self.state == OPEN else 0.0,
+            **self.counters
+        }
@@ -0,0 +1,95 @@
+import gzip
+import zlib
+from typing import Optional, List
+
+# Brotli is optional; gzip is always available
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    brotli = None
+    BROTLI_AVAILABLE = False
+
+# Content types worth compressing
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/javascript",
+    "application/x-javascript",
+    "application/ecmascript",
+    "application/json",
+    "application/manifest+json",
+    "application/xml",
+    "application/xhtml+xml",
+    "application/rss+xml",
+    "image/svg+xml",
+)
+
+def available_encodings() -> List[str]:
+    """
+    Encodings this server can produce, in order of preference
+    """
+    return ["br", "gzip"] if BROTLI_AVAILABLE else ["gzip"]
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    if not content_type:
+        return False
+    content_type = content_type.split(";", 1)[0].strip().lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES) or content_type.endswith(("+json", "+xml"))
+
+def compress(data: bytes, encoding: str, level: int = 6) -> bytes:
+    if encoding == "br" and BROTLI_AVAILABLE:
+        return brotli.compress(data, quality=max(0, min(11, level)))
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=max(1, min(9, level)), mtime=0)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+def decompress(data: bytes, encoding: Optional[str]) -> bytes:
+    if not encoding or encoding == "identity":
+        return data
+    if encoding == "br" and BROTLI_AVAILABLE:
+        return brotli.decompress(data)
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "deflate":
+        return zlib.decompress(data)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+def parse_accept_encoding(header: Optional[str]) -> dict:
+    """
+    Parse Accept-Encoding into a dict of coding -> q-value
+    """
+    accepted = {}
+    if not header:
+        return accepted
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+def accepts_encoding(header: Optional[str], encoding: str) -> bool:
+    accepted = parse_accept_encoding(header)
+    q = accepted.get(encoding, accepted.get("*", 0.0))
+    return q > 0
+
+def negotiate_encoding(header: Optional[str], candidates: Optional[List[str]] = None) -> Optional[str]:
+    """
+    Pick the best encoding the client accepts, or None for identity
+    """
+    accepted = parse_accept_encoding(header)
+    best = None
+    best_q = 0.0
+    for encoding in candidates or available_encodings():
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
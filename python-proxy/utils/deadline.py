@@ -0,0 +1,151 @@
+import os
+import time
+import asyncio
+import httpx
+from contextlib import asynccontextmanager
+from typing import Optional, Mapping, Awaitable, TypeVar
+
+# Per-phase limits; each is also capped by what is left of the request's deadline
+CONNECT_TIMEOUT = float(os.getenv('PROXY_CONNECT_TIMEOUT', '10.0'))  # seconds to open an upstream connection
+READ_TIMEOUT = float(os.getenv('PROXY_READ_TIMEOUT', os.getenv('PROXY_TIMEOUT', '30.0')))  # seconds between bytes from upstream
+POOL_TIMEOUT = float(os.getenv('PROXY_POOL_TIMEOUT', '5.0'))  # seconds waiting for a pooled connection
+MAX_DEADLINE = float(os.getenv('PROXY_MAX_DEADLINE', '300.0'))  # longest budget a client may ask for
+MIN_REMAINING = float(os.getenv('PROXY_DEADLINE_MIN_REMAINING', '0.05'))  # seconds below which a hop is not attempted
+
+# Incoming header carrying the caller's remaining budget in seconds; relative, so clock skew does not matter
+DEADLINE_HEADER = "x-request-timeout"
+
+# Requests given up because their deadline passed, by the stage they were in
+deadline_metrics = {
+    "abandoned": 0,
+    "exceeded": 0,
+    "redirect_hops": 0
+}
+
+T = TypeVar("T")
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """
+    Raised when a proxied request runs out of its end-to-end time budget
+    """
+
+    def __init__(self, budget: float, stage: str):
+        super().__init__(f"Deadline of {budget:g}s exceeded {stage}")
+        self.budget = budget
+        self.stage = stage
+
+class Deadline:
+    """
+    End-to-end time budget of one proxied request, on the monotonic clock.
+
+    Every upstream hop takes its connect, read, write and pool timeouts from
+    what is left, so queueing, redirects and body transfer all draw on the
+    same budget instead of each restarting the clock.
+    """
+
+    def __init__(self, budget: float):
+        self.budget = max(0.0, min(budget, MAX_DEADLINE))
+        self.expires_at = time.monotonic() + self.budget
+
+    @classmethod
+    def for_request(cls, timeout: Optional[float], headers: Optional[Mapping[str, str]], default: float) -> "Deadline":
+        """
+        Budget from an explicit timeout, else the deadline header, whichever is shorter when both are given
+        """
+        budgets = [budget for budget in (timeout, parse_deadline_header(headers)) if budget and budget > 0]
+        return cls(min(budgets) if budgets else default)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def extend(self, other: "Deadline") -> None:
+        """
+        Push the expiry out to another deadline's, when that one ends later
+        """
+        if other.expires_at > self.expires_at:
+            self.budget += other.expires_at - self.expires_at
+            self.expires_at = other.expires_at
+
+    def check(self, stage: str) -> None:
+        """
+        Abandon the request before starting more upstream work that cannot finish in time
+        """
+        if self.remaining() < MIN_REMAINING:
+            deadline_metrics["abandoned"] += 1
+            raise DeadlineExceeded(self.budget, stage)
+
+    def timeout(self) -> httpx.Timeout:
+        remaining = self.remaining()
+        return httpx.Timeout(
+            connect=min(CONNECT_TIMEOUT, remaining),
+            read=min(READ_TIMEOUT, remaining),
+            write=min(READ_TIMEOUT, remaining),
+            pool=min(POOL_TIMEOUT, remaining)
+        )
+
+    async def run(self, awaitable: Awaitable[T], stage: str) -> T:
+        """
+        Await within the remaining budget, cancelling the work when it runs out
+        """
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError as e:
+            if isinstance(e, DeadlineExceeded):
+                raise
+            deadline_metrics["exceeded"] += 1
+            raise DeadlineExceeded(self.budget, stage) from None
+
+# Helper function to read the caller's remaining budget, ignoring malformed values
+def parse_deadline_header(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    if not headers:
+        return None
+    value = headers.get(DEADLINE_HEADER)
+    if value is None:
+        value = next((v for k, v in headers.items() if k.lower() == DEADLINE_HEADER), None)
+    try:
+        budget = float(value) if value is not None else None
+    except ValueError:
+        return None
+    return budget if budget is not None and budget > 0 else None
+
+async def send_within(
+    client: httpx.AsyncClient,
+    request: httpx.Request,
+    deadline: Deadline,
+    follow_redirects: bool
+) -> httpx.Response:
+    """
+    Send a request with a streamed response, following redirects hop by hop.
+
+    Each hop is checked against the deadline before it starts and gets
+    timeouts from what is left of it, so the whole redirect chain shares one
+    budget. The caller closes the returned response.
+    """
+    hops = 0
+    while True:
+        deadline.check("before " + ("redirect" if hops else "connecting"))
+        request.extensions["timeout"] = deadline.timeout().as_dict()
+        response = await deadline.run(
+            client.send(request, stream=True, follow_redirects=False),
+            "waiting for response headers"
+        )
+        if not follow_redirects or response.next_request is None:
+            return response
+        hops += 1
+        deadline_metrics["redirect_hops"] += 1
+        if hops > client.max_redirects:
+            await response.aclose()
+            raise httpx.TooManyRedirects("Exceeded maximum allowed redirects.", request=request)
+        request = response.next_request
+        await response.aclose()
+
+@asynccontextmanager
+async def stream_within(client: httpx.AsyncClient, request: httpx.Request, deadline: Deadline, follow_redirects: bool):
+    """
+    Like client.stream(), with the response headers of every hop due within the deadline
+    """
+    response = await send_within(client, request, deadline, follow_redirects)
+    try:
+        yield response
+    finally:
+        await response.aclose()
@@ -0,0 +1,345 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Set
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("disk_cache")
+
+# Helper function to read a body file into memory for promotion to the memory tier
+def read_body_file(path: str, size: int, body_type: str) -> Any:
+    if size == 0:
+        return "" if body_type == "str" else b""
+    with open(path, "rb") as f:
+        body = f.read()
+    return body.decode("utf-8") if body_type == "str" else body
+
+class DiskCache:
+    """
+    Second cache tier on the local filesystem.
+
+    Bodies are stored once per content hash under <directory>/<aa>/<sha256>,
+    so identical assets behind different URLs share a file. A SQLite index
+    maps cache keys to the body hash plus headers and freshness metadata, and
+    an in-memory OrderedDict mirrors it in recency order so lookups and
+    eviction candidates are O(1). Hits can be loaded with their body or, for
+    callers that stream the file to the client, with only its path. The in-memory index is only touched on the
+    event loop; file writes and index updates run in order on a single
+    writer thread, and total body bytes are kept under max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_object_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes
+        self._index: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._refcounts: Dict[str, int] = {}
+        self._bytes = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._eviction_task: Optional[asyncio.Task] = None
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "deduplicated": 0,
+            "evictions": 0,
+            "rejected": 0,
+            "errors": 0
+        }
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    def body_path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    # Lifecycle
+
+    async def _run(self, func, *args) -> Any:
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk-cache")
+        return await asyncio.get_running_loop().run_in_executor(self._writer, func, *args)
+
+    async def open(self) -> None:
+        await self._run(self._open_sync)
+        logger.info(f"Disk cache opened at {self.directory}: {len(self._index)} entries, {self._bytes} bytes")
+
+    def _open_sync(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self.directory, "index.sqlite3"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, digest TEXT, size INTEGER, meta TEXT, last_access REAL)"
+        )
+        self._db.commit()
+
+        # Runs before the server accepts requests, so the index can be rebuilt here
+        self._index.clear()
+        self._refcounts.clear()
+        self._bytes = 0
+        rows = self._db.execute("SELECT key, digest, size, meta, last_access FROM entries ORDER BY last_access")
+        for key, digest, size, meta, last_access in rows:
+            if digest and not os.path.exists(self.body_path(digest)):
+                continue
+            self._index_add(key, {"digest": digest, "size": size, "meta": json.loads(meta), "last_access": last_access})
+
+    async def close(self) -> None:
+        # Let queued writes finish so the index matches the files on disk
+        for task in list(self._tasks):
+            try:
+                await asyncio.wait_for(asyncio.shield(task), timeout=5)
+            except Exception:
+                task.cancel()
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        if self._writer is not None:
+            self._writer.shutdown(wait=False)
+            self._writer = None
+
+    # Index bookkeeping (event loop only)
+
+    def _index_add(self, key: str, record: Dict[str, Any]) -> None:
+        self._index[key] = record
+        digest = record["digest"]
+        if digest:
+            count = self._refcounts.get(digest, 0)
+            if count == 0:
+                self._bytes += record["size"]
+            self._refcounts[digest] = count + 1
+
+    def _index_remove(self, key: str) -> Optional[str]:
+        """
+        Drop a key from the index; returns the body digest if no other key references it
+        """
+        record = self._index.pop(key, None)
+        if record is None or not record["digest"]:
+            return None
+        digest = record["digest"]
+        count = self._refcounts.get(digest, 1) - 1
+        if count <= 0:
+            self._refcounts.pop(digest, None)
+            self._bytes -= record["size"]
+            return digest
+        self._refcounts[digest] = count
+        return None
+
+    # Reads
+
+    def peek_meta(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the stored metadata for key without reading the body
+        """
+        record = self._index.get(key)
+        return record["meta"] if record is not None else None
+
+    async def load(self, key: str, read_body: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Load an entry; without read_body its body stays on disk and body_path names the file
+        """
+        record = self._index.get(key)
+        if record is None:
+            self.counters["misses"] += 1
+            return None
+
+        entry = dict(record["meta"])
+        if record["digest"] and not read_body:
+            entry.pop("body_type", None)
+            entry["body_path"] = self.body_path(record["digest"])
+            entry["body_size"] = record["size"]
+        elif record["digest"]:
+            try:
+                entry["body"] = await asyncio.to_thread(
+                    read_body_file, self.body_path(record["digest"]), record["size"], entry.pop("body_type", "str")
+                )
+            except OSError as e:
+                logger.error(f"Disk cache read failed for {key}: {str(e)}")
+                self.counters["errors"] += 1
+                self.discard(key)
+                return None
+
+        self._index.move_to_end(key)
+        record["last_access"] = time.time()
+        self._spawn(self._run(self._touch_sync, key, record["last_access"]))
+        self.counters["hits"] += 1
+        return entry
+
+    def _touch_sync(self, key: str, last_access: float) -> None:
+        if self._db is not None:
+            self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (last_access, key))
+            self._db.commit()
+
+    # Writes
+
+    def schedule_store(self, key: str, entry: Dict[str, Any]) -> None:
+        """
+        Write an entry to disk in the background
+        """
+        self._spawn(self.store(key, entry))
+
+    async def store(self, key: str, entry: Dict[str, Any]) -> bool:
+        meta = {name: value for name, value in entry.items() if name != "body"}
+        body = entry.get("body")
+        payload: Optional[bytes] = None
+        if body is not None:
+            if isinstance(body, str):
+                payload = body.encode("utf-8")
+                meta["body_type"] = "str"
+            else:
+                payload = bytes(body)
+                meta["body_type"] = "bytes"
+            if len(payload) > self.max_object_bytes or len(payload) > self.max_bytes:
+                self.counters["rejected"] += 1
+                return False
+
+        try:
+            digest = await self._run(self._write_body_sync, payload)
+        except OSError as e:
+            logger.error(f"Disk cache write failed for {key}: {str(e)}")
+            self.counters["errors"] += 1
+            return False
+
+        record = {
+            "digest": digest,
+            "size": len(payload) if payload is not None else 0,
+            "meta": meta,
+            "last_access": time.time()
+        }
+        orphan = self._index_remove(key)
+        self._index_add(key, record)
+        if orphan == digest:
+            orphan = None
+
+        try:
+            await self._run(self._write_row_sync, key, record, orphan)
+        except sqlite3.Error as e:
+            logger.error(f"Disk cache index update failed for {key}: {str(e)}")
+            self.counters["errors"] += 1
+
+        self.counters["writes"] += 1
+        if self._bytes > self.max_bytes:
+            self._schedule_eviction()
+        return True
+
+    def _write_body_sync(self, payload: Optional[bytes]) -> Optional[str]:
+        """
+        Write a body under its content hash unless an identical body is already stored
+        """
+        if payload is None:
+            return None
+        digest = hashlib.sha256(payload).hexdigest()
+        path = self.body_path(digest)
+        if os.path.exists(path):
+            self.counters["deduplicated"] += 1
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+        return digest
+
+    def _write_row_sync(self, key: str, record: Dict[str, Any], orphan: Optional[str]) -> None:
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, digest, size, meta, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, record["digest"], record["size"], json.dumps(record["meta"]), record["last_access"])
+            )
+            self._db.commit()
+        if orphan:
+            self._unlink(orphan)
+
+    def discard(self, key: str) -> None:
+        """
+        Remove an entry from the index now and delete its body in the background
+        """
+        if key not in self._index:
+            return
+        orphan = self._index_remove(key)
+        self._spawn(self._run(self._delete_rows_sync, [key], [orphan] if orphan else []))
+
+    def _delete_rows_sync(self, keys, orphans) -> None:
+        if self._db is not None:
+            self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in keys])
+            self._db.commit()
+        for digest in orphans:
+            self._unlink(digest)
+
+    def _unlink(self, digest: str) -> None:
+        try:
+            os.remove(self.body_path(digest))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Disk cache could not remove {digest}: {str(e)}")
+
+    # Eviction
+
+    def _schedule_eviction(self) -> None:
+        if self._eviction_task is None or self._eviction_task.done():
+            self._eviction_task = self._spawn(self._evict())
+
+    async def _evict(self) -> None:
+        """
+        Drop least recently used entries until the body bytes fit the budget
+        """
+        keys = []
+        orphans = []
+        while self._index and self._bytes > self.max_bytes:
+            key = next(iter(self._index))
+            orphan = self._index_remove(key)
+            keys.append(key)
+            if orphan:
+                orphans.append(orphan)
+        if keys:
+            self.counters["evictions"] += len(keys)
+            await self._run(self._delete_rows_sync, keys, orphans)
+
+    async def clear(self) -> int:
+        count = len(self._index)
+        orphans = list(self._refcounts.keys())
+        keys = list(self._index.keys())
+        self._index.clear()
+        self._refcounts.clear()
+        self._bytes = 0
+        await self._run(self._delete_rows_sync, keys, orphans)
+        return count
+
+    def _spawn(self, coroutine) -> asyncio.Task:
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "directory": self.directory,
+            "entries": len(self._index),
+            "files": len(self._refcounts),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "max_object_bytes": self.max_object_bytes,
+            "utilization": round(self._bytes / max(1, self.max_bytes), 4),
+            "hit_ratio": self.counters["hits"] / max(1, lookups),
+            "pending_tasks": len(self._tasks),
+            **self.counters
+        }
@@ -0,0 +1,196 @@
+import time
+import socket
+import asyncio
+import logging
+import ipaddress
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+import httpcore
+from utils.singleflight import SingleFlight
+
+# c-ares lookups are optional; without them the event loop's getaddrinfo is used
+try:
+    import aiodns
+    AIODNS_AVAILABLE = True
+except ImportError:
+    aiodns = None
+    AIODNS_AVAILABLE = False
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("dns_cache")
+
+# Helper function to check whether a host is already an IP address
+def is_ip_address(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+        return True
+    except ValueError:
+        return False
+
+class DNSCache:
+    """
+    Async DNS cache that honours record TTLs.
+
+    With aiodns installed, names are resolved through c-ares on the event
+    loop and cached for the TTL of the returned records, clamped to
+    [min_ttl, max_ttl]. Otherwise, or when c-ares finds nothing (for names
+    only in /etc/hosts, say), the loop's getaddrinfo is used and results are
+    kept for default_ttl. Concurrent lookups of the same name share one query.
+    """
+
+    def __init__(self, default_ttl: float, min_ttl: float, max_ttl: float, max_entries: int = 1000):
+        self.default_ttl = default_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[List[str], float]]" = OrderedDict()
+        self._flights = SingleFlight()
+        self._resolver = None
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "lookups": 0,
+            "errors": 0,
+            "prefetches": 0
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def expires_in(self, host: str) -> Optional[float]:
+        entry = self._entries.get(host)
+        return entry[1] - time.time() if entry is not None else None
+
+    async def resolve(self, host: str) -> List[str]:
+        """
+        Return the addresses for host, from the cache while its TTL lasts
+        """
+        if is_ip_address(host):
+            return [host.strip("[]")]
+
+        entry = self._entries.get(host)
+        if entry is not None and time.time() < entry[1]:
+            self._entries.move_to_end(host)
+            self.counters["hits"] += 1
+            return entry[0]
+
+        self.counters["misses"] += 1
+        return await self._flights.do(host, lambda: self._lookup(host))
+
+    async def prefetch(self, host: str, ahead: float) -> None:
+        """
+        Refresh a cached name that would expire within the next `ahead` seconds
+        """
+        if is_ip_address(host):
+            return
+        remaining = self.expires_in(host)
+        if remaining is None or remaining < ahead:
+            self.counters["prefetches"] += 1
+            await self._flights.do(host, lambda: self._lookup(host))
+
+    async def _lookup(self, host: str) -> List[str]:
+        self.counters["lookups"] += 1
+        addresses: List[str] = []
+        ttl = self.default_ttl
+        try:
+            if AIODNS_AVAILABLE:
+                try:
+                    addresses, ttl = await self._query(host)
+                except Exception as e:
+                    logger.warning(f"c-ares lookup for {host} failed, using getaddrinfo: {str(e)}")
+            if not addresses:
+                addresses = await self._getaddrinfo(host)
+                ttl = self.default_ttl
+        except Exception:
+            self.counters["errors"] += 1
+            raise
+
+        self._entries[host] = (addresses, time.time() + max(self.min_ttl, min(self.max_ttl, ttl)))
+        self._entries.move_to_end(host)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return addresses
+
+    async def _query(self, host: str) -> Tuple[List[str], float]:
+        if self._resolver is None:
+            self._resolver = aiodns.DNSResolver()
+        for record_type in ("A", "AAAA"):
+            try:
+                records = await self._resolver.query(host, record_type)
+            except aiodns.error.DNSError:
+                continue
+            if records:
+                return [record.host for record in records], min(record.ttl for record in records)
+        return [], self.default_ttl
+
+    async def _getaddrinfo(self, host: str) -> List[str]:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        addresses = []
+        # IPv4 first, then IPv6, without duplicates
+        for family in (socket.AF_INET, socket.AF_INET6):
+            for info_family, _, _, _, sockaddr in infos:
+                if info_family == family and sockaddr[0] not in addresses:
+                    addresses.append(sockaddr[0])
+        if not addresses:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return addresses
+
+    def close(self) -> None:
+        """
+        Drop the resolver, which is bound to the running event loop
+        """
+        if self._resolver is not None:
+            try:
+                self._resolver.cancel()
+            except Exception:
+                pass
+            self._resolver = None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "backend": "c-ares" if AIODNS_AVAILABLE else "getaddrinfo",
+            "entries": len(self._entries),
+            "hit_ratio": self.counters["hits"] / max(1, lookups),
+            **self.counters
+        }
+
+class CachingNetworkBackend(httpcore.AsyncNetworkBackend):
+    """
+    httpcore network backend that resolves hosts through a DNSCache.
+
+    Connections are opened to the cached addresses in order; TLS still uses
+    the origin host name for SNI and certificate checks, since httpcore takes
+    that from the request origin rather than from the connected address.
+    """
+
+    def __init__(self, dns_cache: DNSCache):
+        self.dns_cache = dns_cache
+        self._backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        try:
+            addresses = await asyncio.wait_for(self.dns_cache.resolve(host), timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise httpcore.ConnectError(str(e)) from e
+
+        last_error: Optional[Exception] = None
+        for address in addresses:
+            try:
+                return await self._backend.connect_tcp(
+                    address,
+                    port,
+                    timeout=timeout,
+                    local_address=local_address,
+                    socket_options=socket_options
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                last_error = e
+        raise last_error
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
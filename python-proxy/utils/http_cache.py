@@ -0,0 +1,218 @@
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional, List, Tuple
+
+# Status codes a shared cache may store (206 is handled separately by range caching)
+CACHEABLE_STATUS_CODES = {200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501}
+
+# Error statuses stored only when the origin gives them an explicit lifetime, never the heuristic TTL
+EXPLICIT_FRESHNESS_STATUS_CODES = {404, 405, 410, 414, 501}
+
+# Response headers addressed to the client that caused the response, never replayed from a shared cache
+UNSHARED_RESPONSE_HEADERS = {"set-cookie", "set-cookie2"}
+
+# Fraction of (Date - Last-Modified) used as heuristic freshness
+HEURISTIC_FRACTION = 0.1
+
+# Helper function to read a header case-insensitively
+def get_header(headers: Optional[Dict[str, str]], name: str) -> Optional[str]:
+    if not headers:
+        return None
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+# Helper function to parse an HTTP date into a unix timestamp
+def parse_http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """
+    Parse a Cache-Control header into a dict of lower-cased directives
+    """
+    directives: Dict[str, Optional[str]] = {}
+    if not value:
+        return directives
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "=" in part:
+            name, _, arg = part.partition("=")
+            directives[name.strip().lower()] = arg.strip().strip('"')
+        else:
+            directives[part.lower()] = None
+    return directives
+
+# Helper function to read an integer directive such as max-age
+def directive_seconds(directives: Dict[str, Optional[str]], name: str) -> Optional[int]:
+    if name not in directives:
+        return None
+    try:
+        return max(0, int(directives[name] or 0))
+    except ValueError:
+        return 0
+
+def parse_vary(headers: Dict[str, str]) -> List[str]:
+    """
+    Return the lower-cased request header names listed in Vary
+    """
+    value = get_header(headers, "vary")
+    if not value:
+        return []
+    return sorted({name.strip().lower() for name in value.split(",") if name.strip()})
+
+def is_cacheable(
+    status_code: int,
+    response_headers: Dict[str, str],
+    request_headers: Optional[Dict[str, str]] = None
+) -> bool:
+    """
+    Decide whether a shared cache may store this response
+    """
+    if status_code not in CACHEABLE_STATUS_CODES:
+        return False
+
+    directives = parse_cache_control(get_header(response_headers, "cache-control"))
+    if "no-store" in directives or "private" in directives:
+        return False
+
+    request_directives = parse_cache_control(get_header(request_headers, "cache-control"))
+    if "no-store" in request_directives:
+        return False
+
+    if "*" in parse_vary(response_headers):
+        return False
+
+    # Cookies are not part of the cache key, so a response setting one is only shared when marked public
+    if get_header(response_headers, "set-cookie") is not None and "public" not in directives:
+        return False
+
+    if status_code in EXPLICIT_FRESHNESS_STATUS_CODES and not has_explicit_freshness(response_headers):
+        return False
+
+    # Authenticated responses are only shared when the origin says so explicitly
+    if get_header(request_headers, "authorization") is not None:
+        if not ({"public", "s-maxage", "must-revalidate"} & directives.keys()):
+            return False
+
+    # no-cache responses are only useful if they can be revalidated
+    if "no-cache" in directives and not has_validators(response_headers):
+        return False
+
+    return True
+
+def has_validators(headers: Dict[str, str]) -> bool:
+    return bool(get_header(headers, "etag") or get_header(headers, "last-modified"))
+
+# Helper function to copy response headers without the ones a shared cache must not store
+def shareable_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    return {name: value for name, value in headers.items() if name.lower() not in UNSHARED_RESPONSE_HEADERS}
+
+# Helper function to check whether the origin set a lifetime itself rather than leaving it to a heuristic
+def has_explicit_freshness(headers: Dict[str, str]) -> bool:
+    directives = parse_cache_control(get_header(headers, "cache-control"))
+    return "s-maxage" in directives or "max-age" in directives or get_header(headers, "expires") is not None
+
+def freshness_lifetime(headers: Dict[str, str], default_ttl: float, now: Optional[float] = None) -> float:
+    """
+    Compute how long a response stays fresh, minus the age it already has.
+
+    Follows RFC 9111 precedence: s-maxage, max-age, Expires minus Date, then a
+    heuristic of 10% of the Last-Modified age, and finally the configured TTL.
+    """
+    now = now or time.time()
+    directives = parse_cache_control(get_header(headers, "cache-control"))
+
+    if "no-cache" in directives:
+        return 0.0
+
+    lifetime: Optional[float] = directive_seconds(directives, "s-maxage")
+    if lifetime is None:
+        lifetime = directive_seconds(directives, "max-age")
+
+    date = parse_http_date(get_header(headers, "date")) or now
+
+    if lifetime is None:
+        expires_header = get_header(headers, "expires")
+        if expires_header is not None:
+            expires = parse_http_date(expires_header)
+            # An invalid Expires value means "already expired"
+            lifetime = max(0.0, expires - date) if expires is not None else 0.0
+
+    if lifetime is None:
+        last_modified = parse_http_date(get_header(headers, "last-modified"))
+        if last_modified is not None and last_modified < date:
+            lifetime = min(default_ttl, (date - last_modified) * HEURISTIC_FRACTION)
+        else:
+            lifetime = default_ttl
+
+    try:
+        age = max(0.0, float(get_header(headers, "age") or 0))
+    except ValueError:
+        age = 0.0
+
+    return max(0.0, lifetime - age)
+
+def stale_allowances(headers: Dict[str, str], default_swr: float, default_sie: float) -> Tuple[float, float]:
+    """
+    Return the (stale-while-revalidate, stale-if-error) windows in seconds.
+
+    Upstream directives (RFC 5861) override the configured defaults, and
+    must-revalidate, proxy-revalidate or no-cache disable stale serving.
+    """
+    directives = parse_cache_control(get_header(headers, "cache-control"))
+    if {"must-revalidate", "proxy-revalidate", "no-cache"} & directives.keys():
+        return 0.0, 0.0
+
+    swr = directive_seconds(directives, "stale-while-revalidate")
+    sie = directive_seconds(directives, "stale-if-error")
+    return (
+        float(swr) if swr is not None else default_swr,
+        float(sie) if sie is not None else default_sie
+    )
+
+def conditional_headers(entry: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Build If-None-Match / If-Modified-Since headers from a stored entry
+    """
+    headers = {}
+    etag = get_header(entry.get("headers"), "etag")
+    if etag:
+        headers["If-None-Match"] = etag
+    last_modified = get_header(entry.get("headers"), "last-modified")
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+def has_client_conditionals(request_headers: Optional[Dict[str, str]]) -> bool:
+    return any(
+        get_header(request_headers, name) is not None
+        for name in ("if-none-match", "if-modified-since", "if-match", "if-unmodified-since", "if-range")
+    )
+
+# Headers a 304 must not overwrite on the stored response
+_NOT_UPDATED_ON_304 = {"content-length", "content-encoding", "content-type", "transfer-encoding", "content-range"}
+
+def merge_not_modified_headers(stored: Dict[str, str], fresh: Dict[str, str]) -> Dict[str, str]:
+    """
+    Apply the headers of a 304 Not Modified response to a stored response
+    """
+    merged = dict(stored)
+    lower_index = {key.lower(): key for key in merged}
+    for name, value in fresh.items():
+        lower = name.lower()
+        if lower in _NOT_UPDATED_ON_304 or lower in UNSHARED_RESPONSE_HEADERS:
+            continue
+        if lower in lower_index:
+            merged[lower_index[lower]] = value
+        else:
+            merged[name] = value
+    return merged
@@ -0,0 +1,414 @@
+import httpx
+import asyncio
+import os
+import time
+import heapq
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional
+from utils.circuit_breaker import CircuitBreaker, HostUnavailable, is_dns_failure
+from utils.dns_cache import DNSCache, CachingNetworkBackend
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("http_pool")
+
+# Pool configuration
+POOL_MAX_CONNECTIONS = int(os.getenv('PROXY_POOL_MAX_CONNECTIONS', '200'))
+POOL_MAX_KEEPALIVE = int(os.getenv('PROXY_POOL_MAX_KEEPALIVE', '50'))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv('PROXY_POOL_KEEPALIVE_EXPIRY', '30.0'))  # seconds
+POOL_MAX_PER_HOST = int(os.getenv('PROXY_POOL_MAX_PER_HOST', '20'))
+POOL_HTTP2 = os.getenv('PROXY_POOL_HTTP2', 'true').lower() == 'true'
+MAX_REDIRECTS = int(os.getenv('MAX_REDIRECTS', '10'))
+HOST_MAX_QUEUE = int(os.getenv('PROXY_HOST_MAX_QUEUE', '100'))  # requests waiting for a slot per host
+HOST_QUEUE_TIMEOUT = float(os.getenv('PROXY_HOST_QUEUE_TIMEOUT', '10.0'))  # seconds
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('PROXY_BREAKER_FAILURES', '5'))  # consecutive failures
+BREAKER_RESET_TIMEOUT = float(os.getenv('PROXY_BREAKER_RESET_TIMEOUT', '30.0'))  # seconds open before a probe
+NEGATIVE_CACHE_TTL = float(os.getenv('PROXY_NEGATIVE_CACHE_TTL', '10.0'))  # seconds
+BREAKER_MAX_HOSTS = 1000
+DNS_CACHE_ENABLED = os.getenv('PROXY_DNS_CACHE', 'true').lower() == 'true'
+DNS_DEFAULT_TTL = float(os.getenv('PROXY_DNS_TTL', '60'))  # seconds, when the lookup gives no TTL
+DNS_MIN_TTL = float(os.getenv('PROXY_DNS_MIN_TTL', '5'))
+DNS_MAX_TTL = float(os.getenv('PROXY_DNS_MAX_TTL', '600'))
+PREWARM_ENABLED = os.getenv('PROXY_PREWARM', 'true').lower() == 'true'
+PREWARM_HOSTS = int(os.getenv('PROXY_PREWARM_HOSTS', '8'))  # hottest origins kept warm
+PREWARM_INTERVAL = float(os.getenv('PROXY_PREWARM_INTERVAL', '20'))  # seconds, below the keep-alive expiry
+PREWARM_MIN_HITS = float(os.getenv('PROXY_PREWARM_MIN_HITS', '3'))  # decayed requests before an origin counts as hot
+PREWARM_TRACKED = max(64, PREWARM_HOSTS * 8)  # origins counted at once; the coldest make room for new ones
+
+# Shared client and per-host slot tracking
+_client: Optional[httpx.AsyncClient] = None
+host_semaphores: Dict[str, asyncio.Semaphore] = {}
+host_in_flight: Dict[str, int] = {}
+host_waiting: Dict[str, int] = {}
+host_breakers: "OrderedDict[str, CircuitBreaker]" = OrderedDict()
+
+# DNS cache under the pool's transport, and decayed request counts per origin for the pre-warmer
+dns_cache: Optional[DNSCache] = DNSCache(
+    default_ttl=DNS_DEFAULT_TTL,
+    min_ttl=DNS_MIN_TTL,
+    max_ttl=DNS_MAX_TTL
+) if DNS_CACHE_ENABLED else None
+hot_origins: Dict[str, float] = {}
+_prewarm_task: Optional[asyncio.Task] = None
+
+# Pool metrics
+pool_metrics = {
+    "requests": 0,
+    "in_flight": 0,
+    "peak_in_flight": 0,
+    "host_waits": 0,
+    "host_queue_rejected": 0,
+    "host_queue_timeouts": 0,
+    "clients_created": 0,
+    "prewarm_runs": 0,
+    "prewarm_connections": 0,
+    "prewarm_errors": 0,
+    "started_at": None
+}
+
+def _create_client() -> httpx.AsyncClient:
+    """
+    Build the pooled upstream client. Timeouts and redirect policy are set per request.
+    """
+    pool_metrics["clients_created"] += 1
+    transport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE,
+            keepalive_expiry=POOL_KEEPALIVE_EXPIRY
+        ),
+        http2=POOL_HTTP2,
+        verify=True
+    )
+    if dns_cache is not None:
+        # httpx does not take a network backend, so the pool's backend is replaced in place
+        transport._pool._network_backend = CachingNetworkBackend(dns_cache)
+    return httpx.AsyncClient(
+        transport=transport,
+        max_redirects=MAX_REDIRECTS
+    )
+
+async def start_pool() -> None:
+    """
+    Create the shared upstream client, called from the application lifespan
+    """
+    global _client, _prewarm_task
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+        pool_metrics["started_at"] = time.time()
+        logger.info(
+            f"Upstream pool started (max_connections={POOL_MAX_CONNECTIONS}, "
+            f"keepalive={POOL_MAX_KEEPALIVE}, per_host={POOL_MAX_PER_HOST})"
+        )
+    if PREWARM_ENABLED and (_prewarm_task is None or _prewarm_task.done()):
+        _prewarm_task = asyncio.ensure_future(_prewarm_loop())
+
+async def close_pool() -> None:
+    """
+    Close the shared upstream client and release all pooled connections
+    """
+    global _client, _prewarm_task
+    if _prewarm_task is not None:
+        _prewarm_task.cancel()
+        _prewarm_task = None
+    if _client is not None:
+        try:
+            await _client.aclose()
+        except Exception as e:
+            logger.error(f"Error closing upstream pool: {str(e)}")
+        _client = None
+        logger.info(f"Upstream pool closed. Final stats: {pool_metrics}")
+    host_semaphores.clear()
+    host_in_flight.clear()
+    host_waiting.clear()
+    if dns_cache is not None:
+        dns_cache.close()
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Return the shared upstream client, creating it lazily if the lifespan did not run
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+        pool_metrics["started_at"] = time.time()
+    return _client
+
+def get_breaker(host: str) -> CircuitBreaker:
+    """
+    Return the circuit breaker for a host, keeping at most BREAKER_MAX_HOSTS of them
+    """
+    breaker = host_breakers.get(host)
+    if breaker is None:
+        breaker = host_breakers[host] = CircuitBreaker(
+            host,
+            failure_threshold=BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=BREAKER_RESET_TIMEOUT,
+            negative_ttl=NEGATIVE_CACHE_TTL
+        )
+        while len(host_breakers) > BREAKER_MAX_HOSTS:
+            host_breakers.popitem(last=False)
+    else:
+        host_breakers.move_to_end(host)
+    return breaker
+
+class HostSlot:
+    """
+    A held upstream slot; callers report the response status through it so 5xx counts as a failure
+    """
+
+    def __init__(self, breaker: CircuitBreaker):
+        self.breaker = breaker
+        self.settled = False
+
+    def record_status(self, status_code: int) -> None:
+        if self.settled:
+            return
+        self.settled = True
+        if status_code >= 500:
+            self.breaker.record_failure(f"HTTP {status_code}")
+        else:
+            self.breaker.record_success()
+
+    def abandon(self) -> None:
+        """
+        Settle the slot without a verdict, for requests given up for reasons of their own such as a client deadline
+        """
+        if self.settled:
+            return
+        self.settled = True
+        self.breaker.release()
+
+    def record_error(self, error: BaseException) -> None:
+        if self.settled:
+            return
+        if isinstance(error, httpx.TimeoutException):
+            self.settled = True
+            self.breaker.record_failure("timeout")
+        elif isinstance(error, httpx.TransportError):
+            self.settled = True
+            dns = is_dns_failure(error)
+            self.breaker.record_failure("DNS failure" if dns else type(error).__name__, dns=dns)
+
+async def _acquire_host_semaphore(host: str, semaphore: asyncio.Semaphore) -> None:
+    if not semaphore.locked():
+        await semaphore.acquire()
+        return
+
+    # Queue behind the in-flight requests, but only so many and only for so long
+    if host_waiting.get(host, 0) >= HOST_MAX_QUEUE:
+        pool_metrics["host_queue_rejected"] += 1
+        raise HostUnavailable(host, "too many queued requests", 1.0)
+    pool_metrics["host_waits"] += 1
+    host_waiting[host] = host_waiting.get(host, 0) + 1
+    try:
+        await asyncio.wait_for(semaphore.acquire(), HOST_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        pool_metrics["host_queue_timeouts"] += 1
+        raise HostUnavailable(host, f"no slot free after {HOST_QUEUE_TIMEOUT}s", 1.0)
+    finally:
+        host_waiting[host] -= 1
+        if host_waiting[host] <= 0:
+            del host_waiting[host]
+
+@asynccontextmanager
+async def host_slot(url: str):
+    """
+    Hold one of the POOL_MAX_PER_HOST upstream slots for the host of the given URL.
+
+    Requests to a host whose circuit breaker is open fail fast with
+    HostUnavailable, as do requests that would queue behind HOST_MAX_QUEUE
+    others or wait longer than HOST_QUEUE_TIMEOUT. Transport errors and
+    timeouts raised inside the block, and statuses reported through the
+    yielded HostSlot, feed the breaker; a block that exits cleanly without
+    reporting a status counts as a success.
+    """
+    parsed = httpx.URL(url)
+    host = parsed.host
+    breaker = get_breaker(host)
+    breaker.check()
+    if PREWARM_ENABLED:
+        record_origin(origin_key(parsed))
+
+    semaphore = host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = host_semaphores[host] = asyncio.Semaphore(POOL_MAX_PER_HOST)
+
+    # Waiters are counted too so the semaphore is only dropped once nobody holds a reference
+    host_in_flight[host] = host_in_flight.get(host, 0) + 1
+    try:
+        await _acquire_host_semaphore(host, semaphore)
+        try:
+            # The breaker may have opened while this request was queued
+            breaker.before_request()
+            slot = HostSlot(breaker)
+            pool_metrics["requests"] += 1
+            pool_metrics["in_flight"] += 1
+            pool_metrics["peak_in_flight"] = max(pool_metrics["peak_in_flight"], pool_metrics["in_flight"])
+            try:
+                yield slot
+            except BaseException as e:
+                slot.record_error(e)
+                raise
+            else:
+                if not slot.settled:
+                    slot.record_status(200)
+            finally:
+                pool_metrics["in_flight"] -= 1
+                if not slot.settled:
+                    breaker.release()
+        finally:
+            semaphore.release()
+    finally:
+        host_in_flight[host] -= 1
+        if host_in_flight[host] <= 0:
+            del host_in_flight[host]
+            host_semaphores.pop(host, None)
+
+# Helper function to key connections and traffic by scheme, host and port
+def origin_key(url: httpx.URL) -> str:
+    port = url.port or (443 if url.scheme == "https" else 80)
+    return f"{url.scheme}://{url.host}:{port}"
+
+def idle_connections_by_origin() -> Dict[str, int]:
+    """
+    Count idle, reusable pooled connections per origin
+    """
+    counts: Dict[str, int] = {}
+    if _client is None or _client.is_closed:
+        return counts
+    try:
+        connections = list(_client._transport._pool.connections)
+    except AttributeError:
+        return counts
+    for connection in connections:
+        if not connection.is_idle():
+            continue
+        origin = connection._origin
+        key = f"{origin.scheme.decode()}://{origin.host.decode()}:{origin.port}"
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+# Helper function to count a request to an origin, keeping at most PREWARM_TRACKED origins between decays
+def record_origin(origin: str) -> None:
+    if origin not in hot_origins and len(hot_origins) >= PREWARM_TRACKED:
+        del hot_origins[min(hot_origins, key=hot_origins.get)]
+    hot_origins[origin] = hot_origins.get(origin, 0.0) + 1
+
+def hottest_origins() -> list:
+    ranked = heapq.nlargest(PREWARM_HOSTS, hot_origins.items(), key=lambda item: item[1])
+    return [origin for origin, hits in ranked if hits >= PREWARM_MIN_HITS]
+
+async def _prewarm_origin(origin: str, idle: Dict[str, int]) -> None:
+    host = httpx.URL(origin).host
+    if get_breaker(host).state != "closed":
+        return
+    # Refresh the address before it expires so the next request never waits on DNS
+    if dns_cache is not None:
+        await dns_cache.prefetch(host, ahead=PREWARM_INTERVAL * 2)
+    if idle.get(origin, 0) == 0:
+        # A HEAD request leaves a handshaken keep-alive connection in the pool
+        response = await get_client().head(origin + "/", timeout=httpx.Timeout(5.0))
+        await response.aclose()
+        pool_metrics["prewarm_connections"] += 1
+
+async def prewarm_once() -> None:
+    """
+    Keep DNS answers and an idle connection ready for the hottest origins
+    """
+    hot = hottest_origins()
+    # Decay the counts so origins drop out once their traffic stops
+    for origin in list(hot_origins):
+        hot_origins[origin] /= 2
+        if hot_origins[origin] < 0.5:
+            del hot_origins[origin]
+
+    idle = idle_connections_by_origin()
+    results = await asyncio.gather(*[_prewarm_origin(origin, idle) for origin in hot], return_exceptions=True)
+    for origin, result in zip(hot, results):
+        if isinstance(result, Exception):
+            pool_metrics["prewarm_errors"] += 1
+            logger.debug(f"Pre-warming {origin} failed: {str(result)}")
+    pool_metrics["prewarm_runs"] += 1
+
+async def _prewarm_loop() -> None:
+    while True:
+        await asyncio.sleep(PREWARM_INTERVAL)
+        try:
+            await prewarm_once()
+        except Exception as e:
+            logger.warning(f"Connection pre-warming failed: {str(e)}")
+
+def get_breaker_stats() -> Dict[str, Any]:
+    """
+    Report breakers that are not simply closed and healthy, plus totals
+    """
+    hosts = {host: breaker.stats() for host, breaker in host_breakers.items() if not breaker.idle}
+    return {
+        "failure_threshold": BREAKER_FAILURE_THRESHOLD,
+        "reset_timeout": BREAKER_RESET_TIMEOUT,
+        "negative_ttl": NEGATIVE_CACHE_TTL,
+        "tracked_hosts": len(host_breakers),
+        "open": sum(1 for breaker in host_breakers.values() if breaker.state != "closed"),
+        "hosts": hosts
+    }
+
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    Report pool configuration and current utilization
+    """
+    connections = []
+    if _client is not None and not _client.is_closed:
+        try:
+            connections = list(_client._transport._pool.connections)
+        except AttributeError:
+            connections = []
+
+    idle = sum(1 for conn in connections if conn.is_idle())
+
+    return {
+        "limits": {
+            "max_connections": POOL_MAX_CONNECTIONS,
+            "max_keepalive": POOL_MAX_KEEPALIVE,
+            "keepalive_expiry": POOL_KEEPALIVE_EXPIRY,
+            "max_per_host": POOL_MAX_PER_HOST,
+            "http2": POOL_HTTP2
+        },
+        "connections": {
+            "total": len(connections),
+            "idle": idle,
+            "active": len(connections) - idle,
+            "utilization": round(len(connections) / max(1, POOL_MAX_CONNECTIONS), 4)
+        },
+        "requests": pool_metrics["requests"],
+        "in_flight": pool_metrics["in_flight"],
+        "peak_in_flight": pool_metrics["peak_in_flight"],
+        "host_waits": pool_metrics["host_waits"],
+        "host_queue_rejected": pool_metrics["host_queue_rejected"],
+        "host_queue_timeouts": pool_metrics["host_queue_timeouts"],
+        "hosts_in_flight": dict(host_in_flight),
+        "hosts_waiting": dict(host_waiting),
+        "clients_created": pool_metrics["clients_created"],
+        "dns": dns_cache.stats() if dns_cache is not None else None,
+        "prewarm": get_prewarm_stats(),
+        "uptime": time.time() - pool_metrics["started_at"] if pool_metrics["started_at"] else 0
+    }
+
+def get_prewarm_stats() -> Dict[str, Any]:
+    """
+    Report the origins being kept warm and how many idle connections each has
+    """
+    hot = hottest_origins()
+    idle = idle_connections_by_origin()
+    return {
+        "enabled": PREWARM_ENABLED,
+        "interval": PREWARM_INTERVAL,
+        "hot_origins": {origin: idle.get(origin, 0) for origin in hot},
+        "warm_connections": sum(idle.get(origin, 0) for origin in hot),
+        "idle_connections": sum(idle.values()),
+        "runs": pool_metrics["prewarm_runs"],
+        "connections_opened": pool_metrics["prewarm_connections"],
+        "errors": pool_metrics["prewarm_errors"]
+    }
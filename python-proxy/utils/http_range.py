@@ -0,0 +1,88 @@
+from typing import Dict, Optional, Tuple
+from utils.http_cache import get_header, parse_http_date
+
+# A parsed single byte range: (first, last) with last None for "first-", or (None, length) for a suffix
+ByteRangeSpec = Tuple[Optional[int], Optional[int]]
+
+def parse_range(value: Optional[str]) -> Optional[ByteRangeSpec]:
+    """
+    Parse a single-range "bytes=" Range header.
+
+    Returns None when the header is absent, malformed, not in bytes or asks
+    for several ranges; those requests are passed to the origin unchanged.
+    """
+    if not value:
+        return None
+    unit, _, ranges = value.strip().partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, dash, last = ranges.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if not first:
+            length = int(last)
+            return (None, length) if length > 0 else None
+        start = int(first)
+        end = int(last) if last else None
+    except ValueError:
+        return None
+    if start < 0 or (end is not None and end < start):
+        return None
+    return start, end
+
+def resolve_range(spec: ByteRangeSpec, total: int) -> Optional[Tuple[int, int]]:
+    """
+    Turn a range spec into inclusive (start, end) offsets, or None if it is unsatisfiable
+    """
+    first, last = spec
+    if first is None:
+        if total == 0:
+            return None
+        return max(0, total - last), total - 1
+    if first >= total:
+        return None
+    return first, total - 1 if last is None else min(last, total - 1)
+
+def parse_content_range(value: Optional[str]) -> Optional[Tuple[int, int, Optional[int]]]:
+    """
+    Parse "bytes first-last/total" into (first, last, total), with total None when it is "*"
+    """
+    if not value:
+        return None
+    unit, _, rest = value.strip().partition(" ")
+    if unit.lower() != "bytes":
+        return None
+    span, _, total = rest.strip().partition("/")
+    first, _, last = span.partition("-")
+    try:
+        start, end = int(first), int(last)
+        length = None if total.strip() == "*" else int(total)
+    except ValueError:
+        return None
+    if end < start or (length is not None and end >= length):
+        return None
+    return start, end, length
+
+def content_range(start: int, end: int, total: int) -> str:
+    return f"bytes {start}-{end}/{total}"
+
+def strong_validator(headers: Dict[str, str]) -> Optional[str]:
+    """
+    Return the validator that lets ranges of one representation be combined: a strong ETag, else Last-Modified
+    """
+    etag = get_header(headers, "etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return get_header(headers, "last-modified")
+
+def if_range_matches(if_range: str, headers: Dict[str, str]) -> bool:
+    """
+    Evaluate If-Range against a stored representation (RFC 9110 section 13.1.5)
+    """
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        etag = get_header(headers, "etag")
+        return not if_range.startswith("W/") and etag is not None and etag == if_range
+    last_modified = parse_http_date(get_header(headers, "last-modified"))
+    return last_modified is not None and last_modified == parse_http_date(if_range)
@@ -0,0 +1,57 @@
+import json
+from typing import Any
+from starlette.responses import JSONResponse
+
+# orjson is optional; without it the standard library encoder is used
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+# Helper function to serialize values the encoders do not handle natively, such as pydantic models
+def _default(value: Any) -> Any:
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(content: Any) -> bytes:
+    """
+    Serialize to compact UTF-8 JSON, with orjson when it is installed
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        content,
+        default=_default,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":")
+    ).encode("utf-8")
+
+def dumps_line(content: Any) -> bytes:
+    """
+    Serialize one NDJSON line, newline included
+    """
+    return dumps(content) + b"\n"
+
+def loads(data: Any) -> Any:
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse that renders with orjson when available.
+
+    Content is serialized as given, without FastAPI's jsonable_encoder pass;
+    pydantic models in it are dumped directly.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,505 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from urllib.parse import urlsplit
+from typing import Dict, Any, Callable, Iterable, List, Tuple
+
+# Configure constants from environment variables with defaults
+METRICS_MAX_SERIES = int(os.getenv("METRICS_MAX_SERIES", "1000"))  # label combinations per metric before folding into "other"
+
+# Latency buckets in seconds; upper bounds, +Inf is implicit
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Quantiles reported alongside every histogram
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Status class labels indexed by status code // 100, so no string is built per request
+STATUS_CLASSES = ("other", "1xx", "2xx", "3xx", "4xx", "5xx")
+
+# Helper function to map a status code to its index in STATUS_CLASSES
+def status_index(status_code: int) -> int:
+    index = status_code // 100
+    return index if 0 < index < 6 else 0
+
+# Helper function to map a status code to its class label
+def status_class(status_code: int) -> str:
+    return STATUS_CLASSES[status_index(status_code)]
+
+# Helper function to get the upstream host label for a target URL
+def host_label(url: str) -> str:
+    try:
+        return urlsplit(url).hostname or ""
+    except ValueError:
+        return ""
+
+# Helper function to escape a label value for the text exposition format
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+# Helper function to render a label set, with optional extra labels appended
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+# Helper function to format a sample value the way Prometheus expects
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class CounterSeries:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+class GaugeSeries:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: int = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+class HistogramSeries:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # One slot per bucket plus +Inf, allocated once; observations only bump a slot
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metric(ABC):
+    """
+    A metric family: one series per distinct label combination.
+
+    Series are created on first use and kept for the life of the process, so
+    recording into an existing series only bumps preallocated slots and
+    nothing grows per request. Callers on hot paths can hold on to the series
+    returned by labels() and skip the lookup entirely. Once max_series
+    combinations exist, new ones are folded into a single series with every
+    label set to "other" to bound memory.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), max_series: int = METRICS_MAX_SERIES):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.max_series = max_series
+        self._series: Dict[Tuple[str, ...], Any] = {}
+        self._overflow = tuple("other" for _ in labelnames)
+
+    @abstractmethod
+    def _new_series(self) -> Any:
+        """
+        Create the series for a new label combination
+        """
+
+    def labels(self, *values: str) -> Any:
+        series = self._series.get(values)
+        if series is None:
+            if len(self._series) >= self.max_series:
+                values = self._overflow
+                series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = self._new_series()
+        return series
+
+    def series(self) -> Iterable[Tuple[Tuple[str, ...], Any]]:
+        return list(self._series.items())
+
+    def reset(self) -> None:
+        self._series.clear()
+
+    @abstractmethod
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Plain-data form of the family, as Registry.snapshot() collects it
+        """
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_series(self) -> CounterSeries:
+        return CounterSeries()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return family(self.name, self.kind, self.help, self.labelnames,
+                      [[list(values), series.value] for values, series in self.series()])
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_series(self) -> GaugeSeries:
+        return GaugeSeries()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return family(self.name, self.kind, self.help, self.labelnames,
+                      [[list(values), series.value] for values, series in self.series()])
+
+class Histogram(Metric):
+    """
+    Fixed-bucket histogram. Quantiles are estimated from the buckets at
+    scrape time by linear interpolation, as Prometheus' histogram_quantile does,
+    and published as a companion <name>_quantile gauge.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS, max_series: int = METRICS_MAX_SERIES):
+        super().__init__(name, help_text, labelnames, max_series)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new_series(self) -> HistogramSeries:
+        return HistogramSeries(self.bounds)
+
+    def summary(self, **match: str) -> Dict[str, float]:
+        """
+        Count, mean and quantiles over every series whose labels match
+        """
+        counts = [0] * (len(self.bounds) + 1)
+        total_sum = 0.0
+        total_count = 0
+        for values, series in self.series():
+            labels = dict(zip(self.labelnames, values))
+            if any(labels.get(name) != value for name, value in match.items()):
+                continue
+            for index, count in enumerate(series.counts):
+                counts[index] += count
+            total_sum += series.sum
+            total_count += series.count
+        result = {
+            "count": total_count,
+            "mean": total_sum / total_count if total_count else 0.0
+        }
+        for q in QUANTILES:
+            result[f"p{int(q * 100)}"] = bucket_quantile(self.bounds, counts, q)
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        snapshot = family(self.name, self.kind, self.help, self.labelnames,
+                          [[list(values), {"counts": list(series.counts), "sum": series.sum}] for values, series in self.series()])
+        snapshot["bounds"] = list(self.bounds)
+        return snapshot
+
+# Helper function to estimate a quantile from non-cumulative bucket counts
+def bucket_quantile(bounds, counts: List[int], q: float) -> float:
+    total = sum(counts)
+    if total == 0:
+        return 0.0
+    rank = q * total
+    cumulative = 0
+    for index, count in enumerate(counts):
+        if cumulative + count >= rank and count > 0:
+            if index == len(bounds):
+                # Past the last finite bucket: the best estimate is its upper bound
+                return bounds[-1]
+            lower = bounds[index - 1] if index > 0 else 0.0
+            upper = bounds[index]
+            return lower + (upper - lower) * (rank - cumulative) / count
+        cumulative += count
+    return bounds[-1]
+
+# Helper function to build the plain-data form of a metric family, as snapshots carry it
+def family(name: str, kind: str, help_text: str, labelnames, series: List[List[Any]]) -> Dict[str, Any]:
+    return {"name": name, "kind": kind, "help": help_text, "labelnames": list(labelnames), "series": series}
+
+# Helper function to render one metric family in the text exposition format
+def render_family(metric: Dict[str, Any]) -> List[str]:
+    name = metric["name"]
+    names = tuple(metric["labelnames"])
+    lines = [f"# HELP {name} {metric['help']}", f"# TYPE {name} {metric['kind']}"]
+    if metric["kind"] != "histogram":
+        for values, value in metric["series"]:
+            lines.append(f"{name}{format_labels(names, tuple(values))} {format_value(value)}")
+        return lines
+
+    bounds = tuple(metric["bounds"])
+    quantile_lines = []
+    for values, data in metric["series"]:
+        values = tuple(values)
+        cumulative = 0
+        for bound, count in zip(bounds + (float("inf"),), data["counts"]):
+            cumulative += count
+            le = 'le="' + format_value(bound) + '"'
+            lines.append(f"{name}_bucket{format_labels(names, values, le)} {cumulative}")
+        lines.append(f"{name}_sum{format_labels(names, values)} {format_value(data['sum'])}")
+        lines.append(f"{name}_count{format_labels(names, values)} {cumulative}")
+        for q in QUANTILES:
+            quantile = 'quantile="' + str(q) + '"'
+            quantile_lines.append(
+                f"{name}_quantile{format_labels(names, values, quantile)} "
+                f"{format_value(bucket_quantile(bounds, data['counts'], q))}"
+            )
+    if quantile_lines:
+        lines.append(f"# HELP {name}_quantile {metric['help']} (estimated from buckets)")
+        lines.append(f"# TYPE {name}_quantile gauge")
+        lines.extend(quantile_lines)
+    return lines
+
+# Helper function to render a snapshot in the Prometheus text exposition format (version 0.0.4)
+def render_snapshot(snapshot: List[Dict[str, Any]]) -> str:
+    lines = []
+    for metric in snapshot:
+        lines.extend(render_family(metric))
+    return "\n".join(lines) + "\n"
+
+# Helper function to combine snapshots from several worker processes into one
+def merge_snapshots(snapshots: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    merged: Dict[str, Dict[str, Any]] = {}
+    merged_series: Dict[str, Dict[Tuple[str, ...], Any]] = {}
+    for snapshot in snapshots:
+        for metric in snapshot:
+            name = metric["name"]
+            if name not in merged:
+                merged[name] = {**metric, "series": []}
+                merged_series[name] = {}
+            series = merged_series[name]
+            for values, data in metric["series"]:
+                key = tuple(values)
+                current = series.get(key)
+                if current is None:
+                    series[key] = {"counts": list(data["counts"]), "sum": data["sum"]} if isinstance(data, dict) else data
+                elif isinstance(data, dict):
+                    # Counters, gauges and histogram buckets from separate processes add up
+                    current["counts"] = [a + b for a, b in zip(current["counts"], data["counts"])]
+                    current["sum"] += data["sum"]
+                elif metric.get("aggregate") == "max":
+                    # Every worker reports the same shared value
+                    series[key] = max(current, data)
+                else:
+                    series[key] = current + data
+    for name, metric in merged.items():
+        metric["series"] = [[list(values), data] for values, data in merged_series[name].items()]
+    return list(merged.values())
+
+# A collector returns (name, kind, help, labels, value) samples read from existing state at scrape time
+Collector = Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]
+
+class Registry:
+    """
+    Holds metric families and scrape-time collectors. snapshot() turns them
+    into plain data that can be merged with other workers' snapshots before
+    rendering.
+    """
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._collectors: List[Tuple[Collector, str]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector, aggregate: str = "sum") -> None:
+        """
+        Add a scrape-time collector. Its samples are summed across workers,
+        or with aggregate="max" taken once when they describe shared state.
+        """
+        self._collectors.append((collector, aggregate))
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        snapshot = [metric.snapshot() for metric in self._metrics]
+
+        # Samples from collectors are grouped by name so each family is declared once
+        families: Dict[str, Dict[str, Any]] = {}
+        for collector, aggregate in self._collectors:
+            for name, kind, help_text, labels, value in collector():
+                if name not in families:
+                    families[name] = family(name, kind, help_text, tuple(labels), [])
+                    families[name]["aggregate"] = aggregate
+                metric = families[name]
+                metric["series"].append([[labels[n] for n in metric["labelnames"]], value])
+        snapshot.extend(families.values())
+        return snapshot
+
+    def render(self) -> str:
+        return render_snapshot(self.snapshot())
+
+# Shared registry and the metrics recorded across routers
+registry = Registry()
+
+REQUEST_DURATION = registry.register(Histogram(
+    "http_request_duration_seconds",
+    "Time from receiving a request to sending the last byte of its response",
+    ("route", "upstream_host", "status_class", "model")
+))
+REQUEST_BYTES = registry.register(Counter(
+    "http_request_bytes_total",
+    "Request body bytes received from clients",
+    ("route",)
+))
+RESPONSE_BYTES = registry.register(Counter(
+    "http_response_bytes_total",
+    "Response body bytes sent to clients",
+    ("route",)
+))
+UPSTREAM_BYTES = registry.register(Counter(
+    "upstream_response_bytes_total",
+    "Response body bytes received from upstream hosts",
+    ("upstream_host",)
+))
+IN_FLIGHT = registry.register(Gauge(
+    "http_requests_in_flight",
+    "Requests currently being served"
+))
+CACHE_LOOKUPS = registry.register(Counter(
+    "proxy_cache_lookups_total",
+    "Proxy cache lookups by result",
+    ("result",)
+))
+
+# Pre-bound series for the hottest recording sites
+in_flight = IN_FLIGHT.labels()
+cache_hit = CACHE_LOOKUPS.labels("hit")
+cache_miss = CACHE_LOOKUPS.labels("miss")
+cache_stale = CACHE_LOOKUPS.labels("stale")
+cache_revalidated = CACHE_LOOKUPS.labels("revalidated")
+
+class RouteSeries:
+    """
+    The request series of one route, bound on its first request.
+
+    Duration series are bound per upstream host, model and status class the
+    first time each combination is seen, so recording a finished request is
+    a few dict lookups and increments with no label tuple built.
+    """
+
+    __slots__ = ("route", "request_bytes", "response_bytes", "durations")
+
+    def __init__(self, route: str):
+        self.route = route
+        self.request_bytes = REQUEST_BYTES.labels(route)
+        self.response_bytes = RESPONSE_BYTES.labels(route)
+        # upstream host -> model -> one duration series slot per status class
+        self.durations: Dict[str, Dict[str, List[Any]]] = {}
+
+    def duration(self, host: str, model: str, status: int) -> HistogramSeries:
+        by_model = self.durations.get(host)
+        if by_model is None:
+            if len(self.durations) >= METRICS_MAX_SERIES:
+                # Unbounded hosts are not cached here; the family folds them into "other"
+                return REQUEST_DURATION.labels(self.route, host, status_class(status), model)
+            by_model = self.durations[host] = {}
+        slots = by_model.get(model)
+        if slots is None:
+            if len(by_model) >= METRICS_MAX_SERIES:
+                return REQUEST_DURATION.labels(self.route, host, status_class(status), model)
+            slots = by_model[model] = [None] * len(STATUS_CLASSES)
+        index = status_index(status)
+        series = slots[index]
+        if series is None:
+            series = slots[index] = REQUEST_DURATION.labels(self.route, host, STATUS_CLASSES[index], model)
+        return series
+
+# Route template -> its bound series; routes are a fixed set, plus "unmatched"
+route_series: Dict[str, RouteSeries] = {}
+
+# Upstream host -> its bound received-bytes series
+upstream_series: Dict[str, CounterSeries] = {}
+
+# Helper function to get the bound series for a route
+def series_for_route(route: str) -> RouteSeries:
+    bound = route_series.get(route)
+    if bound is None:
+        bound = route_series[route] = RouteSeries(route)
+    return bound
+
+# Helper function to get the bound received-bytes series for an upstream host
+def upstream_bytes(host: str) -> CounterSeries:
+    series = upstream_series.get(host)
+    if series is None:
+        series = UPSTREAM_BYTES.labels(host)
+        if len(upstream_series) < METRICS_MAX_SERIES:
+            upstream_series[host] = series
+    return series
+
+class CountingExchange:
+    """
+    Per-request state for MetricsMiddleware: wraps receive and send to note
+    the status code and count body bytes in both directions.
+    """
+
+    __slots__ = ("_receive", "_send", "status", "received", "sent")
+
+    def __init__(self, receive, send):
+        self._receive = receive
+        self._send = send
+        self.status = 500
+        self.received = 0
+        self.sent = 0
+
+    async def receive(self):
+        message = await self._receive()
+        if message["type"] == "http.request":
+            self.received += len(message.get("body", b""))
+        return message
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+        elif message["type"] == "http.response.body":
+            self.sent += len(message.get("body", b""))
+        await self._send(message)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that times every HTTP request through to its last body
+    byte and counts the bytes received and sent.
+
+    The route label is the matched route's path template, so it stays bounded.
+    Handlers add the upstream host or AI model by setting
+    request.state.upstream_host or request.state.model.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        in_flight.value += 1
+        exchange = CountingExchange(receive, send)
+        try:
+            await self.app(scope, exchange.receive, exchange.send)
+        finally:
+            in_flight.value -= 1
+            route = scope.get("route")
+            bound = series_for_route(getattr(route, "path", None) or "unmatched")
+            state = scope.get("state")
+            if state:
+                series = bound.duration(state.get("upstream_host", ""), state.get("model", ""), exchange.status)
+            else:
+                series = bound.duration("", "", exchange.status)
+            series.observe(time.perf_counter() - start)
+            if exchange.received:
+                bound.request_bytes.inc(exchange.received)
+            if exchange.sent:
+                bound.response_bytes.inc(exchange.sent)
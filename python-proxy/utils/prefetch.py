@@ -0,0 +1,223 @@
+import time
+import codecs
+import asyncio
+import logging
+from collections import OrderedDict
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urldefrag
+from typing import Dict, Any, List, Optional, Set, Callable, Awaitable, Tuple
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("prefetch")
+
+# Accept headers a browser sends for each kind of subresource
+ACCEPT_BY_KIND = {
+    "script": "*/*",
+    "style": "text/css,*/*;q=0.1",
+    "image": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8",
+    "font": "*/*"
+}
+
+# Fetch callback: (url, kind) -> None when skipped, else (cache_key, stored)
+PrefetchFetch = Callable[[str, str], Awaitable[Optional[Tuple[str, bool]]]]
+
+# Helper function to tell which kind of subresource a preload link points at
+def preload_kind(attrs: Dict[str, Optional[str]]) -> Optional[str]:
+    destination = (attrs.get("as") or "").lower()
+    if destination in ("script", "style", "image", "font"):
+        return destination
+    return None
+
+class SubresourceScanner(HTMLParser):
+    """
+    Incremental scanner for the subresources an HTML page loads first.
+
+    Chunks are fed as they arrive from upstream and tokenized with the
+    standard library's HTMLParser, so no DOM is built. Scripts, stylesheets,
+    preloads and images are collected as absolute http(s) URLs, resolved
+    against the page URL or its <base href>. Scanning stops once max_urls
+    have been found or max_bytes have been fed.
+    """
+
+    def __init__(self, page_url: str, charset: Optional[str], max_urls: int, max_bytes: int):
+        super().__init__(convert_charrefs=True)
+        self.base_url = page_url
+        self.max_urls = max_urls
+        self.max_bytes = max_bytes
+        self.found: "OrderedDict[str, str]" = OrderedDict()
+        self.scanned = 0
+        self.done = False
+        self._base_seen = False
+        self._taken = 0
+        try:
+            self._decoder = codecs.getincrementaldecoder(charset or "utf-8")(errors="replace")
+        except LookupError:
+            self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def feed_bytes(self, chunk: bytes) -> None:
+        if self.done:
+            return
+        chunk = chunk[:self.max_bytes - self.scanned]
+        self.scanned += len(chunk)
+        try:
+            self.feed(self._decoder.decode(chunk))
+        except Exception as e:
+            # Malformed markup only ends the scan; the page itself is unaffected
+            logger.debug(f"Stopped scanning {self.base_url}: {str(e)}")
+            self.done = True
+        if self.scanned >= self.max_bytes:
+            self.done = True
+
+    def handle_starttag(self, tag: str, attr_list: List[Tuple[str, Optional[str]]]) -> None:
+        if self.done:
+            return
+        attrs = dict(attr_list)
+        if tag == "base" and not self._base_seen and attrs.get("href"):
+            self._base_seen = True
+            self.base_url = urljoin(self.base_url, attrs["href"])
+        elif tag == "script" and attrs.get("src"):
+            self._add(attrs["src"], "script")
+        elif tag == "link" and attrs.get("href"):
+            rels = set((attrs.get("rel") or "").lower().split())
+            if "stylesheet" in rels:
+                self._add(attrs["href"], "style")
+            elif "modulepreload" in rels:
+                self._add(attrs["href"], "script")
+            elif "preload" in rels and preload_kind(attrs):
+                self._add(attrs["href"], preload_kind(attrs))
+            elif "icon" in rels:
+                self._add(attrs["href"], "image")
+        elif tag == "img" and attrs.get("src") and (attrs.get("loading") or "").lower() != "lazy":
+            self._add(attrs["src"], "image")
+
+    handle_startendtag = handle_starttag
+
+    def _add(self, reference: str, kind: str) -> None:
+        url, _ = urldefrag(urljoin(self.base_url, reference.strip()))
+        if not url.startswith(("http://", "https://")) or url in self.found:
+            return
+        self.found[url] = kind
+        if len(self.found) >= self.max_urls:
+            self.done = True
+
+    def take_new(self) -> List[Tuple[str, str]]:
+        """
+        Return the (url, kind) pairs found since the last call
+        """
+        found = list(self.found.items())[self._taken:]
+        self._taken = len(self.found)
+        return found
+
+class Prefetcher:
+    """
+    Background cache warming for subresources found in proxied pages.
+
+    Prefetches run as tasks behind a global concurrency limit; URLs found
+    while max_pending prefetches are already queued are dropped.
+    Each warmed cache key is remembered (up to track_entries) so a later
+    cache hit on it counts as a prefetch hit, while keys that were not stored,
+    were evicted before use or aged out of tracking count as waste.
+    """
+
+    def __init__(self, concurrency: int, max_pending: int, track_entries: int = 2048):
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.track_entries = track_entries
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._pending_urls: Set[str] = set()
+        self._tracked: "OrderedDict[str, float]" = OrderedDict()
+        self.counters = {
+            "pages_scanned": 0,
+            "urls_found": 0,
+            "scheduled": 0,
+            "skipped": 0,
+            "dropped": 0,
+            "completed": 0,
+            "failed": 0,
+            "hits": 0,
+            "wasted": 0
+        }
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def schedule(self, urls: List[Tuple[str, str]], fetch: PrefetchFetch) -> None:
+        """
+        Start background fetches for (url, kind) pairs.
+
+        fetch returns None when there was nothing to do (the URL is already
+        cached or being fetched), otherwise the cache key and whether the
+        response was stored under it.
+        """
+        self.counters["urls_found"] += len(urls)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        for url, kind in urls:
+            if url in self._pending_urls:
+                self.counters["skipped"] += 1
+                continue
+            if len(self._tasks) >= self.max_pending:
+                self.counters["dropped"] += 1
+                continue
+            self._pending_urls.add(url)
+            task = asyncio.ensure_future(self._run(url, kind, fetch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            self.counters["scheduled"] += 1
+
+    async def _run(self, url: str, kind: str, fetch: PrefetchFetch) -> None:
+        try:
+            async with self._semaphore:
+                result = await fetch(url, kind)
+            if result is None:
+                self.counters["skipped"] += 1
+                return
+            cache_key, stored = result
+            self.counters["completed"] += 1
+            if stored:
+                self._track(cache_key)
+            else:
+                # Uncacheable or refused admission: the transfer was wasted
+                self.counters["wasted"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.counters["failed"] += 1
+            logger.debug(f"Prefetch of {url} failed: {str(e)}")
+        finally:
+            self._pending_urls.discard(url)
+
+    def _track(self, cache_key: str) -> None:
+        self._tracked[cache_key] = time.time()
+        self._tracked.move_to_end(cache_key)
+        while len(self._tracked) > self.track_entries:
+            self._tracked.popitem(last=False)
+            self.counters["wasted"] += 1
+
+    def record_lookup(self, cache_key: str, hit: bool) -> None:
+        """
+        Count a cache lookup of a prefetched key as a hit, or as waste if the entry is gone
+        """
+        if self._tracked.pop(cache_key, None) is not None:
+            self.counters["hits" if hit else "wasted"] += 1
+
+    def clear(self) -> None:
+        self._tracked.clear()
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._semaphore = None
+
+    def stats(self) -> Dict[str, Any]:
+        used = self.counters["hits"] + self.counters["wasted"]
+        return {
+            **self.counters,
+            "in_flight": len(self._tasks),
+            "tracked": len(self._tracked),
+            "hit_ratio": self.counters["hits"] / max(1, used)
+        }
@@ -0,0 +1,389 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import Dict, Any, Optional, Callable, List, Tuple
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("shared_state")
+
+# Configure constants from environment variables with defaults
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "")  # empty keeps all state process-local
+SHARED_STATE_BUSY_TIMEOUT = float(os.getenv("SHARED_STATE_BUSY_TIMEOUT", "5"))  # seconds to wait for another worker's write
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", "268435456"))  # 256MB
+SHARED_CACHE_TRIM_EVERY = 64  # writes between size checks
+SHARED_CACHE_TOUCH_INTERVAL = 60  # seconds; coarser recency keeps hits from turning into writes
+
+class LocalNamespace:
+    """
+    Process-local keyed store with the same interface as SharedNamespace.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._data: Dict[str, Any] = {}
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        return self._data.get(key, default)
+
+    async def set(self, key: str, value: Any) -> None:
+        self._data[key] = value
+
+    async def contains(self, key: str) -> bool:
+        return key in self._data
+
+    async def count(self) -> int:
+        return len(self._data)
+
+    async def pop(self, key: str, default: Any = None) -> Any:
+        return self._data.pop(key, default)
+
+    async def items(self) -> List[Tuple[str, Any]]:
+        return list(self._data.items())
+
+    async def find(self, field: str, value: Any) -> List[Any]:
+        """
+        Values whose top-level field equals value
+        """
+        return [item for item in self._data.values() if isinstance(item, dict) and item.get(field) == value]
+
+    async def expire(self, field: str, cutoff: float) -> int:
+        """
+        Remove values whose top-level timestamp field is older than cutoff and return how many went
+        """
+        expired = [
+            key for key, item in self._data.items()
+            if isinstance(item, dict) and isinstance(item.get(field), (int, float)) and item[field] < cutoff
+        ]
+        for key in expired:
+            del self._data[key]
+        return len(expired)
+
+    async def update(self, key: str, func: Callable[[Optional[Any]], Any]) -> Any:
+        """
+        Replace the value for key with func(current value or None) and return it
+        """
+        value = func(self._data.get(key))
+        self._data[key] = value
+        return value
+
+class SharedNamespace:
+    """
+    Keyed store in a SharedStore table, visible to every worker process.
+
+    Values are JSON documents. update() reads and writes inside one
+    immediate transaction, so read-modify-write sequences such as rate-limit
+    counters stay atomic across workers. Values returned by get() are copies:
+    write them back or use update() to change them. SQLite work, including
+    waiting for another worker's write, runs in a thread so the event loop
+    never blocks on it.
+    """
+
+    def __init__(self, store: "SharedStore", name: str):
+        self.store = store
+        self.name = name
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        rows = await asyncio.to_thread(
+            self.store.execute, "SELECT value FROM kv WHERE namespace = ? AND key = ?", (self.name, key)
+        )
+        row = rows.fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    async def set(self, key: str, value: Any) -> None:
+        await asyncio.to_thread(
+            self.store.execute,
+            "INSERT OR REPLACE INTO kv (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+            (self.name, key, json.dumps(value), time.time())
+        )
+
+    async def contains(self, key: str) -> bool:
+        rows = await asyncio.to_thread(
+            self.store.execute, "SELECT 1 FROM kv WHERE namespace = ? AND key = ?", (self.name, key)
+        )
+        return rows.fetchone() is not None
+
+    async def count(self) -> int:
+        rows = await asyncio.to_thread(self.store.execute, "SELECT COUNT(*) FROM kv WHERE namespace = ?", (self.name,))
+        return rows.fetchone()[0]
+
+    async def pop(self, key: str, default: Any = None) -> Any:
+        def pop_row(db: sqlite3.Connection) -> Any:
+            row = db.execute("SELECT value FROM kv WHERE namespace = ? AND key = ?", (self.name, key)).fetchone()
+            if row is None:
+                return default
+            db.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (self.name, key))
+            return json.loads(row[0])
+        return await asyncio.to_thread(self.store.transaction, pop_row)
+
+    async def items(self) -> List[Tuple[str, Any]]:
+        rows = await asyncio.to_thread(self.store.execute, "SELECT key, value FROM kv WHERE namespace = ?", (self.name,))
+        return [(key, json.loads(value)) for key, value in rows.fetchall()]
+
+    async def find(self, field: str, value: Any) -> List[Any]:
+        """
+        Values whose top-level field equals value, filtered in SQL
+        """
+        rows = await asyncio.to_thread(
+            self.store.execute,
+            "SELECT value FROM kv WHERE namespace = ? AND json_extract(value, ?) = ?",
+            (self.name, f"$.{field}", value)
+        )
+        return [json.loads(row[0]) for row in rows.fetchall()]
+
+    async def expire(self, field: str, cutoff: float) -> int:
+        """
+        Remove values whose top-level timestamp field is older than cutoff in one DELETE and return how many went
+        """
+        def delete_rows(db: sqlite3.Connection) -> int:
+            return db.execute(
+                "DELETE FROM kv WHERE namespace = ? AND json_extract(value, ?) < ?",
+                (self.name, f"$.{field}", cutoff)
+            ).rowcount
+        return await asyncio.to_thread(self.store.transaction, delete_rows)
+
+    async def update(self, key: str, func: Callable[[Optional[Any]], Any]) -> Any:
+        """
+        Replace the value for key with func(current value or None) and return it, atomically
+        """
+        def update_row(db: sqlite3.Connection) -> Any:
+            row = db.execute("SELECT value FROM kv WHERE namespace = ? AND key = ?", (self.name, key)).fetchone()
+            value = func(json.loads(row[0]) if row is not None else None)
+            db.execute(
+                "INSERT OR REPLACE INTO kv (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                (self.name, key, json.dumps(value), time.time())
+            )
+            return value
+        return await asyncio.to_thread(self.store.transaction, update_row)
+
+class _FetchedCursor:
+    """
+    Rows fetched under the store lock, with the cursor methods callers use
+    """
+
+    def __init__(self, rows: List[Tuple]):
+        self._rows = rows
+
+    def fetchone(self) -> Optional[Tuple]:
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self) -> List[Tuple]:
+        return self._rows
+
+class SharedStore:
+    """
+    State shared between worker processes, kept in SQLite in WAL mode on local disk.
+
+    WAL lets every worker read while one writes, and each write is a short
+    transaction. It holds keyed JSON namespaces (rate limits, conversations),
+    a shared response-cache tier behind each worker's in-memory LRU, and the
+    latest metrics snapshot from each worker. Every process opens its own
+    connection on first use; calls are serialized per process by a lock so
+    the connection can be used from the event loop and worker threads alike.
+    """
+
+    def __init__(self, path: str, cache_max_bytes: int = SHARED_CACHE_MAX_BYTES):
+        self.path = path
+        self.cache_max_bytes = cache_max_bytes
+        self._db: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._cache_writes = 0
+        self.counters = {
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "cache_writes": 0,
+            "cache_evictions": 0,
+            "errors": 0
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections must not cross a fork, so reconnect in each process
+        if self._db is not None and self._pid == os.getpid():
+            return self._db
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=SHARED_STATE_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            "namespace TEXT, key TEXT, value TEXT, updated_at REAL, PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, meta TEXT, body BLOB, body_type TEXT, size INTEGER, last_access REAL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)")
+        db.execute("CREATE TABLE IF NOT EXISTS metrics (worker INTEGER PRIMARY KEY, snapshot TEXT, updated_at REAL)")
+        self._db = db
+        self._pid = os.getpid()
+        return db
+
+    def execute(self, sql: str, params: Tuple = ()) -> _FetchedCursor:
+        with self._lock:
+            cursor = self._connect().execute(sql, params)
+            # Materialize rows while holding the lock
+            return _FetchedCursor(cursor.fetchall())
+
+    def transaction(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        """
+        Run func(connection) inside an immediate transaction and return its result
+        """
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(db)
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+            return result
+
+    def namespace(self, name: str) -> SharedNamespace:
+        return SharedNamespace(self, name)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None and self._pid == os.getpid():
+                self._db.close()
+            self._db = None
+
+    # Shared cache tier
+
+    async def cache_load(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            entry = await asyncio.to_thread(self._cache_load_sync, key)
+        except sqlite3.Error as e:
+            self.counters["errors"] += 1
+            logger.warning(f"Shared cache read failed: {str(e)}")
+            return None
+        self.counters["cache_hits" if entry is not None else "cache_misses"] += 1
+        return entry
+
+    def _cache_load_sync(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            db = self._connect()
+            row = db.execute("SELECT meta, body, body_type, last_access FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            meta, body, body_type, last_access = row
+            now = time.time()
+            if now - last_access > SHARED_CACHE_TOUCH_INTERVAL:
+                db.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+        entry = json.loads(meta)
+        if body_type == "str":
+            entry["body"] = body.decode("utf-8")
+        elif body_type == "bytes":
+            entry["body"] = bytes(body)
+        else:
+            entry["body"] = None
+        return entry
+
+    async def cache_store(self, key: str, entry: Dict[str, Any]) -> None:
+        try:
+            await asyncio.to_thread(self._cache_store_sync, key, entry)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self.counters["errors"] += 1
+            logger.warning(f"Shared cache write failed: {str(e)}")
+
+    def _cache_store_sync(self, key: str, entry: Dict[str, Any]) -> None:
+        body = entry.get("body")
+        meta = json.dumps({name: value for name, value in entry.items() if name != "body"})
+        if body is None:
+            body_type, payload = "none", b""
+        elif isinstance(body, str):
+            body_type, payload = "str", body.encode("utf-8")
+        else:
+            body_type, payload = "bytes", bytes(body)
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO cache (key, meta, body, body_type, size, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, meta, payload, body_type, len(payload) + len(meta), time.time())
+            )
+            self.counters["cache_writes"] += 1
+            self._cache_writes += 1
+            if self._cache_writes % SHARED_CACHE_TRIM_EVERY == 0:
+                self._trim_cache(db)
+
+    def _trim_cache(self, db: sqlite3.Connection) -> None:
+        # Drop least recently used rows until the tier is back under budget
+        total = db.execute("SELECT TOTAL(size) FROM cache").fetchone()[0]
+        if total <= self.cache_max_bytes:
+            return
+        excess = total - self.cache_max_bytes
+        removed = 0
+        keys = []
+        for key, size in db.execute("SELECT key, size FROM cache ORDER BY last_access"):
+            keys.append(key)
+            removed += size
+            if removed >= excess:
+                break
+        db.executemany("DELETE FROM cache WHERE key = ?", [(key,) for key in keys])
+        self.counters["cache_evictions"] += len(keys)
+
+    async def cache_discard(self, key: str) -> None:
+        try:
+            await asyncio.to_thread(self.execute, "DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            self.counters["errors"] += 1
+            logger.warning(f"Shared cache delete failed: {str(e)}")
+
+    async def cache_clear(self) -> int:
+        def clear(db: sqlite3.Connection) -> int:
+            count = db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            db.execute("DELETE FROM cache")
+            return count
+        return await asyncio.to_thread(self.transaction, clear)
+
+    # Metrics snapshots
+
+    def publish_metrics(self, snapshot: Dict[str, Any]) -> None:
+        self.execute(
+            "INSERT OR REPLACE INTO metrics (worker, snapshot, updated_at) VALUES (?, ?, ?)",
+            (os.getpid(), json.dumps(snapshot), time.time())
+        )
+
+    def worker_metrics(self, max_age: float) -> List[Dict[str, Any]]:
+        """
+        Latest snapshot from every worker that published within max_age seconds
+        """
+        cutoff = time.time() - max_age
+        self.execute("DELETE FROM metrics WHERE updated_at < ?", (cutoff,))
+        rows = self.execute("SELECT snapshot FROM metrics").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        row = self.execute("SELECT COUNT(*), TOTAL(size) FROM cache").fetchone()
+        return {
+            "path": self.path,
+            "cache_entries": row[0],
+            "cache_bytes": int(row[1]),
+            "cache_max_bytes": self.cache_max_bytes,
+            **self.counters
+        }
+
+# Helper function to publish this worker's metrics at an interval so any worker can serve the merged view
+async def publish_metrics_periodically(snapshot: Callable[[], List[Dict[str, Any]]], interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(store.publish_metrics, snapshot())
+        except Exception as e:
+            logger.warning(f"Failed to publish worker metrics: {str(e)}")
+
+# The store shared by this process's routers, or None when state is process-local
+store: Optional[SharedStore] = SharedStore(SHARED_STATE_PATH) if SHARED_STATE_PATH else None
+
+# Helper function to get a keyed store that is shared across workers when configured
+def namespace(name: str):
+    if store is not None:
+        return store.namespace(name)
+    return LocalNamespace(name)
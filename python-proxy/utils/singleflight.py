@@ -0,0 +1,66 @@
+import asyncio
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into a single execution.
+
+    The first caller for a key starts the work as its own task; callers that
+    arrive while it is running wait on that task instead of starting another.
+    Every caller, the first one included, waits through asyncio.shield with its
+    own timeout, so a caller timing out or being cancelled never cancels the
+    shared work for the others. Results and exceptions are delivered to all.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.counters = {
+            "leaders": 0,
+            "coalesced": 0,
+            "errors": 0,
+            "waiter_timeouts": 0
+        }
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._calls
+
+    async def do(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Any]],
+        timeout: Optional[float] = None
+    ) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            self.counters["leaders"] += 1
+            task.add_done_callback(lambda done, key=key: self._finish(key, done))
+        else:
+            self.counters["coalesced"] += 1
+
+        try:
+            if timeout is None:
+                return await asyncio.shield(task)
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            if not task.done():
+                self.counters["waiter_timeouts"] += 1
+            raise
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self.counters["errors"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._calls),
+            **self.counters
+        }
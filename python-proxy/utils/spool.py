@@ -0,0 +1,137 @@
+import json
+import codecs
+import asyncio
+import tempfile
+from typing import Dict, Any, Optional, List, IO
+
+# Memory held by buffered bodies, reported by the proxy stats endpoint
+buffer_metrics = {
+    "in_flight": 0,
+    "buffered_bytes": 0,
+    "peak_buffered_bytes": 0,
+    "peak_request_bytes": 0,
+    "spilled": 0,
+    "spilled_bytes": 0,
+    "rejected": 0
+}
+
+class BodyTooLarge(Exception):
+    """
+    Raised when a request or response body crosses the configured size limit
+    """
+
+    def __init__(self, size: int, limit: int):
+        super().__init__(f"Body of {size} bytes exceeds the limit of {limit} bytes")
+        self.size = size
+        self.limit = limit
+
+# Helper function to reject a body as soon as its declared or counted size crosses the limit
+def check_body_size(size: int, limit: int) -> None:
+    if size > limit:
+        buffer_metrics["rejected"] += 1
+        raise BodyTooLarge(size, limit)
+
+# Helper function to read a Content-Length header, ignoring missing or malformed values
+def declared_length(headers) -> Optional[int]:
+    value = headers.get("content-length")
+    if value and value.strip().isdigit():
+        return int(value)
+    return None
+
+class SpooledBody:
+    """
+    Body buffered in memory up to a threshold, then spilled to a temporary file.
+
+    Bytes held in memory are tracked in buffer_metrics while the body is open,
+    including the largest buffer any single request has needed. Writes past
+    max_size raise BodyTooLarge. Call close() when done with the body.
+    """
+
+    def __init__(self, threshold: int, max_size: int, directory: Optional[str] = None):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.directory = directory
+        self.size = 0
+        self.file: Optional[IO[bytes]] = None
+        self._chunks: List[bytes] = []
+        self._buffered = 0
+        self._open = True
+        buffer_metrics["in_flight"] += 1
+
+    @property
+    def spilled(self) -> bool:
+        return self.file is not None
+
+    async def write(self, chunk: bytes) -> None:
+        check_body_size(self.size + len(chunk), self.max_size)
+        self.size += len(chunk)
+        if self.file is None and self._buffered + len(chunk) > self.threshold:
+            await asyncio.to_thread(self._spill)
+        if self.file is not None:
+            await asyncio.to_thread(self.file.write, chunk)
+            buffer_metrics["spilled_bytes"] += len(chunk)
+            return
+
+        self._chunks.append(chunk)
+        self._track(len(chunk))
+
+    def _track(self, delta: int) -> None:
+        self._buffered += delta
+        buffer_metrics["buffered_bytes"] += delta
+        if delta > 0:
+            buffer_metrics["peak_request_bytes"] = max(buffer_metrics["peak_request_bytes"], self._buffered)
+            buffer_metrics["peak_buffered_bytes"] = max(buffer_metrics["peak_buffered_bytes"], buffer_metrics["buffered_bytes"])
+
+    def _spill(self) -> None:
+        self.file = tempfile.NamedTemporaryFile(prefix="proxy-body-", dir=self.directory)
+        self.file.writelines(self._chunks)
+        buffer_metrics["spilled"] += 1
+        buffer_metrics["spilled_bytes"] += self._buffered
+        self._chunks = []
+        self._track(-self._buffered)
+
+    def getvalue(self) -> bytes:
+        """
+        Return an in-memory body as bytes
+        """
+        if self.file is not None:
+            raise ValueError("Body was spilled to disk")
+        return b"".join(self._chunks)
+
+    def close(self) -> None:
+        if not self._open:
+            return
+        self._open = False
+        buffer_metrics["in_flight"] -= 1
+        self._chunks = []
+        self._track(-self._buffered)
+        if self.file is not None:
+            self.file.close()
+
+def write_json_envelope(envelope: Dict[str, Any], body: SpooledBody, charset: str, directory: Optional[str] = None) -> IO[bytes]:
+    """
+    Write a JSON envelope whose "body" field is the decoded spilled body, a chunk at a time.
+
+    The returned temporary file is deleted when the file object is closed or
+    garbage collected, so keep a reference until it has been sent.
+    """
+    try:
+        decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    out = tempfile.NamedTemporaryFile(prefix="proxy-envelope-", dir=directory)
+    fields = {name: value for name, value in envelope.items() if name != "body"}
+    head = json.dumps({**fields, "body": ""})
+    # Everything up to the closing quote of the empty body string
+    out.write(head[:-2].encode("utf-8"))
+    body.file.seek(0)
+    while True:
+        chunk = body.file.read(65536)
+        if not chunk:
+            break
+        out.write(json.dumps(decoder.decode(chunk))[1:-1].encode("utf-8"))
+    out.write(json.dumps(decoder.decode(b"", final=True))[1:-1].encode("utf-8"))
+    out.write(b'"}')
+    out.flush()
+    return out
@@ -0,0 +1,188 @@
+import asyncio
+from typing import Dict, Any, List, Optional
+
+# Response headers describing the upstream transfer, which no longer apply once the body is decoded
+TRANSFER_HEADERS = ("content-encoding", "content-length")
+
+# Helper function to get the headers to relay with a decoded body
+def decoded_body_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    return {name: value for name, value in headers.items() if name.lower() not in TRANSFER_HEADERS}
+
+class FillAbandoned(Exception):
+    """
+    Raised to readers of a fill that stopped being copied into the cache; offset
+    is how many body bytes the reader had already been given
+    """
+
+    def __init__(self, reason: str, offset: int = 0):
+        super().__init__(reason)
+        self.reason = reason
+        self.offset = offset
+
+class CacheFill:
+    """
+    A streamed response that is copied into a buffer while it is relayed.
+
+    The request fetching it from upstream is the writer: it publishes the
+    status and headers, then appends each chunk as it forwards it. Readers
+    of the same cache key that arrive meanwhile follow the writer instead of
+    going upstream: they replay the chunks buffered so far, then wait for new
+    ones. Readers only follow responses the writer marks followable, ones
+    the cache would hand to any client. The buffer holds at most max_bytes;
+    a response that turns out larger or a transfer that does not complete
+    abandons the fill, and readers that are following it get FillAbandoned
+    carrying their offset so they can fetch the rest of the body themselves.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.status: Optional[int] = None
+        self.headers: Optional[Dict[str, str]] = None
+        self.upstream_headers: Optional[Dict[str, str]] = None
+        self.chunks: List[bytes] = []
+        self.size = 0
+        self.followable = False
+        self.done = False
+        self.error: Optional[Exception] = None
+        self._changed = asyncio.get_running_loop().create_future()
+
+    def _notify(self) -> None:
+        if not self._changed.done():
+            self._changed.set_result(None)
+        self._changed = asyncio.get_running_loop().create_future()
+
+    async def _wait(self) -> None:
+        await asyncio.shield(self._changed)
+
+    @property
+    def active(self) -> bool:
+        return not self.done and self.error is None
+
+    def start(self, status: int, headers: Dict[str, str], followable: bool) -> None:
+        """
+        Publish the response head; readers only follow responses marked followable.
+        Chunks are decoded, so readers get the headers without the transfer ones,
+        while upstream_headers keeps them for storing and resuming the body
+        """
+        self.status = status
+        self.upstream_headers = headers
+        self.headers = decoded_body_headers(headers)
+        self.followable = followable
+        self._notify()
+
+    def append(self, chunk: bytes) -> bool:
+        """
+        Buffer a chunk, abandoning the fill and returning False once it no longer fits
+        """
+        if not self.active:
+            return False
+        if self.size + len(chunk) > self.max_bytes:
+            self.fail(FillAbandoned(f"response is larger than {self.max_bytes} bytes"))
+            return False
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self._notify()
+        return True
+
+    def finish(self) -> None:
+        if self.active:
+            self.done = True
+            self._notify()
+
+    def fail(self, error: Exception) -> None:
+        if self.active:
+            self.error = error
+            self.chunks = []
+            self._notify()
+
+    def body(self) -> bytes:
+        return b"".join(self.chunks)
+
+    async def wait_started(self) -> None:
+        """
+        Wait for the response head; raises if the fill is abandoned first or may not be followed
+        """
+        while self.status is None and self.error is None:
+            await self._wait()
+        if self.error is not None:
+            raise self.error
+        if not self.followable:
+            raise FillAbandoned("response may not be shared")
+
+    async def follow(self):
+        """
+        Yield the body from its first byte, waiting for the writer as needed
+        """
+        index = 0
+        offset = 0
+        while True:
+            if self.error is not None:
+                raise FillAbandoned(str(self.error), offset)
+            if index < len(self.chunks):
+                index += 1
+                offset += len(self.chunks[index - 1])
+                yield self.chunks[index - 1]
+            elif self.done:
+                return
+            else:
+                await self._wait()
+
+class StreamFills:
+    """
+    The fills in progress, at most one per cache key
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._fills: Dict[str, CacheFill] = {}
+        self.counters = {
+            "writers": 0,
+            "followers": 0,
+            "follower_fallbacks": 0,
+            "follower_resumes": 0,
+            "completed": 0,
+            "completed_bytes": 0,
+            "uncacheable": 0,
+            "too_large": 0,
+            "abandoned": 0
+        }
+
+    def __len__(self) -> int:
+        return len(self._fills)
+
+    def get(self, key: str) -> Optional[CacheFill]:
+        return self._fills.get(key)
+
+    def begin(self, key: str) -> Optional[CacheFill]:
+        """
+        Register a new fill for key, or return None when one is already running
+        """
+        if key in self._fills:
+            return None
+        fill = CacheFill(self.max_bytes)
+        self._fills[key] = fill
+        self.counters["writers"] += 1
+        return fill
+
+    def detach(self, key: str, fill: CacheFill) -> None:
+        """
+        Stop offering a fill to new readers; the writer may still complete it
+        """
+        if self._fills.get(key) is fill:
+            del self._fills[key]
+
+    def end(self, key: str, fill: CacheFill) -> None:
+        """
+        Unregister a fill, abandoning it if the writer did not finish it; safe to call more than once
+        """
+        self.detach(key, fill)
+        if fill.active:
+            fill.fail(FillAbandoned("transfer did not complete"))
+            self.counters["abandoned"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_progress": len(self._fills),
+            "max_bytes": self.max_bytes,
+            **self.counters
+        }
@@ -0,0 +1,177 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from urllib.parse import urljoin
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Tuple
+from utils.prefetch import SubresourceScanner
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("warmup")
+
+# Failures kept on a job's status for troubleshooting
+MAX_JOB_ERRORS = 20
+
+# Seconds between progress updates published while a job runs
+PUBLISH_INTERVAL = 1.0
+
+def build_games_manifest(games_dir: str, base_url: Optional[str] = None, max_urls_per_page: int = 200) -> Dict[str, Any]:
+    """
+    List the URLs worth warming for the game pages under games_dir.
+
+    Every .html page is scanned for the scripts, stylesheets, preloads and
+    images it loads. Absolute http(s) references are always kept; with
+    base_url (the site root the pages are served from), the pages themselves
+    and their relative references are included too.
+    """
+    urls: Dict[str, None] = {}
+    pages = 0
+    for root, _, files in os.walk(games_dir):
+        for name in sorted(files):
+            if not name.lower().endswith((".html", ".htm")):
+                continue
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, os.path.dirname(games_dir)).replace(os.sep, "/")
+            # Without a site root, relative references resolve to file: URLs and are skipped
+            page_url = urljoin(base_url, relative) if base_url else "file:///" + relative
+            try:
+                with open(path, "rb") as page:
+                    content = page.read()
+            except OSError as e:
+                logger.warning(f"Skipping {path} in the warm-up manifest: {str(e)}")
+                continue
+            pages += 1
+            if base_url:
+                urls[page_url] = None
+            scanner = SubresourceScanner(page_url, "utf-8", max_urls_per_page, len(content) + 1)
+            scanner.feed_bytes(content)
+            for url, _ in scanner.take_new():
+                urls[url] = None
+    return {
+        "generated_at": time.time(),
+        "source": os.path.basename(os.path.normpath(games_dir)),
+        "base_url": base_url,
+        "pages": pages,
+        "urls": list(urls)
+    }
+
+class TokenBucket:
+    """
+    Byte-rate limiter shared by the fetches of a warm-up job.
+
+    Fetches report their size after the fact; once the bucket is overdrawn
+    the caller sleeps until the average rate is back under `rate` bytes per
+    second. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    async def consume(self, amount: int) -> None:
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= amount
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+# Fetch callback: url -> (outcome counter, bytes transferred)
+WarmFetch = Callable[[str], Awaitable[Tuple[str, int]]]
+
+class WarmJob:
+    """
+    One background cache warm-up over a list of URLs.
+
+    Up to `concurrency` workers take URLs in order. Each waits on the gate
+    (which holds warm-up back while live traffic is busy), fetches the URL and
+    then pays its bytes into the shared TokenBucket. Progress snapshots are
+    handed to `publish` at most every PUBLISH_INTERVAL seconds and when the
+    job ends, so any worker process can report on it.
+    """
+
+    def __init__(self, urls: List[str], concurrency: int, publish: Callable[[Dict[str, Any]], Awaitable[None]]):
+        self.id = uuid.uuid4().hex[:12]
+        self.urls = urls
+        self.concurrency = max(1, concurrency)
+        self.publish = publish
+        self.state = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.errors: List[Dict[str, str]] = []
+        self.counters = {
+            "total": len(urls),
+            "done": 0,
+            "fetched": 0,
+            "already_cached": 0,
+            "uncacheable": 0,
+            "failed": 0,
+            "bytes": 0
+        }
+        self._published_at = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = (self.finished_at or time.time()) - self.started_at if self.started_at else 0.0
+        return {
+            "job_id": self.id,
+            "state": self.state,
+            "pid": os.getpid(),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "concurrency": self.concurrency,
+            **self.counters,
+            "progress": self.counters["done"] / max(1, self.counters["total"]),
+            "bytes_per_second": self.counters["bytes"] / elapsed if elapsed > 0 else 0.0,
+            "errors": list(self.errors)
+        }
+
+    async def _report(self, force: bool = False) -> None:
+        now = time.time()
+        if force or now - self._published_at >= PUBLISH_INTERVAL:
+            self._published_at = now
+            try:
+                await self.publish(self.snapshot())
+            except Exception as e:
+                logger.warning(f"Could not publish warm-up progress for {self.id}: {str(e)}")
+
+    async def run(self, fetch: WarmFetch, gate: Callable[[str], Awaitable[None]], bucket: TokenBucket) -> None:
+        self.state = "running"
+        self.started_at = time.time()
+        await self._report(force=True)
+        pending = iter(self.urls)
+
+        async def worker():
+            for url in pending:
+                await gate(url)
+                try:
+                    outcome, size = await fetch(url)
+                    self.counters[outcome] += 1
+                    self.counters["bytes"] += size
+                    await bucket.consume(size)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.counters["failed"] += 1
+                    if len(self.errors) < MAX_JOB_ERRORS:
+                        self.errors.append({"url": url, "error": str(e) or type(e).__name__})
+                self.counters["done"] += 1
+                await self._report()
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, max(1, len(self.urls))))))
+            self.state = "completed"
+        except asyncio.CancelledError:
+            self.state = "cancelled"
+        finally:
+            self.finished_at = time.time()
+            await self._report(force=True)
+            logger.info(f"Cache warm-up {self.id} {self.state}: {self.counters}")
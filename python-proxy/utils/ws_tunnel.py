@@ -0,0 +1,167 @@
+import time
+import asyncio
+import logging
+from typing import Any, Optional, Union
+import websockets
+from starlette.websockets import WebSocket, WebSocketState
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("ws_tunnel")
+
+# Totals across all tunnels, reported by the proxy stats endpoint
+tunnel_metrics = {
+    "active": 0,
+    "opened": 0,
+    "closed": 0,
+    "bytes_up": 0,
+    "bytes_down": 0,
+    "idle_timeouts": 0,
+    "byte_limit_closes": 0,
+    "errors": 0
+}
+
+# Close codes that are only reported locally and may not be sent in a close frame
+RESERVED_CLOSE_CODES = {1005, 1006, 1015}
+
+# Helper function to turn a received close code into one that may be sent on
+def sendable_close_code(code: Optional[int]) -> int:
+    if not code or code in RESERVED_CLOSE_CODES:
+        return 1000
+    return code
+
+class WebSocketTunnel:
+    """
+    Relay frames between a client WebSocket and an upstream WebSocket.
+
+    Each direction forwards one frame at a time and waits for the send to
+    finish before reading the next, so a slow reader pushes back on the
+    writer instead of frames piling up in the proxy. The upstream connection
+    itself buffers at most max_queue frames of bounded size. The tunnel is
+    closed after idle_timeout seconds without traffic in either direction, or
+    once max_bytes have been relayed in total.
+    """
+
+    def __init__(self, client: WebSocket, upstream: Any, idle_timeout: float, max_bytes: int):
+        self.client = client
+        self.upstream = upstream
+        self.idle_timeout = idle_timeout
+        self.max_bytes = max_bytes
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.opened_at = time.time()
+        self.last_activity = time.monotonic()
+        self.close_code = 1000
+        self.close_reason = ""
+        self._tasks = []
+        self._finished = asyncio.Event()
+
+    async def run(self) -> None:
+        tunnel_metrics["active"] += 1
+        tunnel_metrics["opened"] += 1
+        self._tasks = [
+            asyncio.ensure_future(self._client_to_upstream()),
+            asyncio.ensure_future(self._upstream_to_client()),
+            asyncio.ensure_future(self._watch_idle())
+        ]
+        try:
+            # The first direction to finish ends the tunnel
+            done, _ = await asyncio.wait(self._tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    logger.error(f"WebSocket tunnel error: {str(task.exception())}")
+                    tunnel_metrics["errors"] += 1
+                    self.close_code = 1011
+                    self.close_reason = "Upstream error"
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self._close_both()
+            tunnel_metrics["active"] -= 1
+            tunnel_metrics["closed"] += 1
+            self._finished.set()
+
+    async def aclose(self, code: int = 1001, reason: str = "Server shutting down") -> None:
+        """
+        Close both sides and wait for the tunnel to finish
+        """
+        self.close_code = code
+        self.close_reason = reason
+        for task in self._tasks:
+            task.cancel()
+        try:
+            await asyncio.wait_for(self._finished.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            logger.warning("WebSocket tunnel did not close in time")
+
+    def _count(self, data: Union[str, bytes], upstream_bound: bool) -> bool:
+        """
+        Account for a relayed frame; returns False once the tunnel is over its byte limit
+        """
+        size = len(data)
+        if upstream_bound:
+            self.bytes_up += size
+            tunnel_metrics["bytes_up"] += size
+        else:
+            self.bytes_down += size
+            tunnel_metrics["bytes_down"] += size
+        self.last_activity = time.monotonic()
+        if self.bytes_up + self.bytes_down > self.max_bytes:
+            tunnel_metrics["byte_limit_closes"] += 1
+            self.close_code = 1008
+            self.close_reason = "Tunnel byte limit reached"
+            return False
+        return True
+
+    async def _client_to_upstream(self) -> None:
+        while True:
+            message = await self.client.receive()
+            if message["type"] == "websocket.disconnect":
+                self.close_code = sendable_close_code(message.get("code"))
+                return
+            data = message.get("bytes")
+            if data is None:
+                data = message.get("text")
+            if data is None:
+                continue
+            if not self._count(data, upstream_bound=True):
+                return
+            await self.upstream.send(data)
+
+    async def _upstream_to_client(self) -> None:
+        try:
+            async for data in self.upstream:
+                if not self._count(data, upstream_bound=False):
+                    return
+                if isinstance(data, bytes):
+                    await self.client.send_bytes(data)
+                else:
+                    await self.client.send_text(data)
+        except websockets.ConnectionClosed:
+            pass
+        self.close_code = sendable_close_code(self.upstream.close_code)
+        self.close_reason = self.upstream.close_reason or ""
+
+    async def _watch_idle(self) -> None:
+        while True:
+            remaining = self.last_activity + self.idle_timeout - time.monotonic()
+            if remaining <= 0:
+                tunnel_metrics["idle_timeouts"] += 1
+                self.close_code = 1000
+                self.close_reason = "Idle timeout"
+                return
+            await asyncio.sleep(remaining)
+
+    async def _close_both(self) -> None:
+        reason = self.close_reason[:120]
+        try:
+            await self.upstream.close(code=self.close_code, reason=reason)
+        except Exception as e:
+            logger.debug(f"Error closing upstream WebSocket: {str(e)}")
+        if self.client.application_state != WebSocketState.DISCONNECTED \
+                and self.client.client_state != WebSocketState.DISCONNECTED:
+            try:
+                await self.client.close(code=self.close_code, reason=reason)
+            except Exception as e:
+                logger.debug(f"Error closing client WebSocket: {str(e)}")